@@ -0,0 +1,4 @@
+#
+# pianosouls benchmarks, run from the repository root with
+# python -m benchmarks.<name>
+#
@@ -0,0 +1,73 @@
+#
+# bench_glissando.py
+# Per-event dispatch cost during an 88-key glissando with the sustain pedal
+# down, and of the pedal release ending it. With flat per-event cost, the
+# time per event doesn't grow with the number of notes sustained.
+#
+# Run from the repository root:
+# python -m benchmarks.bench_glissando
+#
+
+import os
+import tempfile
+import time
+
+from pianosouls import pianosouls, matcher, config, actions, nullpad
+
+# Glissandi played per run
+RUNS = 50
+
+CONFIG = '''
+C4          A
+E, B        LY+
+F#dim       LT
+Cm7         Back
+GM7         LY-
+B, D#       RB
+A0          Start
+'''
+
+def setup() -> None:
+    ''' Load the benchmark config with nullpad as the output API '''
+    fd, path = tempfile.mkstemp(suffix = '.conf')
+    os.write(fd, CONFIG.encode())
+    os.close(fd)
+    bindings = config.read_config(path)
+    os.remove(path)
+
+    nullpad.LOG = None
+    pianosouls.apimod = nullpad
+    actions.apimod = nullpad
+    pianosouls.BINDINGS = matcher.resolve(
+        matcher.compile_bindings(bindings), actions.compile
+    )
+    pianosouls.CH_STATE = {1: pianosouls.MIDIChannelState()}
+
+def event(status:int, data1:int, data2:int) -> float:
+    ''' Dispatch one event, return the time it took in seconds '''
+    start = time.perf_counter()
+    pianosouls.update_event(status, data1, data2)
+    return time.perf_counter() - start
+
+def main():
+    setup()
+
+    # Time per event by number of notes sustained when it arrived
+    by_sustained = [0.0] * 89
+    pedal_release = 0.0
+    for run in range(RUNS):
+        event(0xB0, 64, 127)
+        for i, n in enumerate(range(21, 109)):
+            by_sustained[i] += event(0x90, n, 100)
+            by_sustained[i] += event(0x80, n, 0)
+        pedal_release += event(0xB0, 64, 0)
+
+    print(f'{"sustained notes":>16}{"us/event":>12}')
+    for low in range(0, 88, 11):
+        total = sum(by_sustained[low:low + 11])
+        per_event = total / (11 * 2 * RUNS) * 1e6
+        print(f'{f"{low}-{low + 10}":>16}{per_event:12.2f}')
+    print(f'{"pedal release":>16}{pedal_release / RUNS * 1e6:12.2f}')
+
+if __name__ == '__main__':
+    main()
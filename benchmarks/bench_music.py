@@ -0,0 +1,51 @@
+#
+# bench_music.py
+# Note name lookup tables against computing names on every call
+#
+# Run from the repository root:
+# python -m benchmarks.bench_music
+#
+
+from timeit import timeit
+
+from pianosouls import music
+
+# Timed runs per benchmark
+RUNS = 2000
+
+def bench(label:str, fn) -> float:
+    ''' Print and return the time per run of fn in microseconds '''
+    us = timeit(fn, number=RUNS) / RUNS * 1e6
+    print(f'{label:40}{us:10.1f} us/run')
+    return us
+
+def main():
+    notes = list(range(21, 109))
+    names = [music.get_note_name(n) for n in notes]
+
+    def computed_names():
+        for n in notes:
+            music._note_name(n)
+            music._note_name(n, False)
+    def table_names():
+        for n in notes:
+            music.get_note_name(n)
+            music.get_note_name(n, False)
+    def parsed_ids():
+        for n in names: music._parse_note_id(n.split('/')[0])
+    def cached_ids():
+        for n in names: music.get_note_id(n.split('/')[0])
+
+    per_call = len(notes) * 2
+    print(f'{per_call} get_note_name() calls per run')
+    old = bench('computed get_note_name()', computed_names)
+    new = bench('table get_note_name()', table_names)
+    print(f'speedup {old/new:.1f}x\n')
+
+    print(f'{len(names)} get_note_id() calls per run')
+    old = bench('parsed get_note_id()', parsed_ids)
+    new = bench('cached get_note_id()', cached_ids)
+    print(f'speedup {old/new:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#
+# compare.py
+# Compare two JSON baselines saved by benchmarks.suite, flagging results that
+# got worse by more than a threshold
+#
+# Run from the repository root:
+# python -m benchmarks.compare old.json new.json [-t 10]
+#
+# Exits with status 1 if anything regressed.
+#
+
+import json
+import optparse
+import sys
+
+from . import suite
+
+# Allowed slowdown in percent before a result counts as a regression
+THRESHOLD = 10.0
+# Differences smaller than this are noise, whatever the percentage: retained
+# bytes per event, for one, hover around 0
+MIN_DIFFERENCE = 0.05
+
+def load(path:str) -> dict:
+    ''' Return the results of a saved baseline '''
+    with open(path, 'r') as f:
+        baseline = json.load(f)
+    if baseline.get('version') != suite.VERSION:
+        raise ValueError(
+            f'{path} was saved by another version of the benchmark suite'
+        )
+    return baseline['results']
+
+def compare(old:dict, new:dict, threshold:float) -> list:
+    ''' Print results found in both, return the names of regressed ones '''
+    regressed = []
+    print(f'{"benchmark":36}{"old":>12}{"new":>12}{"change":>10}')
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name], new[name]
+        if before > 0:
+            change = (after - before) / before * 100
+        else:
+            change = 0.0 if after <= 0 else float('inf')
+        flag = ''
+        if change > threshold and after - before >= MIN_DIFFERENCE:
+            flag = '  REGRESSION'
+            regressed.append(name)
+        print(f'{name:36}{before:12.2f}{after:12.2f}{change:+9.1f}%{flag}')
+
+    for name in sorted(old.keys() ^ new.keys()):
+        print(f'{name:36} only in {"old" if name in old else "new"}')
+    return regressed
+
+def main():
+    parser = optparse.OptionParser(
+        usage = 'python -m benchmarks.compare [options] old.json new.json'
+    )
+    parser.add_option(
+        '-t', '--threshold',
+        action = 'store', type = 'float', dest = 'threshold',
+        default = THRESHOLD,
+        help = 'Percentage a result may get worse by, default ' +
+            str(THRESHOLD),
+    )
+    options, args = parser.parse_args()
+    if len(args) != 2: parser.error('Expected two baselines')
+
+    try:
+        regressed = compare(load(args[0]), load(args[1]), options.threshold)
+    except (OSError, ValueError) as err:
+        print(err)
+        sys.exit(2)
+
+    if len(regressed) > 0:
+        print(f'{len(regressed)} regressed by more than {options.threshold}%')
+        sys.exit(1)
+    print(f'No regressions over {options.threshold}%')
+
+if __name__ == '__main__':
+    main()
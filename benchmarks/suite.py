@@ -0,0 +1,181 @@
+#
+# suite.py
+# Scaling benchmarks for config parsing and event dispatch over synthetic
+# configs of 10 to 10,000 bindings, with nullpad as the output API. Results
+# are printed and can be saved as a JSON baseline for benchmarks.compare.
+#
+# Run from the repository root:
+# python -m benchmarks.suite [-o baseline.json] [--quick]
+#
+# Every result is a number where lower is better:
+#   parse/<size>                ms to read the config
+#   compile/<size>              ms to compile and resolve its bindings
+#   dispatch/<stream>/<size>    us per event through update_state()
+#   alloc/<stream>/<size>       peak bytes allocated per event
+#   retained/<stream>/<size>    bytes still allocated after the stream, per
+#                               event
+#
+
+import gc
+import json
+import optparse
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+from pianosouls import pianosouls, matcher, config, actions, arbiter, axes
+from pianosouls import scheduler, nullpad
+from . import synth
+
+# Format of saved results, bumped when the meaning of a result changes
+VERSION = 1
+
+SIZES = (10, 100, 1000, 10000)
+# Events per stream
+EVENTS = 5000
+# Timed repeats, the fastest one counts
+REPEATS = 5
+
+def timed(fn, repeats:int) -> float:
+    ''' Return the fastest of repeats runs of fn in seconds '''
+    best = float('inf')
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def reset(index:dict) -> None:
+    ''' Start over from nothing held with bindings index '''
+    actions.stop()
+    axes.stop()
+    arbiter.clear()
+    scheduler.clear()
+    pianosouls.PENDING.clear()
+    pianosouls.BINDINGS = index
+    pianosouls.CH_STATE = {
+        ch: pianosouls.MIDIChannelState() for ch in index
+    }
+
+def play(batches:list) -> None:
+    ''' Dispatch batches, running timed events as they'd be in a session '''
+    for batch in batches:
+        pianosouls.update_state(batch)
+        if scheduler.next_due() != None: scheduler.run()
+
+def bench_parse(size:int, repeats:int) -> tuple:
+    ''' Return (parsed bindings, parse ms, compile ms) for a config of size '''
+    fd, path = tempfile.mkstemp(suffix = '.conf')
+    os.write(fd, synth.config(size).encode())
+    os.close(fd)
+    try:
+        parse = timed(lambda: config.read_config(path), repeats)
+        bindings = config.read_config(path)
+    finally:
+        os.remove(path)
+
+    def compile_index():
+        matcher.resolve(matcher.compile_bindings(bindings), actions.compile)
+    return (bindings, parse * 1e3, timed(compile_index, repeats) * 1e3)
+
+def bench_stream(index:dict, batches:list, repeats:int) -> tuple:
+    ''' Return (us per event, peak bytes, retained bytes per event) '''
+    events = sum(len(b) for b in batches)
+
+    # Warm up lookup caches before anything is measured
+    reset(index)
+    play(batches)
+
+    def run():
+        reset(index)
+        play(batches)
+    dispatch = timed(run, repeats) / events * 1e6
+
+    reset(index)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    play(batches)
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (
+        dispatch, (peak - before) / events, max(after - before, 0) / events
+    )
+
+def run(sizes:tuple, events:int, repeats:int) -> dict:
+    ''' Run all benchmarks, return {name: value} '''
+    nullpad.LOG = None
+    pianosouls.apimod = nullpad
+    actions.apimod = nullpad
+    axes.apimod = nullpad
+
+    streams = {
+        name: generate(events) for name, generate in synth.STREAMS.items()
+    }
+    results = {}
+    for size in sizes:
+        # Large configs take long enough to parse to need fewer repeats
+        bindings, parse, compiling = bench_parse(
+            size, repeats if size <= 1000 else 1
+        )
+        results[f'parse/{size}'] = parse
+        results[f'compile/{size}'] = compiling
+        print(f'{size:>6} bindings  parse {parse:9.2f} ms  '
+            f'compile {compiling:9.2f} ms')
+
+        index = matcher.resolve(
+            matcher.compile_bindings(bindings), actions.compile
+        )
+        for name, batches in streams.items():
+            dispatch, alloc, retained = bench_stream(index, batches, repeats)
+            results[f'dispatch/{name}/{size}'] = dispatch
+            results[f'alloc/{name}/{size}'] = alloc
+            results[f'retained/{name}/{size}'] = retained
+            print(f'{"":>16}{name:12}{dispatch:9.2f} us/event '
+                f'{alloc:9.1f} B/event peak '
+                f'{retained:7.1f} B/event retained')
+
+    reset({})
+    return results
+
+def save(path:str, results:dict) -> None:
+    ''' Save results as a JSON baseline '''
+    with open(path, 'w') as f:
+        json.dump({
+            'version':  VERSION,
+            'python':   platform.python_version(),
+            'platform': platform.platform(),
+            'time':     time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results':  results,
+        }, f, indent = 2, sort_keys = True)
+        f.write('\n')
+
+def main():
+    parser = optparse.OptionParser(
+        usage = 'python -m benchmarks.suite [options]'
+    )
+    parser.add_option(
+        '-o', '--output',
+        action = 'store', type = 'string', dest = 'output',
+        help = 'Save results as a JSON baseline to OUTPUT',
+    )
+    parser.add_option(
+        '-q', '--quick',
+        action = 'store_true', dest = 'quick', default = False,
+        help = 'Fewer events and repeats, up to 1000 bindings',
+    )
+    options = parser.parse_args()[0]
+
+    if options.quick:
+        results = run(SIZES[:-1], EVENTS // 5, 2)
+    else:
+        results = run(SIZES, EVENTS, REPEATS)
+    if options.output != None:
+        save(options.output, results)
+        print('Saved', options.output)
+
+if __name__ == '__main__':
+    main()
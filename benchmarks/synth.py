@@ -0,0 +1,113 @@
+#
+# synth.py
+# Synthetic configs and MIDI event streams for the benchmark suite
+#
+# Everything is generated from a fixed random seed, so every run of the suite
+# measures the exact same input.
+#
+
+import random
+
+from pianosouls import music
+
+SEED = 1
+
+# Channels and devices bindings are spread over
+CHANNELS    = (1, 2, 3, 4)
+DEVICES     = (1, 2)
+
+ACTIONS = (
+    'A', 'B', 'X', 'Y', 'LB', 'RB', 'LT', 'RT', 'Start', 'Back',
+    'LX+', 'LX-', 'LY+', 'LY-', 'RX+', 'RX-', 'RY+', 'RY-',
+)
+LETTERS = ('C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B')
+CHORD_NAMES = tuple(music.CHORD_NAME_TO_RELATION)
+
+def config(size:int) -> str:
+    ''' Return a config of size bindings over several channels and devices '''
+    rng = random.Random(SEED)
+    lines = []
+    per_block = max(size // (len(CHANNELS) * len(DEVICES)), 1)
+    for i in range(size):
+        # Channel and device blocks, like a config for several instruments
+        if i % per_block == 0:
+            block = i // per_block
+            lines.append(f'Channel: {CHANNELS[block % len(CHANNELS)]}')
+            device = DEVICES[block // len(CHANNELS) % len(DEVICES)]
+            lines.append(f'Device: {device}')
+
+        kind = rng.random()
+        if kind < 0.4:
+            # Single note, on any octave or a specific one
+            trigger = rng.choice(LETTERS)
+            if rng.random() < 0.5: trigger += str(rng.randint(1, 6))
+        elif kind < 0.8:
+            # Named chord
+            trigger = rng.choice(LETTERS) + rng.choice(CHORD_NAMES)
+        else:
+            # Notes played together
+            trigger = ', '.join(rng.sample(LETTERS, rng.randint(2, 4)))
+        lines.append(f'{trigger:24}{rng.choice(ACTIONS)}')
+
+    return '\n'.join(lines) + '\n'
+
+def _event(status:int, data1:int, data2:int, ts:int) -> list:
+    ''' Return an event in the format of midi.read() '''
+    return [[status, data1, data2, 0], ts]
+
+def chords(events:int) -> list:
+    ''' Return batches of triads played and let go of on every channel '''
+    rng = random.Random(SEED)
+    batches = []
+    ts = 0
+    while sum(len(b) for b in batches) < events:
+        ch = rng.choice(CHANNELS) - 1
+        root = rng.randint(36, 84)
+        relations = rng.choice(tuple(music.CHORD_NAME_TO_RELATION.values()))
+        notes = [root] + [root + r for r in relations]
+        # All notes of a chord arrive in the same batch
+        ts += 40
+        batches.append([_event(0x90 | ch, n, 100, ts) for n in notes])
+        ts += 200
+        batches.append([_event(0x80 | ch, n, 0, ts) for n in notes])
+    return batches
+
+def glissandi(events:int) -> list:
+    ''' Return batches of 88-key glissandi with the sustain pedal down '''
+    batches = []
+    ts = 0
+    while sum(len(b) for b in batches) < events:
+        batches.append([_event(0xB0, 64, 127, ts)])
+        for n in range(21, 109):
+            ts += 10
+            batches.append([_event(0x90, n, 100, ts)])
+            batches.append([_event(0x80, n, 0, ts + 5)])
+        ts += 10
+        batches.append([_event(0xB0, 64, 0, ts)])
+    return batches
+
+def pedal_storm(events:int) -> list:
+    ''' Return batches of notes with the sustain pedal flapping up and down '''
+    rng = random.Random(SEED)
+    batches = []
+    ts = 0
+    while sum(len(b) for b in batches) < events:
+        ts += 5
+        batches.append([_event(0xB0, 64, rng.choice((0, 127)), ts)])
+        # Half-pedalling controllers send plenty of values in between
+        for i in range(rng.randint(1, 4)):
+            ts += 2
+            batches.append([_event(0xB0, 64, rng.randint(0, 127), ts)])
+        ts += 5
+        n = rng.randint(21, 108)
+        batches.append([_event(0x90, n, rng.randint(1, 127), ts)])
+        ts += rng.randint(1, 4)
+        batches.append([_event(0x80, n, 0, ts)])
+    return batches
+
+# Event streams by name
+STREAMS = {
+    'chords':       chords,
+    'glissandi':    glissandi,
+    'pedal_storm':  pedal_storm,
+}
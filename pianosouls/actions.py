@@ -0,0 +1,215 @@
+#
+# actions.py
+# pianosouls timed actions: fixed hold durations, turbo and macros
+#
+# Actions in config files may carry timing modifiers:
+#   A@200           Press A for 200 ms, no matter how long the notes are held
+#   A*15            Turbo, press and release A 15 times per second while held
+#   LB@40>~100>A    Macro, press LB for 40 ms, wait 100 ms, then press A for
+#                   the default step time. Steps are separated by ">".
+# Plain actions are passed to the output API module as they are. The steps
+# of timed actions hold their controls through the arbiter, each running
+# timed action being a holder of its own, so a turbo or hold letting go
+# never releases a control another binding still holds.
+#
+# "Layer=NAME" actions switch to another binding layer of the config instead
+# of sending anything.
+#
+# Action strings are resolved into Action records by the output API module
+# once, when the config is loaded, so nothing gets parsed while playing.
+#
+
+from . import scheduler
+
+# Output API module, set by pianosouls.main()
+apimod = None
+# Function switching to the binding layer of a name, set by pianosouls.main()
+switch_layer = None
+
+# Time in seconds a macro step without "@" is held for
+STEP_HOLD = 0.05
+# Time in seconds between macro steps, long enough for games to see a release
+STEP_GAP  = 1/60
+
+# Kinds of controls an Action can resolve to
+BUTTON  = 0
+AXIS    = 1
+TRIGGER = 2
+TIMED   = 3
+LAYER   = 4
+
+# Prefix of layer switching actions
+LAYER_PREFIX = 'LAYER='
+
+# Action of a binding resolved for one output device
+class Action:
+    __slots__ = (
+        'rid', 'name', 'kind', 'control', 'sign', 'values', 'timed'
+    )
+
+    def __init__(
+        self, rid:int, name:str, kind:int, control, values:tuple,
+        timed = None
+    ):
+        init = object.__setattr__
+        init(self, 'rid', rid)
+        # Action string as written in the config
+        init(self, 'name', name)
+        init(self, 'kind', kind)
+        # Button bit, report field, axis usage or such, up to the output API
+        # module. Layer name for layer switches.
+        init(self, 'control', control)
+        # -1 for actions ending in "-", 1 for "+", otherwise 0
+        init(self, 'sign', sign_of(name))
+        # Output value by MIDI velocity 0-127, up to the output API module
+        init(self, 'values', values)
+        # TimedAction with Action steps, for timed actions only
+        init(self, 'timed', timed)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Action records can\'t be changed')
+
+    def __repr__(self):
+        return f'Action({self.rid}, {self.name!r})'
+
+def sign_of(name:str) -> int:
+    ''' Return the sign of action string name as -1, 1 or 0 for no sign '''
+    if '-' in name: return -1
+    if '+' in name: return 1
+    return 0
+
+# Parsed timed action
+class TimedAction:
+    __slots__ = ('steps', 'turbo')
+
+    def __init__(self, steps:list, turbo:float = None):
+        # [(action, hold time in seconds), ...], action None for a pause.
+        # Actions are strings from parse() and Action records from compile().
+        self.steps = steps
+        # Turbo period in seconds
+        self.turbo = turbo
+
+# Parsed actions by action string, None for plain actions
+_parsed = {}
+# Running timed actions by (device, action string)
+_running = {}
+
+def parse(action:str) -> TimedAction:
+    ''' Return action parsed as a TimedAction, or None if it's plain '''
+    if action in _parsed: return _parsed[action]
+
+    timed = None
+    try:
+        if '*' in action:
+            base, rate = action.split('*')
+            if float(rate) > 0: timed = TimedAction([(base, 0)], 1/float(rate))
+        elif '@' in action or '>' in action or '~' in action:
+            steps = []
+            for step in action.split('>'):
+                if step[0:1] == '~':
+                    steps.append((None, int(step[1:]) / 1000))
+                elif '@' in step:
+                    base, hold = step.split('@')
+                    steps.append((base, int(hold) / 1000))
+                else:
+                    steps.append((step, STEP_HOLD))
+            timed = TimedAction(steps)
+    except ValueError:
+        # Let the output module decide what to do with it
+        timed = None
+
+    _parsed[action] = timed
+    return timed
+
+def compile(rid:int, name:str) -> Action:
+    ''' Resolve action string name on device rid into an Action record '''
+    global apimod
+
+    if name.startswith(LAYER_PREFIX):
+        return Action(rid, name, LAYER, name[len(LAYER_PREFIX):], ())
+
+    timed = parse(name)
+    # The output API module raises ValueError for actions it doesn't know
+    if timed == None: return apimod.compile_action(rid, name)
+
+    steps = []
+    for base, hold in timed.steps:
+        if base != None: base = apimod.compile_action(rid, base)
+        steps.append((base, hold))
+    return Action(rid, name, TIMED, None, (), TimedAction(steps, timed.turbo))
+
+def press(action:Action, value:int) -> None:
+    ''' Press action '''
+    global apimod, switch_layer
+
+    if action.kind == LAYER:
+        switch_layer(action.control)
+        return
+
+    timed = action.timed
+    key = (action.rid, action.name)
+    if timed == None:
+        apimod.update(action, value)
+    # Already running timed actions are not restarted
+    elif key in _running:
+        return
+    elif timed.turbo != None:
+        _turbo(key, timed, value, True)
+    else:
+        _step(key, timed, 0, value)
+
+def release(action:Action) -> None:
+    ''' Release action '''
+    global apimod
+
+    timed = action.timed
+    key = (action.rid, action.name)
+    if action.kind == LAYER:
+        return
+    elif timed == None:
+        apimod.update(action, 0)
+    # Turbo stops on release, holds and macros always run to completion
+    elif timed.turbo != None and key in _running:
+        event, pressed = _running.pop(key)
+        scheduler.cancel(event)
+        if pressed: arbiter.release(key, timed.steps[0][0])
+
+def stop() -> None:
+    ''' Forget all running timed actions '''
+    # Their holds are forgotten with arbiter.clear()
+    for event, *_ in _running.values(): scheduler.cancel(event)
+    _running.clear()
+
+def _turbo(key:tuple, timed:TimedAction, value:int, pressed:bool) -> None:
+    ''' Toggle a turbo action and schedule the next toggle '''
+    # Running timed actions hold their steps by their (device, action string)
+    if pressed:
+        arbiter.press(key, timed.steps[0][0], value)
+    else:
+        arbiter.release(key, timed.steps[0][0])
+    event = scheduler.call_later(
+        timed.turbo / 2, _turbo, key, timed, value, not pressed
+    )
+    _running[key] = (event, pressed)
+
+def _step(key:tuple, timed:TimedAction, i:int, value:int) -> None:
+    ''' Press step i of a hold or macro action '''
+    base, hold = timed.steps[i]
+    if base != None: arbiter.press(key, base, value)
+    event = scheduler.call_later(hold, _step_end, key, timed, i, value)
+    _running[key] = (event,)
+
+def _step_end(key:tuple, timed:TimedAction, i:int, value:int) -> None:
+    ''' Release step i of a hold or macro action and schedule the next one '''
+    base = timed.steps[i][0]
+    if base != None: arbiter.release(key, base)
+
+    if i + 1 == len(timed.steps):
+        del _running[key]
+        return
+    gap = STEP_GAP if base != None else 0
+    event = scheduler.call_later(gap, _step, key, timed, i + 1, value)
+    _running[key] = (event,)
+
+# The arbiter refers to Action when it's imported, so it comes last
+from . import arbiter
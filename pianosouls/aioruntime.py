@@ -0,0 +1,123 @@
+#
+# aioruntime.py
+# pianosouls asyncio runtime, selected with --runtime asyncio
+#
+# MIDI input, timed output events, config reloading, fixed rate output
+# flushing and hotkeys all run as tasks on one event loop, so output state is
+# only ever touched from the loop's thread. Blocking calls (waiting on
+# MIDI input, parsing configs) run in the loop's default thread executor, which
+# only ever needs a couple of threads.
+#
+
+import os.path
+import asyncio
+
+from . import pianosouls as core
+from . import cache
+from . import matcher
+from . import actions
+from . import stats
+from . import reloader
+from . import scheduler
+
+# Longest time in seconds a single executor call waits for MIDI input
+MIDI_WAIT = 0.1
+# Longest time in seconds the timer task sleeps when no events are scheduled
+TIMER_IDLE = 1.0
+# Interval in seconds at which hotkeys are checked
+HOTKEY_INTERVAL = 1/30
+
+def run(config_path:str, recorder = None) -> None:
+    ''' Run until interrupted '''
+    asyncio.run(_main(config_path, recorder))
+
+async def _wait(event:asyncio.Event, timeout:float) -> bool:
+    ''' Wait at most timeout seconds for event, True if it was set '''
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    was_set = event.is_set()
+    event.clear()
+    return was_set
+
+async def _main(config_path:str, recorder) -> None:
+    # Set when the timer task should look at the schedule again
+    timers_changed = asyncio.Event()
+    # Set to reload the config right away
+    reload_now = asyncio.Event()
+
+    tasks = [
+        _read_midi(recorder, timers_changed),
+        _run_timers(timers_changed),
+        _watch_config(config_path, reload_now, timers_changed),
+    ]
+    if core.OUTPUT_RATE != None: tasks.append(_flush_output())
+    if core.msvcrt != None: tasks.append(_read_hotkeys(reload_now))
+    await asyncio.gather(*tasks)
+
+async def _read_midi(recorder, timers_changed:asyncio.Event) -> None:
+    ''' Dispatch MIDI input as it arrives '''
+    loop = asyncio.get_running_loop()
+    while True:
+        if not await loop.run_in_executor(None, core.midi.wait, MIDI_WAIT):
+            continue
+        events = core.midi.read()
+        if recorder != None: recorder.write(events)
+        core.update_state(events)
+        # Dispatching may have scheduled timed events
+        timers_changed.set()
+
+async def _run_timers(timers_changed:asyncio.Event) -> None:
+    ''' Run timed output events when due '''
+    while True:
+        timeout = scheduler.timeout(TIMER_IDLE)
+        if timeout > 0: await _wait(timers_changed, timeout)
+        if scheduler.run() > 0 and core.OUTPUT_RATE == None:
+            core.flush_output()
+
+async def _flush_output() -> None:
+    ''' Flush output at the fixed rate given with --output-rate '''
+    while True:
+        await asyncio.sleep(core.OUTPUT_RATE)
+        core.flush_output()
+
+async def _watch_config(
+    path:str, reload_now:asyncio.Event, timers_changed:asyncio.Event
+) -> None:
+    ''' Reload the config when it changes, compiling it in the executor '''
+    loop = asyncio.get_running_loop()
+    mtime = os.path.getmtime(path)
+    while True:
+        forced = await _wait(reload_now, reloader.CHECK_INTERVAL)
+        try:
+            new_mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if new_mtime == mtime and not forced: continue
+        mtime = new_mtime
+
+        try:
+            new = (await loop.run_in_executor(
+                None, cache.load_bindings, path
+            ))[0]
+            matcher.resolve_layers(new, actions.compile)
+        except Exception as err:
+            print('Couldn\'t reload config', path, err)
+            continue
+        core.swap_layers(new)
+        timers_changed.set()
+        print('Reloaded config', path)
+
+async def _read_hotkeys(reload_now:asyncio.Event) -> None:
+    ''' R to reload config, S to print stats, 1-9 to switch layers '''
+    while True:
+        await asyncio.sleep(HOTKEY_INTERVAL)
+        while core.msvcrt.kbhit():
+            key = core.msvcrt.getch()
+            if key == b'r':
+                reload_now.set()
+            elif key == b's' and stats.ENABLED:
+                print(stats.report())
+            elif key.isdigit():
+                core.layer_hotkey(int(key))
@@ -0,0 +1,117 @@
+#
+# arbiter.py
+# pianosouls output arbitration between bindings holding the same control
+#
+# Every binding pressing an action becomes a holder of that action's control
+# on its device. A control is only released when its last holder lets go.
+# Buttons are pressed again by every new holder. Analog controls (axes and
+# triggers) held by several bindings at once get their value from MODE:
+#   LAST_WINS   The newest holder's value, falling back to the next newest
+#               one when it lets go
+#   MAX         The largest value of all holders
+#   SUM         All holders added up, opposite directions of an axis
+#               cancelling out, clamped to the largest value
+#
+
+from . import actions
+
+LAST_WINS   = 'last'
+MAX         = 'max'
+SUM         = 'sum'
+# Conflict resolution for analog controls, set with --conflict
+MODE = LAST_WINS
+
+# Holders by (device, kind, control): {holder: (Action, value)}, oldest
+# press first
+_held = {}
+# (Action, value) last sent for each (device, kind, control)
+_sent = {}
+
+def key_of(action:actions.Action) -> tuple:
+    ''' Return the (device, kind, control) key action is arbitrated by '''
+    # Timed actions are run by the actions module, which tells them apart by
+    # name, and layer switches have no control
+    if action.kind == actions.TIMED or action.kind == actions.LAYER:
+        return (action.rid, action.kind, action.name)
+    # Output modules may number buttons and axes from the same range, like
+    # vJoy button 48 and axis X (usage 0x30)
+    return (action.rid, action.kind, action.control)
+
+def press(holder, action:actions.Action, value:int) -> None:
+    ''' Press action on behalf of holder '''
+    global _held, _sent
+
+    key = key_of(action)
+    holders = _held.get(key)
+    if holders == None:
+        _held[key] = {holder: (action, value)}
+        _send(key, action, value)
+        return
+
+    # Pressing again moves the holder to the newest spot
+    holders.pop(holder, None)
+    holders[holder] = (action, value)
+    if action.kind == actions.AXIS or action.kind == actions.TRIGGER:
+        _send(key, *_resolve(holders))
+    else:
+        _send(key, action, value)
+
+def release(holder, action:actions.Action) -> None:
+    ''' Let go of action on behalf of holder, released if it was the last '''
+    global _held, _sent
+
+    key = key_of(action)
+    holders = _held.get(key)
+    if holders == None or not holder in holders: return
+
+    held_action = holders.pop(holder)[0]
+    if len(holders) == 0:
+        del _held[key]
+        _sent.pop(key, None)
+        actions.release(held_action)
+    elif action.kind == actions.AXIS or action.kind == actions.TRIGGER:
+        _send(key, *_resolve(holders))
+
+def invalidate(action:actions.Action) -> None:
+    ''' Forget the value last sent to the control of action, set elsewhere '''
+    global _sent
+    _sent.pop(key_of(action), None)
+
+def clear() -> None:
+    ''' Forget all holders '''
+    _held.clear()
+    _sent.clear()
+
+def _resolve(holders:dict) -> tuple:
+    ''' Return (Action, value) an analog control held by holders gets '''
+    global MODE
+
+    if MODE == MAX:
+        return max(holders.values(), key = lambda held: held[1])
+
+    newest = next(reversed(holders.values()))
+    if MODE == SUM:
+        total = 0
+        for action, value in holders.values():
+            total += -value if action.sign < 0 else value
+        # Sent through the newest holder pushing the way the total does
+        for action, value in reversed(holders.values()):
+            if (action.sign < 0) == (total < 0):
+                return (action, min(abs(total), 127))
+        return (newest[0], 0)
+
+    return newest
+
+def _send(key:tuple, action:actions.Action, value:int) -> None:
+    ''' Press action with value unless it's what the control already has '''
+    global _sent
+
+    # Buttons are pressed again on purpose, values of analog controls only
+    # when they change
+    if (
+        (action.kind == actions.AXIS or action.kind == actions.TRIGGER) and
+        _sent.get(key) == (action, value)
+    ):
+        return
+    _sent[key] = (action, value)
+    actions.press(action, value)
@@ -0,0 +1,149 @@
+#
+# axes.py
+# pianosouls analog axis engine for Control Change, pitch bend and channel
+# aftertouch bindings
+#
+# Continuous controls can send hundreds of messages a second. Each message
+# only moves the target value of its axes, and the values are sent to the
+# output API module at most once per AXIS_RATE tick from the scheduler, so a
+# flood of messages never turns into a flood of driver updates.
+#
+# Values passed to the output API module's update_analog() are floats:
+#   Signed actions (LX+, RY-)   0-1, how far along the direction
+#   Everything else (LX, RT, A) -1-1, position across the control's full
+#                               range, 0 being the middle
+#
+
+from . import scheduler
+from . import arbiter
+
+# Output API module, set by pianosouls.main()
+apimod = None
+
+# Shortest time in seconds between two updates of the same axis, set with
+# --axis-rate
+AXIS_RATE = 1/250
+# Smoothed values closer than this to their target snap to it
+EPSILON = 1/512
+
+# Control numbers of continuous triggers, CC0-CC127 are their own numbers
+PITCH_BEND  = 128
+AFTERTOUCH  = 129
+
+# Output state of a single (device, action)
+class Axis:
+    __slots__ = ('action', 'target', 'current', 'sent', 'smoothing')
+
+    def __init__(self, action):
+        # Latest Action record moving this axis
+        self.action     = action
+        # Shaped value the axis is moving towards
+        self.target     = 0.0
+        # Smoothed value, None until the first tick
+        self.current    = None
+        # Value last passed to the output API module
+        self.sent       = None
+        # Fraction of the distance to target left after each tick
+        self.smoothing  = 0.0
+
+# Axes by (device, action)
+_axes = {}
+# Scheduled tick, None if idle
+_tick_event = None
+# clock() time of the last tick
+_last_tick = float('-inf')
+
+def control_number(name:str) -> int:
+    ''' Return the control number of trigger name (CC1, PB, AT), or -1 '''
+    if name == 'PB': return PITCH_BEND
+    if name == 'AT': return AFTERTOUCH
+    if name[0:2] == 'CC' and name[2:].isdigit() and int(name[2:]) <= 127:
+        return int(name[2:])
+    return -1
+
+def shape(binding, raw:int, action) -> float:
+    ''' Return raw control value shaped by binding for action '''
+    # Pitch bend rests in the middle, other controls at 0
+    if binding.control == PITCH_BEND:
+        x = (raw - 8192) / (8192 if raw < 8192 else 8191)
+    else:
+        x = raw / 127
+    sign = -1 if x < 0 else 1
+    x = abs(x)
+
+    # Deadzone around the rest position, the rest of the travel is stretched
+    # to cover the whole range
+    dead = binding.deadzone
+    x = 0.0 if x <= dead else (x - dead) / (1 - dead)
+    # Response curve
+    if binding.curve != 1: x = x ** binding.curve
+    x *= sign
+
+    # Pitch bend pushes signed actions only on its own side of the middle,
+    # unipolar sources push them along their direction however it's signed
+    if binding.control == PITCH_BEND:
+        if action.sign != 0: return max(x * action.sign, 0.0)
+        return x
+    if action.sign != 0: return x
+    # Full range controls, unipolar sources sweep from one end to the other
+    return 2 * x - 1
+
+def feed(binding, raw:int) -> None:
+    ''' Move the axes of a continuous binding to raw control value '''
+    global _axes, _tick_event, _last_tick
+
+    changed = False
+    for action in binding.actions:
+        key = (action.rid, action.name)
+        axis = _axes.get(key)
+        if axis == None:
+            axis = Axis(action)
+            _axes[key] = axis
+        axis.action = action
+        value = shape(binding, raw, action)
+        axis.smoothing = binding.smoothing
+        # Repeated values don't cause updates
+        if value == axis.target and axis.current != None: continue
+        axis.target = value
+        changed = True
+
+    # First change after an idle period goes out right away, later ones wait
+    # for the next tick
+    if changed and _tick_event == None:
+        _tick_event = scheduler.call_at(
+            max(scheduler.clock(), _last_tick + AXIS_RATE), _tick
+        )
+
+def _tick() -> None:
+    ''' Send changed axis values, keep ticking while any is still smoothing '''
+    global apimod, _axes, _tick_event, _last_tick
+
+    _tick_event = None
+    _last_tick = scheduler.clock()
+    moving = False
+    for axis in _axes.values():
+        if axis.current == None or axis.smoothing == 0:
+            axis.current = axis.target
+        else:
+            axis.current += (1 - axis.smoothing) * (axis.target - axis.current)
+            if abs(axis.target - axis.current) < EPSILON:
+                axis.current = axis.target
+            else:
+                moving = True
+        if axis.current != axis.sent:
+            # Bindings holding the same control through the arbiter have to
+            # send their value again, it's been moved from under them
+            arbiter.invalidate(axis.action)
+            apimod.update_analog(axis.action, axis.current)
+            axis.sent = axis.current
+
+    if moving: _tick_event = scheduler.call_later(AXIS_RATE, _tick)
+
+def stop() -> None:
+    ''' Forget all axis state '''
+    global _axes, _tick_event, _last_tick
+
+    if _tick_event != None: scheduler.cancel(_tick_event)
+    _tick_event = None
+    _last_tick = float('-inf')
+    _axes.clear()
@@ -0,0 +1,127 @@
+#
+# cache.py
+# pianosouls parsed config cache
+#
+# Parsed bindings of all layers are stored next to the config file, in
+# <config>.psc, and compiled again when loaded. A cache file is only used if
+# it was written by the same VERSION of the parser from a config with the
+# exact same contents.
+#
+# The cache holds nothing but the plain data config.read_layers() returns, as
+# JSON. Anyone able to write next to a config can rebuild the header, so the
+# file is never trusted with anything a config itself couldn't say.
+#
+
+import os
+import time
+import json
+import hashlib
+
+from . import config
+from . import matcher
+
+# Bump whenever config parsing or the cached layout changes
+VERSION = 7
+
+MAGIC = b'PSC'
+
+def path_for(config_path:str) -> str:
+    ''' Return the cache file path for a config file '''
+    return config_path + '.psc'
+
+def _read(config_path:str) -> bytes:
+    ''' Return the contents of a config file '''
+    f = open(config_path, 'rb')
+    source = f.read()
+    f.close()
+    return source
+
+def _key(source:bytes) -> bytes:
+    ''' Return the cache header for config file contents '''
+    return MAGIC + bytes([VERSION]) + hashlib.sha256(source).digest()
+
+def _encode(parsed:tuple) -> bytes:
+    ''' Return config.read_layers() output as JSON '''
+    # JSON has neither tuples nor integer keys, so dicts become lists of
+    # pairs
+    layers, programs = parsed
+    return json.dumps([
+        [
+            [name, [
+                [ch, [[trigger, acts] for trigger, acts in triggers.items()]]
+                for ch, triggers in bindings.items()
+            ]]
+            for name, bindings in layers.items()
+        ],
+        list(programs.items())
+    ]).encode()
+
+def _decode(data:bytes) -> tuple:
+    ''' Return config.read_layers() output from _encode() JSON '''
+    layers, programs = json.loads(data)
+    return (
+        {
+            name: {
+                ch: {
+                    tuple(trigger): [(rid, action) for rid, action in acts]
+                    for trigger, acts in triggers
+                }
+                for ch, triggers in bindings
+            }
+            for name, bindings in layers
+        },
+        {number: name for number, name in programs}
+    )
+
+def load(config_path:str) -> matcher.Layers:
+    ''' Return cached bindings for a config file, None if not cached '''
+    try:
+        key = _key(_read(config_path))
+        f = open(path_for(config_path), 'rb')
+        data = f.read()
+        f.close()
+    except OSError:
+        return None
+
+    if data[0:len(key)] != key: return None
+    # Anything unexpected in it just means compiling the config again
+    try:
+        return matcher.compile_layers(*_decode(data[len(key):]))
+    except Exception:
+        return None
+
+def store(config_path:str, source:bytes, parsed:tuple) -> None:
+    ''' Write config.read_layers() output of source into the cache '''
+    try:
+        key = _key(source)
+        # Write and rename, so a half written cache is never read
+        tmp_path = path_for(config_path) + '.tmp'
+        f = open(tmp_path, 'wb')
+        f.write(key + _encode(parsed))
+        f.close()
+        os.replace(tmp_path, path_for(config_path))
+    except OSError:
+        # Caching is an optimization only, a read-only folder is fine
+        pass
+
+def compile_config(config_path:str) -> matcher.Layers:
+    ''' Parse and compile a config file and write it into the cache '''
+    try:
+        source = _read(config_path)
+    except OSError:
+        return matcher.compile_layers(*config.read_layers(config_path))
+    # The contents hashed are the very ones parsed, so a file changing in
+    # between can't leave a stale parse cached under its new hash
+    parsed = config.parse_layers(
+        source.decode(errors = 'replace').splitlines()
+    )
+    store(config_path, source, parsed)
+    return matcher.compile_layers(*parsed)
+
+def load_bindings(config_path:str) -> tuple:
+    ''' Return (compiled Layers, seconds taken, True if from cache) '''
+    start = time.perf_counter()
+    bindings = load(config_path)
+    cached = bindings != None
+    if not cached: bindings = compile_config(config_path)
+    return bindings, time.perf_counter() - start, cached
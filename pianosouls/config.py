@@ -7,19 +7,44 @@ import os.path
 import re
 
 from . import music
+from . import axes
 
 def read_config(path:str) -> dict:
     ''' Read and return pianosouls bindings from specified text file '''
-    if not os.path.exists(path): return {}
+    # Bindings of the first layer, for configs without layers all of them
+    return next(iter(read_layers(path)[0].values()))
+
+def read_layers(path:str) -> tuple:
+    ''' Read and return ({layer: bindings}, {program: layer}) from a file '''
+    if not os.path.exists(path): return ({'': {}}, {})
 
-    bindings = {}
     f = open(path, 'r')
+    layers = parse_layers(f)
+    f.close()
+    return layers
+
+def parse_layers(lines) -> tuple:
+    ''' Return ({layer: bindings}, {program: layer}) of config file lines '''
+    # Lines before the first "Layer:" declaration are part of every layer.
+    # A config without layers has a single one named ''.
+    shared = {}
+    layers = {}
+    programs = {}
+    bindings = shared
+    layer = None
 
-    # Currently using channel and device ID's 1
+    # Channel and device ID's default to 1, bindings listen to all inputs
     midi_ch = 1
     rid     = 1
+    source  = 0
+    # Shaping of continuous control bindings, in percent
+    curve       = 100
+    deadzone    = 0
+    smoothing   = 0
+    # Longest time in ms between two notes of a sequence, 0 for no limit
+    timeout     = 0
 
-    for l in f:
+    for l in lines:
         # Don't process empty or commented lines
         l = l.strip()
         if len(l) == 0 or l[0] == ';': continue
@@ -38,7 +63,11 @@ def read_config(path:str) -> dict:
             # Remove whitespace and split
             l = re.sub(r'\s+', '', l)
             l = l.split(':')
-            if l[1].isdigit():
+            if l[0] == 'LAYER' and l[1] != '':
+                # Declaring a layer again adds to it
+                layer = l[1]
+                bindings = layers.setdefault(layer, {})
+            elif l[1].isdigit():
                 # Update device or channel for upcoming lines
                 if (
                     l[0] in ('DEV, DEVICE') and
@@ -50,6 +79,21 @@ def read_config(path:str) -> dict:
                     1 <= int(l[1]) <= 16
                 ):
                     midi_ch = int(l[1])
+                elif l[0] in ('IN', 'INPUT'):
+                    source = int(l[1])
+                elif l[0] == 'CURVE' and int(l[1]) > 0:
+                    curve = int(l[1])
+                elif l[0] == 'DEADZONE' and int(l[1]) <= 99:
+                    deadzone = int(l[1])
+                elif l[0] == 'SMOOTHING' and int(l[1]) <= 99:
+                    smoothing = int(l[1])
+                elif l[0] == 'TIMEOUT':
+                    timeout = int(l[1])
+                elif (
+                    l[0] == 'PROGRAM' and layer != None and
+                    1 <= int(l[1]) <= 128
+                ):
+                    programs[int(l[1])] = layer
             continue
 
         #
@@ -77,10 +121,74 @@ def read_config(path:str) -> dict:
         real_trigger = []
         for tr in l:
             #
-            # Control Change
+            # Control Change, pitch bend and channel aftertouch
             #
-            if tr[0:2] == 'CC':
-                # TODO Implement Control Change functionality some day
+            control = tr.upper()
+            if axes.control_number(control) >= 0:
+                # Continuous controls can't be combined with other triggers
+                if len(l) > 1:
+                    line_valid = False
+                    continue
+                # CC01 and CC1 are the same control
+                if control[0:2] == 'CC': control = 'CC' + str(int(control[2:]))
+                real_trigger = [control, curve, deadzone, smoothing]
+                continue
+            elif control[0:2] == 'CC':
+                line_valid = False
+                continue
+
+            #
+            # Chord recognition, "*m7" for any minor 7th, "F*" for any chord
+            # rooted on F, "*" for any chord at all
+            #
+            if '*' in tr:
+                root_name, star, quality = tr.partition('*')
+                root = -1
+                if root_name != '':
+                    root = music.get_note_id(root_name)
+                    # Roots are pitch classes, octave markings make no sense
+                    if root == -1 or any(c.isdigit() for c in root_name):
+                        line_valid = False
+                        continue
+                    root %= 12
+                if (
+                    (quality != '' and not quality in music.CHORD_QUALITIES) or
+                    # Chords can't be combined with other triggers
+                    len(l) > 1
+                ):
+                    line_valid = False
+                    continue
+                real_trigger = ['*', root, quality]
+                continue
+
+            #
+            # Note sequences, "E > B > E > F# > G" played one note after
+            # another
+            #
+            if '>' in tr:
+                steps = tr.split('>')
+                # Lone arrow without a note on either side
+                if '' in steps:
+                    line_valid = False
+                    continue
+                note_ids = [music.get_note_id(step) for step in steps]
+                is_general = not any(c.isdigit() for c in tr)
+                if (
+                    -1 in note_ids or
+                    # Notes are either all matched by pitch class or all by
+                    # octave
+                    any(
+                        step[-1].isdigit() == is_general for step in steps
+                    ) or
+                    # Sequences can't be combined with other triggers
+                    len(l) > 1
+                ):
+                    line_valid = False
+                    continue
+                names = [
+                    music.get_note_name(n, not is_general) for n in note_ids
+                ]
+                real_trigger = ['>', timeout] + names
                 continue
 
             #
@@ -138,13 +246,28 @@ def read_config(path:str) -> dict:
         # Green light
         if line_valid:
             real_trigger = tuple(real_trigger)
+            # Bindings of a specific input get channel numbers of their own,
+            # like channels 17-32 on the second port of a MIDI interface
+            ch = midi_ch + 16 * source
 
-            if not midi_ch in bindings:
-                bindings[midi_ch] = {}
-            if not real_trigger in bindings[midi_ch]:
-                bindings[midi_ch][real_trigger] = []
+            if not ch in bindings:
+                bindings[ch] = {}
+            if not real_trigger in bindings[ch]:
+                bindings[ch][real_trigger] = []
 
-            bindings[midi_ch][real_trigger].append((rid, action))
+            bindings[ch][real_trigger].append((rid, action))
 
-    f.close()
-    return bindings
+    if len(layers) == 0: return ({'': shared}, programs)
+    merged = {name: _merge(shared, own) for name, own in layers.items()}
+    return (merged, programs)
+
+def _merge(shared:dict, own:dict) -> dict:
+    ''' Return bindings shared by all layers followed by a layer's own '''
+    merged = {
+        ch: {trigger: list(acts) for trigger, acts in triggers.items()}
+        for ch, triggers in shared.items()
+    }
+    for ch, triggers in own.items():
+        for trigger, acts in triggers.items():
+            merged.setdefault(ch, {}).setdefault(trigger, []).extend(acts)
+    return merged
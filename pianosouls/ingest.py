@@ -0,0 +1,321 @@
+#
+# ingest.py
+# pianosouls network MIDI input over UDP or a Unix domain socket, and a
+# sender for testing it
+#
+# Every datagram is a HEADER followed by count EVENT records:
+#   HEADER  MAGIC, sequence number, sender time in milliseconds of the first
+#           event, number of events
+#   EVENT   3 raw MIDI bytes, milliseconds after the header time
+# Sequence numbers count datagrams per sender, wrapping around at 2^32. Gaps
+# are counted as lost datagrams, datagrams arriving after later ones as
+# reordered. Reordered datagrams are still dispatched, late rather than
+# never, as a lost note off leaves the note held. Datagrams already received
+# within the last RESTART_GAP sequence numbers are dropped as duplicates, so
+# a retransmitted note is never played twice.
+#
+# Servers run in threads of their own, queueing events in the format of
+# midi.read() for midi.py to merge with local devices. Sender timestamps are
+# moved onto the local PortMidi clock by the smallest delay seen from each
+# sender, which keeps the spacing of events within and between datagrams.
+#
+# Run as a sender, from the repository root:
+# python -m pianosouls.ingest --udp 127.0.0.1:9100 [--journal session.psj]
+#
+
+import os
+import sys
+import time
+import queue
+import socket
+import struct
+import threading
+from optparse import OptionParser
+
+from . import journal
+
+MAGIC = b'PSN\x01'
+HEADER = struct.Struct('<4sIIB')
+EVENT = struct.Struct('<3BH')
+# Most events in one datagram, and the furthest an event may be from the
+# header time
+MAX_EVENTS = 255
+MAX_OFFSET = 0xFFFF
+# Largest datagram ever sent
+MAX_SIZE = HEADER.size + MAX_EVENTS * EVENT.size
+# A datagram more than this many sequence numbers behind is taken as the
+# sender starting over, not as a reordered one
+RESTART_GAP = 1000
+RESTART_MASK = (1 << RESTART_GAP) - 1
+# Maximum number of events queued, like midi.QUEUE_SIZE
+QUEUE_SIZE = 4096
+
+def parse_address(spec:str) -> tuple:
+    ''' Return (host, port) of a "host:port" or "port" UDP address '''
+    host, sep, port = spec.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+def pack(seq:int, events:list) -> bytes:
+    ''' Return events in the format of midi.read() as one datagram '''
+    base = events[0][1]
+    header = HEADER.pack(
+        MAGIC, seq & 0xFFFFFFFF, base & 0xFFFFFFFF, len(events)
+    )
+    return header + b''.join(
+        EVENT.pack(e[0][0], e[0][1], e[0][2], e[1] - base) for e in events
+    )
+
+def unpack(datagram:bytes) -> tuple:
+    ''' Return (sequence number, [(status, data1, data2, sender ms), ...]) '''
+    # Raises ValueError for anything that isn't a whole datagram
+    if len(datagram) < HEADER.size: raise ValueError('Datagram too short')
+    magic, seq, base, count = HEADER.unpack_from(datagram)
+    if magic != MAGIC: raise ValueError('Not a pianosouls datagram')
+    if len(datagram) != HEADER.size + count * EVENT.size:
+        raise ValueError('Datagram length doesn\'t match its event count')
+    return (seq, [
+        (status, data1, data2, base + offset)
+        for status, data1, data2, offset
+        in EVENT.iter_unpack(datagram[HEADER.size:])
+    ])
+
+# Sequence and clock state of one sender
+class Peer:
+    __slots__ = ('expected', 'seen', 'span', 'offset')
+
+    def __init__(self):
+        # Sequence number of the next datagram
+        self.expected   = None
+        # Bit n set if sequence number expected - 1 - n has been received,
+        # for the last RESTART_GAP of them
+        self.seen       = 0
+        # Sequence numbers from the first datagram on, at most RESTART_GAP
+        self.span       = 0
+        # Local minus sender milliseconds, smallest seen
+        self.offset     = None
+
+# Thread receiving datagrams on a socket into a queue, read by midi.py like
+# a device reader thread
+class Server(threading.Thread):
+    def __init__(self, sock:socket.socket, number:int, clock, name:str):
+        super().__init__(daemon = True)
+        self.sock       = sock
+        # Input number the events are tagged with
+        self.number     = number
+        # Function returning local time in milliseconds
+        self.clock      = clock
+        # Name of the socket for messages
+        self.label      = name
+        self.queue      = queue.Queue(QUEUE_SIZE)
+        self.running    = True
+        # Set after queueing events, set by midi.add_source()
+        self.ready      = None
+        # Socket file of Unix sockets, removed on close
+        self.path       = None
+        # Peer by sender address
+        self.peers      = {}
+        # Totals for report()
+        self.datagrams  = 0
+        self.events     = 0
+        self.lost       = 0
+        self.reordered  = 0
+        self.duplicates = 0
+        self.malformed  = 0
+        self.sock.settimeout(0.1)
+
+    def run(self):
+        while self.running:
+            try:
+                datagram, address = self.sock.recvfrom(MAX_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            events = self.receive(datagram, address)
+            if len(events) == 0: continue
+            for e in events: self.queue.put(e)
+            if self.ready != None: self.ready.set()
+
+    def receive(self, datagram:bytes, address) -> list:
+        ''' Return the events of a datagram in the format of midi.read() '''
+        try:
+            seq, events = unpack(datagram)
+        except ValueError:
+            self.malformed += 1
+            return []
+        self.datagrams += 1
+        now = self.clock()
+
+        peer = self.peers.get(address)
+        if peer == None:
+            peer = Peer()
+            self.peers[address] = peer
+        gap = 0
+        if peer.expected != None: gap = (seq - peer.expected) & 0xFFFFFFFF
+        if gap < 0x80000000:
+            # Datagrams skipped over are lost, unless they turn up later
+            self.lost += gap
+            peer.expected = (seq + 1) & 0xFFFFFFFF
+            if gap + 1 < RESTART_GAP:
+                peer.seen = (peer.seen << (gap + 1) | 1) & RESTART_MASK
+                peer.span = min(peer.span + gap + 1, RESTART_GAP)
+            else:
+                # Everything still in the window was skipped over
+                peer.seen, peer.span = 1, RESTART_GAP
+        elif 0x100000000 - gap > RESTART_GAP:
+            # Sender started over, its clock may have too
+            peer.offset = None
+            peer.expected = (seq + 1) & 0xFFFFFFFF
+            peer.seen = peer.span = 1
+        else:
+            behind = 0x100000000 - gap - 1
+            if peer.seen >> behind & 1:
+                self.duplicates += 1
+                return []
+            peer.seen |= 1 << behind
+            self.reordered += 1
+            # It was counted as lost when later ones arrived first, unless
+            # it's from before the first one received
+            if behind < peer.span: self.lost -= 1
+
+        # A datagram taking less time to arrive than any before moves the
+        # estimate of the sender's clock
+        if len(events) > 0:
+            delay = now - events[-1][3]
+            if peer.offset == None or delay < peer.offset:
+                peer.offset = delay
+
+        self.events += len(events)
+        offset = peer.offset
+        return [
+            [[status, data1, data2, 0], min(ts + offset, now), self.number]
+            for status, data1, data2, ts in events
+        ]
+
+    def close(self) -> None:
+        ''' Stop receiving and close the socket '''
+        self.running = False
+        if self.is_alive(): self.join()
+        self.sock.close()
+        if self.path != None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def report(self) -> str:
+        ''' Return the totals of this server on one line '''
+        return (
+            f'{self.label}: {self.datagrams} datagrams, {self.events} events, '
+            f'{self.lost} lost, {self.reordered} reordered, '
+            f'{self.duplicates} duplicates, {self.malformed} malformed'
+        )
+
+def listen_udp(spec:str, number:int, clock) -> Server:
+    ''' Return a Server for UDP "host:port" spec, not yet started '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(parse_address(spec))
+    return Server(sock, number, clock, f'UDP {spec}')
+
+def listen_unix(path:str, number:int, clock) -> Server:
+    ''' Return a Server for a Unix datagram socket at path, not yet started '''
+    # A socket file left over from an earlier run would fail bind()
+    if os.path.exists(path): os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    server = Server(sock, number, clock, f'Unix {path}')
+    server.path = path
+    return server
+
+# Batches events into datagrams to a server
+class Sender:
+    def __init__(self, udp:str = None, unix:str = None):
+        if unix != None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.address = unix
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.address = parse_address(udp)
+        self.seq = 0
+
+    def send(self, events:list) -> None:
+        ''' Send events in the format of midi.read() in as few datagrams '''
+        start = 0
+        while start < len(events):
+            end = start + 1
+            base = events[start][1]
+            while (
+                end < len(events) and end - start < MAX_EVENTS and
+                0 <= events[end][1] - base <= MAX_OFFSET
+            ):
+                end += 1
+            self.sock.sendto(pack(self.seq, events[start:end]), self.address)
+            self.seq += 1
+            start = end
+
+    def close(self) -> None:
+        self.sock.close()
+
+def _clock_ms() -> int:
+    ''' Return milliseconds since an arbitrary point '''
+    return int(time.perf_counter() * 1000)
+
+def _test_pattern() -> list:
+    ''' Return (delay seconds, [(status, data1, data2)]) steps to send '''
+    steps = []
+    # C major scale up, one note at a time
+    for n in (60, 62, 64, 65, 67, 69, 71, 72):
+        steps.append((0.15, [(0x90, n, 100)]))
+        steps.append((0.1, [(0x80, n, 0)]))
+    # I-IV-V-I, chords in a single datagram each
+    for root in (60, 65, 67, 60):
+        notes = (root, root + 4, root + 7)
+        steps.append((0.4, [(0x90, n, 100) for n in notes]))
+        steps.append((0.2, [(0x80, n, 0) for n in notes]))
+    return steps
+
+def main():
+    ''' Send a test pattern or a journal to a pianosouls ingest server '''
+    opt_parser = OptionParser(
+        usage = 'python -m pianosouls.ingest (--udp ADDR | --unix PATH)'
+    )
+    opt_parser.add_option(
+        '--udp',
+        action = 'store', type = 'string', dest = 'udp'
+    )
+    opt_parser.add_option(
+        '--unix',
+        action = 'store', type = 'string', dest = 'unix'
+    )
+    opt_parser.add_option(
+        '--journal',
+        action = 'store', type = 'string', dest = 'journal_path'
+    )
+    (options, args) = opt_parser.parse_args()
+    if options.udp == None and options.unix == None:
+        opt_parser.error('Give --udp or --unix')
+
+    sender = Sender(options.udp, options.unix)
+    try:
+        if options.journal_path != None:
+            # Batches as recorded, at the pace they were played
+            batches = journal.batches(journal.read(options.journal_path))
+            start = time.perf_counter()
+            for ts, batch in batches:
+                delay = start + ts - batches[0][0] - time.perf_counter()
+                if delay > 0: time.sleep(delay)
+                now = _clock_ms()
+                sender.send([[e[0], now] for e in batch])
+        else:
+            for delay, messages in _test_pattern():
+                time.sleep(delay)
+                now = _clock_ms()
+                sender.send([[list(m), now] for m in messages])
+    except KeyboardInterrupt:
+        pass
+    except Exception as err:
+        print(err)
+        sys.exit(1)
+    finally:
+        sender.close()
+    print(f'Sent {sender.seq} datagrams')
+
+if __name__ == '__main__':
+    main()
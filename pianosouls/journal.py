@@ -0,0 +1,87 @@
+#
+# journal.py
+# pianosouls MIDI session journal for --record and --replay
+#
+# A journal is the 4-byte MAGIC header followed by one fixed size EVENT record
+# per MIDI message: the 4 raw data bytes, the PortMidi timestamp in
+# milliseconds and the input number. Files are only ever appended to.
+# Journals from before multiple inputs (MAGIC_V1, EVENT_V1) have no input
+# number and are read as coming from input 1, but aren't appended to.
+#
+
+import os.path
+import struct
+
+MAGIC = b'PSJ\x02'
+EVENT = struct.Struct('<4BIB')
+MAGIC_V1 = b'PSJ\x01'
+EVENT_V1 = struct.Struct('<4BI')
+
+# Append-only journal file writer
+class Writer:
+    def __init__(self, path:str):
+        self.f = open(path, 'ab')
+        size = self.f.tell()
+        if size == 0:
+            self.f.write(MAGIC)
+            return
+
+        # Records of another format would make the whole file unreadable
+        f = open(path, 'rb')
+        header = f.read(len(MAGIC))
+        f.close()
+        if header != MAGIC:
+            self.f.close()
+            if header == MAGIC_V1:
+                raise Exception(
+                    f'{path} is a journal of an older pianosouls version, '
+                    'record into a new file'
+                )
+            raise Exception(f'{path} is not a pianosouls journal')
+        # Drop a torn record at the end of an interrupted recording, new
+        # ones would be out of step after it
+        end = size - (size - len(MAGIC)) % EVENT.size
+        if end != size: self.f.truncate(end)
+
+    def write(self, events:list) -> None:
+        ''' Append events as returned by midi.read() '''
+        records = []
+        for e in events:
+            data = list(e[0][0:4]) + [0] * (4 - len(e[0][0:4]))
+            source = e[2] if len(e) > 2 else 1
+            records.append(EVENT.pack(*data, e[1] & 0xFFFFFFFF, source))
+        self.f.write(b''.join(records))
+
+    def close(self) -> None:
+        self.f.close()
+
+def read(path:str) -> list:
+    ''' Return all events in a journal in the format of midi.read() '''
+    if not os.path.exists(path): raise Exception(f'Can\'t find file {path}')
+
+    f = open(path, 'rb')
+    buf = f.read()
+    f.close()
+    if buf[0:len(MAGIC)] == MAGIC:
+        event = EVENT
+    elif buf[0:len(MAGIC_V1)] == MAGIC_V1:
+        event = EVENT_V1
+    else:
+        raise Exception(f'{path} is not a pianosouls journal')
+
+    # Ignore a torn record at the end of an interrupted recording
+    end = len(buf) - (len(buf) - len(MAGIC)) % event.size
+    return [
+        [list(e[0:4]), e[4], e[5] if len(e) > 5 else 1]
+        for e in event.iter_unpack(buf[len(MAGIC):end])
+    ]
+
+def batches(events:list) -> list:
+    ''' Group events by timestamp, return [(seconds, [events]), ...] '''
+    grouped = []
+    for e in events:
+        if len(grouped) > 0 and grouped[-1][0] == e[1] / 1000:
+            grouped[-1][1].append(e)
+        else:
+            grouped.append((e[1] / 1000, [e]))
+    return grouped
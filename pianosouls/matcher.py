@@ -0,0 +1,431 @@
+#
+# matcher.py
+# pianosouls compiled, integer-coded binding index
+#
+
+from . import music
+from . import axes
+from . import actions
+
+def bits(mask:int) -> list:
+    ''' Return the indices of all set bits in mask, lowest first '''
+    found = []
+    while mask:
+        low = mask & -mask
+        found.append(low.bit_length() - 1)
+        mask ^= low
+    return found
+
+def pitch_classes(notes:int) -> int:
+    ''' Fold a 128-bit note mask into a 12-bit pitch class mask '''
+    pcs = 0
+    while notes:
+        pcs |= notes & 0xFFF
+        notes >>= 12
+    return pcs
+
+# Compiled single binding
+class Binding:
+    __slots__ = ('index', 'trigger', 'pc_mask', 'note_mask', 'actions')
+
+    def __init__(self, index:int, trigger:tuple, actions:list):
+        self.index      = index
+        self.trigger    = trigger
+        self.actions    = actions
+        # 12-bit pitch class mask for notes without an octave marking
+        self.pc_mask    = 0
+        # 128-bit absolute note mask for notes with an octave marking
+        self.note_mask  = 0
+
+    def matches(self, held_notes:int, held_pcs:int) -> bool:
+        ''' Return True if every note of this binding is currently held '''
+        return (
+            held_pcs & self.pc_mask == self.pc_mask and
+            held_notes & self.note_mask == self.note_mask
+        )
+
+    def extends(self, other) -> bool:
+        ''' Return True if this binding has every note of other, and more '''
+        pcs = self.pc_mask | pitch_classes(self.note_mask)
+        return (
+            other.pc_mask & ~pcs == 0 and
+            other.note_mask & ~self.note_mask == 0 and
+            (self.pc_mask, self.note_mask) != (other.pc_mask, other.note_mask)
+        )
+
+    def contains(self, n:int) -> bool:
+        ''' Return True if MIDI note n is part of this binding '''
+        return (
+            self.note_mask >> n & 1 == 1 or
+            self.pc_mask >> (n % 12) & 1 == 1
+        )
+
+# Compiled Control Change, pitch bend or channel aftertouch binding
+class ControlBinding:
+    __slots__ = (
+        'trigger', 'control', 'curve', 'deadzone', 'smoothing', 'actions'
+    )
+
+    def __init__(self, trigger:tuple, actions:list):
+        # Trigger is (name, curve %, deadzone %, smoothing %)
+        self.trigger    = trigger
+        self.control    = axes.control_number(trigger[0])
+        self.curve      = trigger[1] / 100
+        self.deadzone   = trigger[2] / 100
+        self.smoothing  = trigger[3] / 100
+        self.actions    = actions
+
+def is_control(trigger:tuple) -> bool:
+    ''' Return True if trigger is a continuous control trigger '''
+    return (
+        len(trigger) > 0 and isinstance(trigger[0], str) and
+        axes.control_number(trigger[0]) >= 0
+    )
+
+# Compiled chord recognition binding, like "*m7" or "F*"
+class ChordBinding:
+    __slots__ = ('trigger', 'root', 'quality', 'actions')
+
+    def __init__(self, trigger:tuple, actions:list):
+        # Trigger is ('*', root pitch class or -1 for any, quality or '')
+        self.trigger    = trigger
+        self.root       = trigger[1]
+        self.quality    = trigger[2]
+        self.actions    = actions
+
+    def matches(self, chord:music.Chord) -> bool:
+        ''' Return True if recognized chord (or None) fits this binding '''
+        return chord != None and (
+            (self.root == -1 or self.root == chord.root) and
+            (self.quality == '' or self.quality == chord.quality)
+        )
+
+def is_chord(trigger:tuple) -> bool:
+    ''' Return True if trigger is a chord recognition trigger '''
+    return len(trigger) > 0 and trigger[0] == '*'
+
+# Compiled note sequence binding, like "E > B > E > F# > G"
+class SequenceBinding:
+    __slots__ = (
+        'trigger', 'timeout', 'timeout_index', 'symbols', 'by_pc', 'actions'
+    )
+
+    def __init__(self, trigger:tuple, actions:list):
+        # Trigger is ('>', timeout ms or 0 for none, note name, ...)
+        self.trigger    = trigger
+        self.timeout    = trigger[1]
+        # Index into SequenceIndex.timeouts, -1 without a timeout
+        self.timeout_index = -1
+        # Names without an octave are matched by pitch class, names with an
+        # octave by absolute MIDI note id. A sequence is all one or the other.
+        names = trigger[2:]
+        self.by_pc = names[0] in music.PITCH_CLASS_NAME_TO_ID
+        if self.by_pc:
+            self.symbols = tuple(
+                music.PITCH_CLASS_NAME_TO_ID[n] for n in names
+            )
+        else:
+            # Notes outside MIDI note range are left out, never playable
+            self.symbols = tuple(
+                music.NOTE_NAME_TO_ID.get(n, -1) for n in names
+            )
+        self.actions    = actions
+
+def is_sequence(trigger:tuple) -> bool:
+    ''' Return True if trigger is a note sequence trigger '''
+    return len(trigger) > 0 and trigger[0] == '>'
+
+# Aho-Corasick automaton over an alphabet of symbols 0 to size-1, with the
+# failure links folded into a full transition table: every symbol fed costs a
+# single lookup, no matter how many patterns there are or how much of the
+# stream has been fed before
+class Automaton:
+    __slots__ = ('delta', 'outputs')
+
+    def __init__(self, patterns:list, size:int):
+        # Patterns are [(symbols, value), ...], state 0 is the start state
+        children    = [{}]
+        outputs     = [[]]
+        for symbols, value in patterns:
+            s = 0
+            for a in symbols:
+                if not a in children[s]:
+                    children[s][a] = len(children)
+                    children.append({})
+                    outputs.append([])
+                s = children[s][a]
+            outputs[s].append(value)
+
+        # Breadth first, the longest proper suffix of a state is always
+        # shallower and done before it
+        delta   = [None] * len(children)
+        fail    = [0] * len(children)
+        delta[0] = [children[0].get(a, 0) for a in range(size)]
+        queue   = list(children[0].values())
+        for s in queue:
+            delta[s] = list(delta[fail[s]])
+            for a, c in children[s].items():
+                delta[s][a] = c
+                fail[c] = delta[fail[s]][a]
+                # Patterns ending in the suffix end here too
+                outputs[c] += outputs[fail[c]]
+                queue.append(c)
+
+        # delta[state][symbol] is the state after feeding symbol
+        self.delta      = [tuple(d) for d in delta]
+        # outputs[state] are the values of patterns ending at state, longest
+        # first
+        self.outputs    = [tuple(o) for o in outputs]
+
+# Progress of a channel through its SequenceIndex
+class SequenceState:
+    __slots__ = ('pc_state', 'note_state', 'count', 'last', 'breaks')
+
+    def __init__(self, timeouts:int):
+        # Automaton states
+        self.pc_state   = 0
+        self.note_state = 0
+        # Notes fed so far
+        self.count      = 0
+        # Time in ms of the latest note
+        self.last       = float('-inf')
+        # Number of the latest note that came later than each timeout after
+        # the one before it
+        self.breaks     = [0] * timeouts
+
+# Note sequence bindings of a single MIDI channel
+class SequenceIndex:
+    def __init__(self, bindings:list):
+        # Distinct timeouts in ms
+        self.timeouts = sorted({b.timeout for b in bindings if b.timeout > 0})
+        for b in bindings:
+            if b.timeout > 0: b.timeout_index = self.timeouts.index(b.timeout)
+
+        playable = [b for b in bindings if not -1 in b.symbols]
+        self.pcs = Automaton(
+            [(b.symbols, b) for b in playable if b.by_pc], 12
+        )
+        self.notes = Automaton(
+            [(b.symbols, b) for b in playable if not b.by_pc], 128
+        )
+
+    def start(self) -> SequenceState:
+        ''' Return the state of a channel that hasn't played anything '''
+        return SequenceState(len(self.timeouts))
+
+    def feed(self, state:SequenceState, note:int, ms:float) -> list:
+        ''' Feed note played at ms, return the sequences it completes '''
+        state.count += 1
+        gap = ms - state.last
+        state.last = ms
+        # Timeouts are checked per distinct value rather than per sequence
+        for i, timeout in enumerate(self.timeouts):
+            if gap > timeout: state.breaks[i] = state.count
+
+        state.pc_state = self.pcs.delta[state.pc_state][note % 12]
+        state.note_state = self.notes.delta[state.note_state][note]
+        found = self.pcs.outputs[state.pc_state]
+        found += self.notes.outputs[state.note_state]
+        if len(found) == 0: return found
+
+        # A sequence only counts if no gap within it was over its timeout,
+        # ie. the latest gap that was is at or before its first note
+        return [
+            b for b in found if
+            b.timeout_index == -1 or
+            state.breaks[b.timeout_index] <= state.count - len(b.symbols) + 1
+        ]
+
+# Compiled bindings for a single MIDI channel
+class ChannelIndex:
+    def __init__(self, triggers:dict):
+        # All note bindings in config order
+        self.bindings = []
+        # Continuous bindings by control number
+        self.controls = {}
+        # Chord recognition bindings in config order
+        self.chords   = []
+        # Note sequence bindings in config order, and their automata. None
+        # without any.
+        self.sequence_bindings = []
+        self.sequences = None
+        # Bindings by trigger tuple
+        self.by_trigger = {}
+        # Reverse index: by_note[n] holds the bindings containing MIDI note n,
+        # in config order
+        self.by_note  = [[] for n in range(128)]
+
+        for trigger, acts in triggers.items():
+            if is_control(trigger):
+                cb = ControlBinding(trigger, acts)
+                self.controls.setdefault(cb.control, []).append(cb)
+                continue
+            if is_chord(trigger):
+                chb = ChordBinding(trigger, acts)
+                self.chords.append(chb)
+                self.by_trigger[trigger] = chb
+                continue
+            if is_sequence(trigger):
+                sb = SequenceBinding(trigger, acts)
+                self.sequence_bindings.append(sb)
+                self.by_trigger[trigger] = sb
+                continue
+
+            b = Binding(len(self.bindings), trigger, acts)
+            matchable = True
+            # Names without an octave are matched by pitch class, names with
+            # an octave by absolute MIDI note id
+            for name in trigger:
+                if name in music.PITCH_CLASS_NAME_TO_ID:
+                    bit = 1 << music.PITCH_CLASS_NAME_TO_ID[name]
+                    # A note listed twice can never be matched, as every held
+                    # note is only counted once
+                    if b.pc_mask & bit: matchable = False
+                    b.pc_mask |= bit
+                elif name in music.NOTE_NAME_TO_ID:
+                    bit = 1 << music.NOTE_NAME_TO_ID[name]
+                    if b.note_mask & bit: matchable = False
+                    b.note_mask |= bit
+                else:
+                    # Outside MIDI note range, never playable
+                    matchable = False
+
+            self.bindings.append(b)
+            self.by_trigger[trigger] = b
+            if not matchable: continue
+            notes = set(bits(b.note_mask))
+            for pc in bits(b.pc_mask): notes.update(range(pc, 128, 12))
+            for n in notes: self.by_note[n].append(b)
+
+        self.by_note = [tuple(bn) for bn in self.by_note]
+        if len(self.sequence_bindings) > 0:
+            self.sequences = SequenceIndex(self.sequence_bindings)
+
+    def affected(self, note:int, removed:int, actions_active:dict) -> tuple:
+        ''' Return bindings that may change state, in config order '''
+        # Only bindings containing a note just played can be pressed
+        found = self.by_note[note] if note >= 0 else ()
+        if removed == 0: return found
+
+        # Only active bindings containing a removed note can be released
+        removed_pcs = pitch_classes(removed)
+        extra = {}
+        for b in actions_active.values():
+            if b.note_mask & removed or b.pc_mask & removed_pcs:
+                extra[b.index] = b
+        if len(extra) == 0: return found
+
+        for b in found: extra[b.index] = b
+        return tuple(extra[i] for i in sorted(extra))
+
+def carry_over(new:ChannelIndex, actions_active:dict) -> list:
+    ''' Move held bindings to the same bindings in new '''
+    # Returns [(trigger, action), ...] held through bindings that no longer
+    # exist in new, or no longer have the action. Bindings left with none of
+    # their actions are dropped from actions_active.
+    kept = {}
+    gone = []
+    for trigger, binding in actions_active.items():
+        nb = new.by_trigger.get(trigger)
+        names = set()
+        if nb != None: names = {(a.rid, a.name) for a in nb.actions}
+        for a in binding.actions:
+            if (a.rid, a.name) in names:
+                # Held state refers to the new binding from now on
+                kept[trigger] = nb
+            else:
+                gone.append((trigger, a))
+
+    actions_active.clear()
+    actions_active.update(kept)
+    return gone
+
+def compile_bindings(bindings:dict) -> dict:
+    ''' Compile config.read_config() output into a ChannelIndex per channel '''
+    return {ch: ChannelIndex(tr) for ch, tr in bindings.items()}
+
+def all_bindings(ch_index:ChannelIndex) -> list:
+    ''' Return note, chord, sequence and continuous bindings of a channel '''
+    control_bindings = [
+        cb for cbs in ch_index.controls.values() for cb in cbs
+    ]
+    return (
+        ch_index.bindings + ch_index.chords + ch_index.sequence_bindings +
+        control_bindings
+    )
+
+def resolve(index:dict, compile_action, compiled:dict = None) -> dict:
+    ''' Replace the actions of compiled bindings with Action records '''
+    # Bindings come out of compile_bindings() with [(device, action string)]
+    # lists, compile_action(device, action string) turns each into a record.
+    # ValueError is raised for actions the output API module doesn't know.
+    # Records already in compiled {(device, action string): Action} are
+    # reused.
+    if compiled == None: compiled = {}
+    for ch_index in index.values():
+        for b in all_bindings(ch_index):
+            records = []
+            for rid, name in b.actions:
+                if not (rid, name) in compiled:
+                    compiled[(rid, name)] = compile_action(rid, name)
+                records.append(compiled[(rid, name)])
+                if isinstance(b, ControlBinding) and (
+                    records[-1].timed or records[-1].kind == actions.LAYER
+                ):
+                    raise ValueError(
+                        f'{name} can\'t be bound to {b.trigger[0]}'
+                    )
+            b.actions = tuple(records)
+    return index
+
+def devices(index:dict) -> list:
+    ''' Return all device ID's used by resolved bindings '''
+    using_devices = []
+    for ch_index in index.values():
+        for b in all_bindings(ch_index):
+            for action in b.actions:
+                # Layer switches don't send anything to any device
+                if action.kind == actions.LAYER: continue
+                if not action.rid in using_devices:
+                    using_devices.append(action.rid)
+    return using_devices
+
+# Compiled bindings of every layer of a config
+class Layers:
+    def __init__(self, indexes:dict, programs:dict):
+        # {layer name: {channel: ChannelIndex}}, in config order. Every layer
+        # has a ChannelIndex for every channel any layer uses.
+        self.indexes    = indexes
+        # Layer names in config order, the first one is active at start
+        self.names      = tuple(indexes)
+        # {Program Change number 1-128: layer name}
+        self.programs   = programs
+
+def compile_layers(layers:dict, programs:dict) -> Layers:
+    ''' Compile config.read_layers() output into Layers '''
+    indexes = {name: compile_bindings(b) for name, b in layers.items()}
+    channels = set()
+    for index in indexes.values(): channels.update(index)
+    for index in indexes.values():
+        for ch in sorted(channels - set(index)): index[ch] = ChannelIndex({})
+    return Layers(indexes, programs)
+
+def resolve_layers(layers:Layers, compile_action) -> Layers:
+    ''' resolve() the bindings of every layer, rejecting unknown layers '''
+    compiled = {}
+    for index in layers.indexes.values():
+        resolve(index, compile_action, compiled)
+    for action in compiled.values():
+        if action.kind == actions.LAYER and not (
+            action.control in layers.indexes
+        ):
+            raise ValueError(f'Unknown layer {action.control}')
+    return layers
+
+def layer_devices(layers:Layers) -> list:
+    ''' Return all device ID's used by the resolved bindings of any layer '''
+    using_devices = []
+    for index in layers.indexes.values():
+        for rid in devices(index):
+            if not rid in using_devices: using_devices.append(rid)
+    return using_devices
@@ -2,30 +2,163 @@
 # pianosouls.midi
 #
 
+import time
+import queue
+import threading
 import pygame.midi
 
-# Always initialize pygame.midi when imported
-pygame.midi.init()
-# Global reference to device interacted with
+# Global reference to the first device interacted with
 DEV = None
+# Global list of all open devices. Events read from DEVS[i] are tagged with
+# input number i + 1, which config "Input:" declarations refer to.
+DEVS = []
+# Reader threads, one per device, when listening to more than one device
+READERS = []
+# Reader threads of other inputs than PortMidi devices, like ingest.Server
+SOURCES = []
+
+# PortMidi can't block waiting for input, so wait() busy-polls the device for
+# SPIN_TIME seconds and only then falls back to sleeping SLEEP_TIME seconds
+# between polls. Spinning longer lowers latency at the cost of CPU time.
+SPIN_TIME  = 0.0005
+SLEEP_TIME = 0.001
+# Maximum number of events read from PortMidi per call
+READ_SIZE  = 1024
+# Maximum number of events queued by each reader thread. Readers wait for the
+# dispatcher when full, leaving the rest buffered in PortMidi.
+QUEUE_SIZE = 4096
+
+# Set by reader threads whenever they queue events
+_ready = threading.Event()
+
+# Thread reading one device into a queue
+class Reader(threading.Thread):
+    def __init__(self, dev, number:int):
+        super().__init__(daemon = True)
+        self.dev     = dev
+        self.number  = number
+        self.queue   = queue.Queue(QUEUE_SIZE)
+        self.running = True
+
+    def run(self):
+        while self.running:
+            if not _wait_device(self.dev, 0.1): continue
+            for data, ts in _read_device(self.dev):
+                self.queue.put([data, ts, self.number])
+            _ready.set()
+
+def init() -> None:
+    ''' Initialize PortMidi, called before any other function '''
+    pygame.midi.init()
 
 def open(n:int):
-    ''' Open MIDI input device for listening to midi.DEV '''
-    global DEV
-    if DEV == None:
-        DEV = pygame.midi.Input(n)
-    else:
+    ''' Open MIDI input device n for listening, added to midi.DEVS '''
+    global DEV, DEVS
+    if n in [d.device_id for d in DEVS]:
         raise Warning('MIDI device already open')
+    DEVS.append(pygame.midi.Input(n))
+    DEV = DEVS[0]
+
+def add_source(reader) -> None:
+    ''' Read input from reader alongside devices, call before start_readers '''
+    # Readers are threads with a queue of events in the format of read() and
+    # a close() method, and set their ready event after queueing
+    global SOURCES
+    reader.ready = _ready
+    SOURCES.append(reader)
 
 def close():
-    ''' Close MIDI devices in midi.DEV '''
-    global DEV
-    if isinstance(DEV, pygame.midi.Input):
-        DEV.close()
-        DEV = None
-    else:
+    ''' Close all MIDI devices in midi.DEVS and other sources '''
+    global DEV, DEVS, READERS, SOURCES
+    if len(DEVS) == 0 and len(SOURCES) == 0:
         raise Warning('MIDI device already closed')
 
+    for r in READERS:
+        if not r in SOURCES: r.running = False
+    for r in READERS:
+        if not r in SOURCES: r.join()
+    for s in SOURCES: s.close()
+    READERS = []
+    SOURCES = []
+    for d in DEVS: d.close()
+    DEVS = []
+    DEV = None
+
+def start_readers():
+    ''' Read every input in its own thread, if there are several '''
+    global DEVS, READERS, SOURCES
+    if len(DEVS) < 2 and len(SOURCES) == 0: return
+
+    READERS = [Reader(d, i + 1) for i, d in enumerate(DEVS)] + SOURCES
+    for r in READERS: r.start()
+
+def find_device(spec:str) -> int:
+    ''' Return the id of an input device by id or part of its name, or -1 '''
+    if spec.isdigit(): return int(spec)
+
+    for i in range(pygame.midi.get_count()):
+        dev_info = pygame.midi.get_device_info(i)
+        if dev_info[2] == 1 and spec.lower() in dev_info[1].decode().lower():
+            return i
+    return -1
+
+def _wait_device(dev, timeout:float) -> bool:
+    ''' Wait at most timeout seconds for input in dev, True if any '''
+    if dev.poll(): return True
+
+    now      = time.perf_counter()
+    spin_end = now + SPIN_TIME
+    deadline = now + timeout
+    while now < deadline:
+        if now >= spin_end: time.sleep(min(SLEEP_TIME, deadline - now))
+        if dev.poll(): return True
+        now = time.perf_counter()
+
+    return False
+
+def _read_device(dev) -> list:
+    ''' Drain and return all pending events in dev '''
+    events = dev.read(READ_SIZE)
+    # A full read means there may be more left in the buffer
+    while len(events) > 0 and len(events) % READ_SIZE == 0 and dev.poll():
+        events += dev.read(READ_SIZE)
+    return events
+
+def poll() -> bool:
+    ''' Return True if there's input waiting to be read '''
+    if len(READERS) == 0: return DEV.poll()
+    return any(not r.queue.empty() for r in READERS)
+
+def wait(timeout:float) -> bool:
+    ''' Wait at most timeout seconds for input, True if any '''
+    if len(READERS) == 0: return _wait_device(DEV, timeout)
+
+    if poll() or _ready.wait(timeout):
+        _ready.clear()
+        return True
+    return False
+
+def clock() -> int:
+    ''' Return the current PortMidi time in milliseconds '''
+    return pygame.midi.time()
+
+def read() -> list:
+    ''' Drain and return all pending input, oldest first '''
+    if len(READERS) == 0:
+        return [[data, ts, 1] for data, ts in _read_device(DEV)]
+
+    # PortMidi timestamps share one clock across devices, so merging by
+    # timestamp keeps the order events were played in. The sort is stable,
+    # so events of each device stay in order.
+    events = []
+    for r in READERS:
+        try:
+            while True: events.append(r.queue.get_nowait())
+        except queue.Empty:
+            pass
+    events.sort(key = lambda e: e[1])
+    return events
+
 def prompt_device() -> int:
     ''' Interactive prompt for MIDI device from all available '''
 
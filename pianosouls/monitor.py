@@ -0,0 +1,116 @@
+#
+# monitor.py
+# Terminal view of a state file written by pianosouls --export-state,
+# showing held notes, recognized chords and gamepad controls live
+#
+# Run from the repository root:
+# python -m pianosouls.monitor state.pss [--rate 30]
+#
+
+import sys
+import time
+from optparse import OptionParser
+
+from . import music
+from . import matcher
+from . import statefile
+
+# Keys drawn on each keyboard row, the 88 of a piano
+LOWEST_KEY  = 21
+HIGHEST_KEY = 108
+# Width of trigger and stick bars
+BAR_WIDTH   = 16
+
+# ANSI sequences to redraw from the top left corner
+HOME  = '\x1b[H'
+CLEAR = '\x1b[J'
+
+def keyboard(held:int, sounding:int) -> str:
+    ''' Return a row of keys, # for held, + for sustained and . for up '''
+    row = []
+    for n in range(LOWEST_KEY, HIGHEST_KEY + 1):
+        if held >> n & 1:
+            row.append('#')
+        elif sounding >> n & 1:
+            row.append('+')
+        else:
+            row.append('.')
+    return ''.join(row)
+
+def chord_name(sounding:int) -> str:
+    ''' Return the name of the chord sounding notes form, or their names '''
+    notes = matcher.bits(sounding)
+    if len(notes) == 0: return ''
+    chord = music.recognize(matcher.pitch_classes(sounding), notes[0] % 12)
+    if chord != None and len(notes) > 1: return repr(chord)
+    return ' '.join(music.get_note_name(n, simple = True) for n in notes)
+
+def bar(value:int, low:int, high:int) -> str:
+    ''' Return value drawn as a bar between low and high '''
+    filled = round((value - low) / (high - low) * BAR_WIDTH)
+    return '[' + '=' * filled + ' ' * (BAR_WIDTH - filled) + ']'
+
+def render(snapshot:statefile.Snapshot) -> str:
+    ''' Return a whole screen for a snapshot '''
+    lines = []
+    status = 'running' if snapshot.running else 'stopped'
+    stamp = time.strftime('%H:%M:%S', time.localtime(snapshot.time))
+    layer = f'  layer {snapshot.layer}' if snapshot.layer else ''
+    lines.append(f'pianosouls {status}  updated {stamp}{layer}')
+    lines.append('')
+
+    for ch in sorted(snapshot.channels, key = lambda c: c.number):
+        pedal = 'pedal' if ch.pedal else ''
+        lines.append(f'ch {ch.number:<4}{pedal:6}{chord_name(ch.sounding)}')
+        lines.append('  ' + keyboard(ch.held, ch.sounding))
+    lines.append('')
+
+    for d in snapshot.devices:
+        lines.append(f'device {d.rid}  ' + ' '.join(d.pressed()))
+        lines.append(
+            f'  LT {bar(d.left_trigger, 0, 255)}  '
+            f'RT {bar(d.right_trigger, 0, 255)}'
+        )
+        for name, value in (
+            ('LX', d.lx), ('LY', d.ly), ('RX', d.rx), ('RY', d.ry)
+        ):
+            lines.append(f'  {name} {bar(value, -32768, 32767)} {value:6}')
+    return '\n'.join(lines)
+
+def main():
+    ''' Draw a state file until interrupted '''
+    opt_parser = OptionParser(
+        usage = 'python -m pianosouls.monitor STATE_FILE [--rate N]'
+    )
+    opt_parser.add_option(
+        '-r', '--rate',
+        action = 'store', type = 'float', dest = 'rate', default = 30
+    )
+    (options, args) = opt_parser.parse_args()
+    if len(args) != 1: opt_parser.error('Give the state file to monitor')
+
+    try:
+        reader = statefile.Reader(args[0])
+    except (OSError, ValueError) as err:
+        print(err)
+        sys.exit(1)
+
+    seen = None
+    try:
+        while True:
+            # Nothing to redraw until pianosouls writes again
+            seq = reader.sequence()
+            if seq != seen:
+                snapshot = reader.read()
+                if snapshot != None:
+                    seen = snapshot.seq
+                    print(HOME + CLEAR + render(snapshot), end = '')
+                    sys.stdout.flush()
+            time.sleep(1 / options.rate)
+    except KeyboardInterrupt:
+        print()
+    finally:
+        reader.close()
+
+if __name__ == '__main__':
+    main()
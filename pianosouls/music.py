@@ -25,10 +25,11 @@ CHORD_NAME_TO_RELATION = {
     'mmaj7':    (3, 11),
     'm7':       (3, 10),
     # Sixth chords
-    # TODO Currently the overlap with minor chord inversion makes these
-    # confusing and inconsistent from detection standpoint
-    # 'M6':       (4, 9),
-    # 'm6':       (3, 9),
+    # NOTE Unlike other chords, these keep their pure fifth. Without it, M6
+    # would be the same notes as the first inversion of the relative minor
+    # triad (C, E, A is A minor) and m6 of the diminished triad.
+    'M6':       (4, 7, 9),
+    'm6':       (3, 7, 9),
     # Triads
     'aug':      (4, 8),
     'dim':      (3, 6),
@@ -51,8 +52,8 @@ NOTE_LETTER_TO_ID = {
 NOTE_ID_TO_LETTER = {}
 for key, value in NOTE_LETTER_TO_ID.items(): NOTE_ID_TO_LETTER[value] = key
 
-def get_note_id(n:str) -> int:
-    ''' Returns any valid musical notes MIDI note id value '''
+def _parse_note_id(n:str) -> int:
+    ''' Parse any valid musical notes MIDI note id value '''
     # Take out all whitespace for safety
     n = re.sub(r'\s+', '', n)
     # Case-insensitivity
@@ -81,8 +82,8 @@ def get_note_id(n:str) -> int:
 
     return note_id
 
-def get_note_name(n:int, find_octave:bool = True, simple=False) -> str:
-    ''' Returns the musical notation for any given MIDI note id value '''
+def _note_name(n:int, find_octave:bool = True, simple=False) -> str:
+    ''' Compose the musical notation for any given MIDI note id value '''
     # NOTE I actually want names for arbitary note values, even if they're not
     # strictly playable or exist, so this next line is commented out
     # if not 21 <= n <= 127: return ''
@@ -103,3 +104,110 @@ def get_note_name(n:int, find_octave:bool = True, simple=False) -> str:
             note = note[:2] + str(octave) + note[2:]
 
     return note
+
+# Note names precomputed for every MIDI note id 0-127, with octave
+NOTE_NAMES          = tuple(_note_name(n, True, False) for n in range(128))
+NOTE_NAMES_SIMPLE   = tuple(_note_name(n, True, True) for n in range(128))
+# Note names without octave only depend on the pitch class (0-11)
+PITCH_CLASS_NAMES   = tuple(_note_name(n, False, False) for n in range(12))
+PITCH_CLASS_NAMES_SIMPLE = tuple(_note_name(n, False, True) for n in range(12))
+
+# Reverse tables for the default names get_note_name() returns, used to turn
+# names back into pitch classes (0-11) and MIDI note id's (0-127)
+PITCH_CLASS_NAME_TO_ID = {name: n for n, name in enumerate(PITCH_CLASS_NAMES)}
+NOTE_NAME_TO_ID        = {name: n for n, name in enumerate(NOTE_NAMES)}
+
+# Results of get_note_id() by note name, filled as names are looked up
+_NOTE_ID_CACHE = {}
+
+def get_note_id(n:str) -> int:
+    ''' Returns any valid musical notes MIDI note id value '''
+    if n in _NOTE_ID_CACHE: return _NOTE_ID_CACHE[n]
+    note_id = _parse_note_id(n)
+    _NOTE_ID_CACHE[n] = note_id
+    return note_id
+
+def get_note_name(n:int, find_octave:bool = True, simple=False) -> str:
+    ''' Returns the musical notation for any given MIDI note id value '''
+    if not find_octave:
+        if simple: return PITCH_CLASS_NAMES_SIMPLE[n % 12]
+        return PITCH_CLASS_NAMES[n % 12]
+    if 0 <= n <= 127:
+        if simple: return NOTE_NAMES_SIMPLE[n]
+        return NOTE_NAMES[n]
+    return _note_name(n, find_octave, simple)
+
+#
+# Chord recognition
+#
+# CHORD_TABLE maps each of the 4096 possible sets of held pitch classes (bit
+# n standing for pitch class n, C being 0) to the chords those notes form.
+# Ambiguity rules:
+#   1. Only exact sets are recognized. Every held pitch class must be a chord
+#      tone, and every chord tone must be held, except for the pure fifths
+#      left out of chord relations above, which may be played or not.
+#   2. When the same notes form several chords (CM6 and Am7, Cm6 and Am7b5,
+#      the symmetric augmented and diminished 7th chords), the chord rooted
+#      on the lowest note held wins.
+#   3. If the lowest note isn't the root of any of them, the quality listed
+#      first in CHORD_QUALITIES wins, then the lowest root pitch class.
+#
+
+# Recognized chord qualities, in order of preference for rule 3
+CHORD_QUALITIES = (
+    'augmaj7', 'aug7', 'm7b5', 'dim7', 'M7b5', 'M7', 'maj7', 'mmaj7', 'm7',
+    'M6', 'm6', 'aug', 'dim', 'M', 'm'
+)
+
+# Chord one set of pitch classes can be recognized as
+class Chord:
+    __slots__ = ('root', 'quality', 'intervals')
+
+    def __init__(self, root:int, quality:str, intervals:tuple):
+        # Root pitch class 0-11
+        self.root       = root
+        self.quality    = quality
+        # Semitones from root of the chord tones actually held, root first
+        self.intervals  = intervals
+
+    def inversion(self, bass:int) -> int:
+        ''' Return 0 for root position, 1-3 for 3rd, 5th or 7th in bass '''
+        interval = (bass - self.root) % 12
+        if interval == 0: return 0
+        if interval <= 4: return 1
+        if interval <= 8: return 2
+        return 3
+
+    def __repr__(self):
+        return f'{PITCH_CLASS_NAMES_SIMPLE[self.root]}{self.quality}'
+
+def _build_chord_table() -> list:
+    ''' Return chord candidates by pitch class set, best first '''
+    table = [[] for pcs in range(4096)]
+    for quality in CHORD_QUALITIES:
+        relation = CHORD_NAME_TO_RELATION[quality]
+        # Pure fifths left out of seventh chords may still be played
+        extras = [()]
+        if (
+            (10 in relation or 11 in relation) and
+            not (6 in relation or 8 in relation)
+        ):
+            extras.append((7,))
+        for root in range(12):
+            for extra in extras:
+                intervals = (0,) + tuple(sorted(relation + extra))
+                pcs = 0
+                for i in intervals: pcs |= 1 << ((root + i) % 12)
+                table[pcs].append(Chord(root, quality, intervals))
+    return [tuple(chords) for chords in table]
+
+CHORD_TABLE = _build_chord_table()
+
+def recognize(pcs:int, bass:int) -> Chord:
+    ''' Return the chord held pitch classes pcs form, None if they don't '''
+    # bass is the pitch class of the lowest note held, see rule 2 above
+    chords = CHORD_TABLE[pcs]
+    if len(chords) == 0: return None
+    for chord in chords:
+        if chord.root == bass: return chord
+    return chords[0]
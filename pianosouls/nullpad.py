@@ -0,0 +1,76 @@
+#
+# nullpad.py
+# Output API module without any real devices. Logs every update, which makes
+# it useful for --replay regression diffs and throughput measurements.
+#
+
+import sys
+
+from . import scheduler
+from .actions import Action, BUTTON, AXIS, TRIGGER
+
+# File every update is logged to, one tab separated line of time, device,
+# action and value each. None only counts updates.
+LOG = sys.stdout
+
+# Number of update() and flush() calls so far
+updates = 0
+flushes = 0
+
+# Velocity passed through as it is
+VALUES = tuple(range(128))
+
+# Axes and triggers of vigemclient and uinput, and axes of vjoyfeeder. Any
+# other action is a button.
+AXES = (
+    'LX', 'LY', 'RX', 'RY', 'X', 'Y', 'Z', 'RZ', 'SL0', 'SL1', 'WHL'
+)
+TRIGGERS = ('LT', 'RT')
+
+def compile_action(rid:int, name:str) -> Action:
+    ''' Accept any action, resolved like the real output modules would '''
+    # Both directions of an axis and every spelling of a button share one
+    # control, so the arbiter sees them the way it does with real devices
+    real_action = name.replace('+','').replace('-','')
+    if real_action in TRIGGERS:
+        kind = TRIGGER
+    elif real_action in AXES:
+        kind = AXIS
+    else:
+        kind = BUTTON
+    return Action(rid, name, kind, real_action, VALUES)
+
+def update(action:Action, value:int):
+    ''' Log an update '''
+    global LOG, updates
+
+    updates += 1
+    if LOG != None:
+        LOG.write(
+            f'{scheduler.clock():.3f}\t{action.rid}\t{action.name}\t{value}\n'
+        )
+
+def update_analog(action:Action, value:float):
+    ''' Log an analog update '''
+    global LOG, updates
+
+    updates += 1
+    if LOG != None:
+        LOG.write(
+            f'{scheduler.clock():.3f}\t{action.rid}\t{action.name}\t'
+            f'{value:.4f}\n'
+        )
+
+def flush():
+    ''' Count a flush, nothing to send '''
+    global flushes
+    flushes += 1
+
+def init(devices):
+    ''' No devices to initialize '''
+    return
+
+def close():
+    ''' Flush the update log '''
+    global LOG
+    if LOG != None: LOG.flush()
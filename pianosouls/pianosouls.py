@@ -8,32 +8,51 @@
 #
 
 
-# TODO TODO Functionality to implement TODO TODO
-# MIDI Control Change support
-
-
 import sys
 import os
 import time
 import importlib
-import msvcrt
-from optparse import OptionParser
 
-from . import midi
+# Start of the import phase of --startup-profile
+_IMPORT_START = time.perf_counter()
+
 from . import music
-from . import config
+from . import matcher
+from . import actions
+from . import axes
+from . import arbiter
+from . import scheduler
+from . import journal
+from . import stats
+from . import reloader
+from . import cache
+from . import statefile
+
+# Backends and platform specific modules are imported by main() once they're
+# needed, so config errors and --help show up quickly, and the core imports
+# without pygame or any DLL.
+# Keyboard hotkeys, only available on Windows
+msvcrt = None
 
 # Global API module dynamically imported in main()
 apimod = None
-DEFAULT_API = 'vigemclient'
-
-# Global dictionary with current state for each MIDI channel listening to
+DEFAULT_API = 'uinput' if sys.platform.startswith('linux') else 'vigemclient'
+# Global MIDI input module imported in main(), by --midi-api name
+midi = None
+MIDI_APIS = {'portmidi': 'midi', 'rawmidi': 'rawmidi'}
+DEFAULT_MIDI_API = (
+    'rawmidi' if sys.platform.startswith('linux') else 'portmidi'
+)
+
+# Global dictionary with current state for each MIDI channel listening to.
+# Channels 1-16 listen to all inputs. Channels of bindings declared for a
+# specific input with "Input: n" are numbered 16 * n + (1-16).
 CH_STATE = {}
-# Global dictionary with bindings per each MIDI channel used
+# Global dictionary with compiled bindings per each MIDI channel used
 BINDINGS = {}
-# All trigger-action bindings stored in the following semi-incoprehensible
-# format:
-# BINDINGS = {
+# config.read_config() returns all trigger-action bindings in the following
+# semi-incoprehensible format:
+# {
 #     # Channels
 #     1: {
 #         # Binding       [(Device, Action), (Device, Action), ...]
@@ -43,128 +62,577 @@ BINDINGS = {}
 #         ('D', 'F'):     [(1, 'X'), (2, 'Y')]
 #     }
 # }
+# which matcher.compile_bindings() turns into a matcher.ChannelIndex per
+# channel, and matcher.resolve() into actions.Action records for the output
+# API module, stored in BINDINGS:
+# BINDINGS = {
+#     1: ChannelIndex,
+#     2: ChannelIndex
+# }
+# Configs with "Layer:" declarations are compiled into one such dictionary
+# per layer up front, and BINDINGS points to the active layer's.
+# Compiled matcher.Layers of the config, and the name of the active layer
+LAYERS = None
+LAYER = None
+# Layer to switch to once the event being handled is done, None if none
+NEXT_LAYER = None
+
+# Polling rate in seconds, set with --poll. Enforced to limit CPU usage. If
+# None, the main loop waits for MIDI input instead and reacts as soon as any
+# arrives.
+POLLING_RATE = None
+# Longest time in seconds to wait for MIDI input before checking hotkeys
+WAIT_TIMEOUT = 1/60
+# Output flush interval in seconds, set with --output-rate. If None, output
+# API state is flushed once at the end of each batch of MIDI events.
+OUTPUT_RATE = None
+# Interval in seconds at which stats are written to --stats-file
+STATS_INTERVAL = 10
+# statefile.Writer live state is published to on every flush, set with
+# --export-state
+EXPORT = None
+# perf_counter() time the batch being processed entered update_state(), only
+# kept when stats are enabled
+BATCH_START = 0.0
+# Chord window in seconds, set with --chord-window. A press of a binding whose
+# notes could still grow into a longer binding is held back until the longer
+# one completes (and the shorter one is dropped), or until this long after
+# the timestamp of the note that completed it. 0 presses everything at once.
+CHORD_WINDOW = 0.0
+# Presses held back by the chord window, by (channel, trigger)
+PENDING = {}
+
+# Press held back by the chord window
+class PendingPress:
+    __slots__ = (
+        'ch', 'binding', 'value', 'start', 'deadline', 'extenders', 'event'
+    )
 
-# Polling rate in seconds. Enforced to limit CPU usage.
-POLLING_RATE = 1/60
+    def __init__(self, ch:int, binding, value:int, extenders:list):
+        self.ch         = ch
+        self.binding    = binding
+        self.value      = value
+        # Longer bindings whose completion drops this press
+        self.extenders  = extenders
+        # scheduler.clock() time of the note, PortMidi time the window ends
+        self.start      = 0.0
+        self.deadline   = None
+        # Scheduled firing
+        self.event      = None
 
 # State class for each MIDI channel
 class MIDIChannelState:
+    __slots__ = (
+        'held', 'released', 'sounding', 'pedal_down', 'actions_active',
+        'chords_active', 'sequences_active', 'sequence', 'sequence_notes'
+    )
+
     def __init__(self):
-        self.notes_down     = []
-        self.notes_rel      = []
+        # Notes as 128-bit masks, bit n standing for MIDI note n
+        # Keys currently pressed down
+        self.held           = 0
+        # Keys let go of while the sustain pedal is down
+        self.released       = 0
+        # Notes bindings see as down, ie. held or sustained
+        self.sounding       = 0
         self.pedal_down     = False
-        self.actions_active = []
+        # Note and chord recognition bindings currently pressed, by trigger
+        self.actions_active = {}
+        self.chords_active  = {}
+        # Note sequence bindings currently pressed by trigger, and the note
+        # completing each, which holds it
+        self.sequences_active   = {}
+        self.sequence_notes     = {}
+        # Progress through the channel's sequences, None until the first note
+        self.sequence       = None
 
 def update_state(msg) -> None:
-    global apimod, CH_STATE, BINDINGS, POLLING_RATE
+    ''' Process a batch of MIDI events as returned by midi.read() '''
+    global apimod, BATCH_START
     if apimod == None: raise Exception('Output API not initialized')
 
-    status, data1, data2 = msg[0][0][0:3]
+    if stats.ENABLED:
+        BATCH_START = time.perf_counter()
+        if stats.input_clock != None:
+            now = stats.input_clock()
+            for event in msg: stats.record('input', (now - event[1]) / 1000)
+
+    for event in msg:
+        source = event[2] if len(event) > 2 else 1
+        update_event(event[0][0], event[0][1], event[0][2], source, event[1])
+
+    # Send the outcome of the whole batch at once
+    if OUTPUT_RATE == None: flush_output()
+
+def flush_output() -> None:
+    ''' Flush output API state '''
+    global apimod, EXPORT
+
+    if stats.ENABLED:
+        start = time.perf_counter()
+        apimod.flush()
+        stats.record('flush', time.perf_counter() - start)
+    else:
+        apimod.flush()
+    if EXPORT != None: EXPORT.publish(CH_STATE, LAYER)
+
+def record_output(start:float, counter:str) -> None:
+    ''' Record stats for an output API update started at start '''
+    global BATCH_START
+
+    stats.record('dispatch', start - BATCH_START)
+    stats.record('update', time.perf_counter() - start)
+    stats.count(counter)
+
+def update_event(
+    status:int, data1:int, data2:int, source:int = 1, ts:int = None
+) -> None:
+    ''' Process a single MIDI event from input number source '''
+    # ts is the PortMidi timestamp of the event in milliseconds, if known
+    if stats.ENABLED: stats.count('events')
+
+    # Presses whose chord window ended before this event go first
+    if len(PENDING) > 0 and ts != None: expire_pending(ts)
+
+    # Program Change switches to the layer declared for the program
+    if 192 <= status <= 207 and LAYERS != None:
+        name = LAYERS.programs.get(data1 + 1)
+        if name != None: switch_layer(name)
+
     ch = (status % 16) + 1
+    # Bindings listening to all inputs
+    update_channel(ch, status, data1, data2, ts)
+    # Bindings listening to this input only
+    update_channel(ch + 16 * source, status, data1, data2, ts)
+
+    # Layers only switch between events, so no event sees two of them
+    if NEXT_LAYER != None: apply_layer()
+
+def update_channel(
+    ch:int, status:int, data1:int, data2:int, ts:int = None
+) -> None:
+    ''' Process a single MIDI event for the bindings of channel ch '''
+    global apimod, CH_STATE, BINDINGS
 
-    # I am NOT writing "CH_STATE[ch]." in front of these EVERY SINGLE TIME I
-    # need them (every other line), but Python doesn't support pointers
-    # so here we are :--) I don't care to look for a handier way to unload
-    # these, there's only 4.
     if 128 <= status <= 239 and ch in CH_STATE:
-        notes_down      = CH_STATE[ch].notes_down
-        notes_rel       = CH_STATE[ch].notes_rel
-        pedal_down      = CH_STATE[ch].pedal_down
-        actions_active  = CH_STATE[ch].actions_active
+        state = CH_STATE[ch]
     else:
         return
 
+    actions_active = state.actions_active
+    sounding_before = state.sounding
+    # Note just played, if any
+    note_on = -1
+    # Continuous control moved, if any, and its raw value
+    control = -1
+    raw     = 0
+
     # Control Change
     if 176 <= status <= 191:
         # Sustain pedal
         if data1 == 64:
-            pedal_down = True if data2 >= 64 else False
+            state.pedal_down = True if data2 >= 64 else False
+        control = data1
+        raw     = data2
+    # Pitch bend, 14 bits
+    elif 224 <= status <= 239:
+        control = axes.PITCH_BEND
+        raw     = data1 | data2 << 7
+    # Channel aftertouch
+    elif 208 <= status <= 223:
+        control = axes.AFTERTOUCH
+        raw     = data1
     # Note on
     elif 144 <= status <= 159:
-        if data1 not in notes_down: notes_down.append(data1)
-        if data1 in notes_rel:      notes_rel.remove(data1)
+        bit = 1 << data1
+        state.held      |= bit
+        state.sounding  |= bit
+        state.released  &= ~bit
+        note_on = data1
     # Note off
-    elif 128 <= 143:
-        notes_rel.append(data1)
+    elif 128 <= status <= 143:
+        bit = 1 << data1
+        state.held      &= ~bit
+        state.released  |= bit
 
     # Clear released notes if not sustaining
-    if not pedal_down:
-        for n in notes_rel:
-            while n in notes_down:
-                notes_down.remove(n)
-        notes_rel.clear()
+    if not state.pedal_down:
+        state.sounding &= ~state.released
+        state.released = 0
+
+    held_notes = state.sounding
+    held_pcs   = matcher.pitch_classes(held_notes)
+    removed    = sounding_before & ~held_notes
+
+    # Continuous bindings only move their axes, output is rate limited
+    if control >= 0:
+        for cb in BINDINGS[ch].controls.get(control, ()): axes.feed(cb, raw)
 
     # Update output
-    # TODO This section needs heavy updating when adding CC functionality
-    for trigger, actions in BINDINGS[ch].items():
-        triggers_down = []
-        value         = -1
-
-        # Notes
-        # Look through all notes_down that belong to this trigger and append
-        # them to list
-        for n in trigger:
-            for m in notes_down:
-                if n in (music.get_note_name(m), music.get_note_name(m, False)):
-                    if n not in triggers_down: triggers_down.append(n)
-                    # Under the if-statement conditions, a "note on" played this
-                    # cycle happened in the current trigger; data2 can be used
-                    # as the value (velocity) for gamepad state updates
-                    if 144 <= status <= 159 and data1 == m: value = data2
+    # Only bindings containing a changed note can change between pressed and
+    # released, so the rest are never looked at
+    affected = BINDINGS[ch].affected(note_on, removed, actions_active)
+    # Longer bindings the note just played belongs to that aren't complete
+    # yet, which shorter ones wait for with a chord window
+    growing = ()
+    if CHORD_WINDOW > 0 and note_on >= 0:
+        growing = [
+            b for b in affected
+            if b.contains(note_on) and not b.matches(held_notes, held_pcs)
+        ]
+    for binding in affected:
+        trigger = binding.trigger
+        if stats.ENABLED: stats.count('bindings')
+        is_down = binding.matches(held_notes, held_pcs)
+
+        # A "note on" played this cycle happened in the current trigger; data2
+        # can be used as the value (velocity) for gamepad state updates
+        value = -1
+        if note_on >= 0 and binding.contains(note_on): value = data2
 
         # Check whether currently processing binding needs updating
-        press_triggered   = (
-            tuple(triggers_down) == trigger and
-            value >= 0
-        )
-        release_triggered = (
-            tuple(triggers_down) != trigger and
-            any(t is trigger for (t, a) in actions_active)
+        if is_down and value >= 0:
+            extenders = [g for g in growing if g.extends(binding)]
+            if len(extenders) > 0:
+                defer_press(ch, binding, value, ts, extenders)
+            else:
+                press_binding(ch, binding, value, actions_active)
+        elif not is_down and trigger in actions_active:
+            release_binding(ch, binding, actions_active)
+
+    # Quick taps let go of within the chord window still get pressed, and
+    # then released
+    if len(PENDING) > 0 and removed:
+        for key in [
+            k for k, p in PENDING.items()
+            if k[0] == ch and not p.binding.matches(held_notes, held_pcs)
+        ]:
+            binding = PENDING[key].binding
+            fire_pending(key)
+            release_binding(ch, binding, actions_active)
+
+    # Chord recognition bindings, one table lookup for all of them
+    chord_bindings = BINDINGS[ch].chords
+    if len(chord_bindings) > 0 and (note_on >= 0 or removed):
+        chord = None
+        if held_notes:
+            bass = ((held_notes & -held_notes).bit_length() - 1) % 12
+            chord = music.recognize(held_pcs, bass)
+        chords_active = state.chords_active
+        for binding in chord_bindings:
+            if stats.ENABLED: stats.count('bindings')
+            is_down = binding.matches(chord)
+            # Every note played into a matching chord presses it again, like
+            # with note bindings
+            if is_down and note_on >= 0:
+                press_binding(ch, binding, data2, chords_active)
+            elif not is_down and binding.trigger in chords_active:
+                release_binding(ch, binding, chords_active)
+
+    # Note sequences, one automaton step per note played
+    sequences = BINDINGS[ch].sequences
+    if sequences != None:
+        sequences_active = state.sequences_active
+        # Velocity 0 note ons stand for note offs on many keyboards, they'd
+        # show up as repeated notes
+        if note_on >= 0 and data2 > 0:
+            if state.sequence == None: state.sequence = sequences.start()
+            ms = ts if ts != None else scheduler.clock() * 1000
+            for binding in sequences.feed(state.sequence, note_on, ms):
+                if stats.ENABLED: stats.count('bindings')
+                state.sequence_notes[binding.trigger] = note_on
+                press_binding(ch, binding, data2, sequences_active)
+        # Completed sequences are held for as long as their last note is
+        if removed and len(sequences_active) > 0:
+            for trigger, binding in list(sequences_active.items()):
+                if not held_notes >> state.sequence_notes[trigger] & 1:
+                    release_binding(ch, binding, sequences_active)
 
-        )
+    return
 
-        for a in actions:
-            rid             = a[0]
-            action          = a[1]
-            action_nosign   = action.replace('+','').replace('-','')
-
-            overlap = False
-            for tr, ac in actions_active:
-                if action_nosign in ac and not tr == trigger:
-                    overlap = True
-
-            # Update press event
-            if press_triggered:
-                apimod.update(rid, action, int(value))
-                # # Add to active actions list
-                if not (trigger, action) in actions_active:
-                    actions_active.append((trigger, action))
-            # Update release event
-            elif release_triggered:
-                if not overlap: apimod.update(rid, action, 0)
-                # # Remove from active actions list
-                while (trigger, action) in actions_active:
-                    actions_active.remove((trigger, action))
-
-    # Load changed state back into the channel state object
-    if 128 <= status <= 239 and ch in CH_STATE:
-        CH_STATE[ch].notes_down     = notes_down
-        CH_STATE[ch].notes_rel      = notes_rel
-        CH_STATE[ch].pedal_down     = pedal_down
-        CH_STATE[ch].actions_active = actions_active
+def press_binding(ch:int, binding, value:int, active:dict) -> None:
+    ''' Press the actions of a binding on channel ch with value '''
+    # Bindings hold their actions through the arbiter, which only releases a
+    # control once nothing else holds it
+    active[binding.trigger] = binding
+    holder = (ch, binding.trigger)
+    # Shorter bindings waiting for this one to complete are dropped
+    if len(PENDING) > 0: absorb_pending(ch, binding)
+    for action in binding.actions:
+        if stats.ENABLED: start = time.perf_counter()
+        arbiter.press(holder, action, int(value))
+        if stats.ENABLED: record_output(start, 'presses')
+
+def release_binding(ch:int, binding, active:dict) -> None:
+    ''' Release the actions of a binding on channel ch '''
+    del active[binding.trigger]
+    holder = (ch, binding.trigger)
+    for action in binding.actions:
+        if stats.ENABLED: start = time.perf_counter()
+        arbiter.release(holder, action)
+        if stats.ENABLED: record_output(start, 'releases')
+
+def defer_press(ch:int, binding, value:int, ts:int, extenders:list) -> None:
+    ''' Hold back the press of a binding for the chord window '''
+    global PENDING, CHORD_WINDOW
+
+    key = (ch, binding.trigger)
+    # Playing a note again doesn't extend the window
+    if key in PENDING: return
+    # A longer binding already complete and waiting takes this one's place
+    if any(
+        p.ch == ch and p.binding.extends(binding) for p in PENDING.values()
+    ):
+        if stats.ENABLED: stats.count('absorbed')
+        return
+    # Shorter bindings waiting for this one to complete are dropped, like
+    # when it's pressed
+    absorb_pending(ch, binding)
+
+    pending = PendingPress(ch, binding, value, extenders)
+    # Time already spent between the note and now counts towards the window
+    age = 0.0
+    if ts != None and stats.input_clock != None:
+        age = max((stats.input_clock() - ts) / 1000, 0)
+    if ts != None: pending.deadline = ts + CHORD_WINDOW * 1000
+    pending.start = scheduler.clock() - age
+    pending.event = scheduler.call_later(
+        max(CHORD_WINDOW - age, 0), fire_due, key
+    )
+    PENDING[key] = pending
+
+def fire_pending(key:tuple) -> None:
+    ''' Press a binding held back by the chord window now '''
+    global PENDING, CH_STATE
+
+    pending = PENDING.pop(key)
+    scheduler.cancel(pending.event)
+    if stats.ENABLED:
+        stats.record('window', scheduler.clock() - pending.start)
+        stats.count('delayed')
+    active = CH_STATE[pending.ch].actions_active
+    press_binding(pending.ch, pending.binding, pending.value, active)
+
+def fire_due(key:tuple) -> None:
+    ''' Press a binding whose chord window ran out between events '''
+    fire_pending(key)
+    # The press may have asked for another layer
+    if NEXT_LAYER != None: apply_layer()
+
+def expire_pending(ts:int) -> None:
+    ''' Press held back bindings whose chord window ended by time ts '''
+    for key in [
+        k for k, p in PENDING.items()
+        if p.deadline != None and p.deadline <= ts
+    ]:
+        fire_pending(key)
+
+def absorb_pending(ch:int, binding) -> None:
+    ''' Drop held back presses waiting for binding to complete '''
+    global PENDING
+
+    for key in [
+        k for k, p in PENDING.items()
+        if p.ch == ch and any(e is binding for e in p.extenders)
+    ]:
+        scheduler.cancel(PENDING.pop(key).event)
+        if stats.ENABLED: stats.count('absorbed')
+
+def swap_bindings(new:dict) -> None:
+    ''' Replace BINDINGS, keeping actions of unchanged bindings held '''
+    global BINDINGS, CH_STATE
+
+    # Held back presses belong to the old bindings, press them now
+    for key in list(PENDING): fire_pending(key)
+
+    for ch, state in CH_STATE.items():
+        new_index = new[ch] if ch in new else matcher.ChannelIndex({})
+        gone = matcher.carry_over(new_index, state.actions_active)
+        gone += matcher.carry_over(new_index, state.chords_active)
+        gone += matcher.carry_over(new_index, state.sequences_active)
+        # Automaton states only mean something to the automata they're from
+        state.sequence = None
+        # Release actions of removed bindings, unless still held by others
+        for trigger, action in gone: arbiter.release((ch, trigger), action)
+
+    for ch in new:
+        if not ch in CH_STATE: CH_STATE[ch] = MIDIChannelState()
+    for ch in list(CH_STATE):
+        if not ch in new: del CH_STATE[ch]
+
+    BINDINGS = new
+    flush_output()
+
+def switch_layer(name:str) -> None:
+    ''' Switch to layer name after the event being handled '''
+    global NEXT_LAYER
+    NEXT_LAYER = name
+
+def apply_layer() -> None:
+    ''' Switch to the layer asked for with switch_layer() '''
+    global LAYERS, LAYER, NEXT_LAYER
+
+    name = NEXT_LAYER
+    NEXT_LAYER = None
+    if name == LAYER or not name in LAYERS.indexes: return
+    LAYER = name
+    # Bindings of the same trigger and action in both layers stay held, the
+    # rest of the old layer's held actions are released
+    swap_bindings(LAYERS.indexes[name])
+
+def layer_hotkey(number:int) -> None:
+    ''' Switch to layer number 1-9 in config order right away '''
+    global LAYERS
+
+    if 1 <= number <= len(LAYERS.names):
+        switch_layer(LAYERS.names[number - 1])
+        apply_layer()
+        print('Layer', LAYER)
+
+def swap_layers(new:matcher.Layers) -> None:
+    ''' Replace LAYERS with a reloaded config, staying on the same layer '''
+    global LAYERS, LAYER
+
+    LAYERS = new
+    if not LAYER in new.indexes: LAYER = new.names[0]
+    swap_bindings(new.indexes[LAYER])
+
+def replay(path:str, realtime:bool = False) -> None:
+    ''' Feed a journal recorded with --record through update_state() '''
+    global apimod, OUTPUT_RATE
+
+    events = journal.read(path)
+    batches = journal.batches(events)
+    if len(batches) == 0: return
+
+    # Simulated clock following the journal timestamps, so timed output
+    # events land at the same time on every replay
+    now = batches[0][0]
+    scheduler.clock = lambda: now
+    first = now
+    wall_start = time.perf_counter()
+
+    def advance(to:float) -> None:
+        ''' Move the simulated clock to time to, running timed events '''
+        nonlocal now
+        while True:
+            due = scheduler.next_due()
+            if due == None or due > to: break
+            now = due
+            if realtime: pace()
+            scheduler.run()
+            flush_output()
+        now = to
+        if realtime: pace()
+
+    def pace() -> None:
+        ''' Sleep until wall clock time catches up with simulated time '''
+        delay = wall_start + (now - first) - time.perf_counter()
+        if delay > 0: time.sleep(delay)
+
+    for ts, batch in batches:
+        advance(ts)
+        update_state(batch)
+        if OUTPUT_RATE != None: flush_output()
+    elapsed = time.perf_counter() - wall_start
+    span = now - first
+    # Let timed events still running finish, turbo would never end though
+    realtime = False
+    advance(now + 1)
+
+    scheduler.clock = time.perf_counter
+    print(
+        f'Replayed {len(events)} events in {len(batches)} batches,',
+        f'{span:.3f} s of input in {elapsed:.3f} s',
+        f'({len(events) / max(elapsed, 1e-9):.0f} events/s,',
+        f'{elapsed / len(events) * 1e6:.1f} us/event)',
+        file = sys.stderr
+    )
 
-    return
+def write_stats(path:str) -> None:
+    ''' Write stats to path now and every STATS_INTERVAL seconds after '''
+    global STATS_INTERVAL
+
+    stats.write(path)
+    scheduler.call_later(STATS_INTERVAL, write_stats, path)
+
+def run(config_path:str, recorder:journal.Writer = None) -> None:
+    ''' Main loop, listens to MIDI input until interrupted '''
+    global POLLING_RATE, WAIT_TIMEOUT, OUTPUT_RATE
+
+    # Watch the config file for changes
+    reloader.start(config_path)
+
+    next_flush = time.perf_counter()
+    while True:
+        if POLLING_RATE == None:
+            # Wake up as soon as there's input, or for the next flush
+            timeout = scheduler.timeout(WAIT_TIMEOUT)
+            if OUTPUT_RATE != None:
+                timeout = min(timeout, next_flush - time.perf_counter())
+            ready = midi.wait(max(timeout, 0))
+        else:
+            # Fixed rate polling, sleeps at the end of the loop
+            ready = midi.poll()
+        # Everything buffered since last wakeup is handled as one batch
+        if ready:
+            events = midi.read()
+            if recorder != None: recorder.write(events)
+            update_state(events)
+
+        # Timed output events (re-presses, holds, turbo, macros)
+        if scheduler.run() > 0 and OUTPUT_RATE == None: flush_output()
+
+        # Fixed rate output flush
+        if OUTPUT_RATE != None and time.perf_counter() >= next_flush:
+            flush_output()
+            # Skip ticks missed while busy instead of catching up
+            next_flush = max(
+                next_flush + OUTPUT_RATE,
+                time.perf_counter()
+            )
+
+        # Swap in the config if it has been changed and compiled, between
+        # batches so no event ever sees half of it
+        new_layers = reloader.take()
+        if new_layers != None:
+            swap_layers(new_layers)
+            print('Reloaded config', config_path)
+
+        # R to reload config on the fly
+        if msvcrt != None and msvcrt.kbhit():
+            key = msvcrt.getch()
+            if key == b'r':
+                reloader.request()
+            # S to print stats
+            elif key == b's' and stats.ENABLED:
+                print(stats.report())
+            # 1-9 to switch layers
+            elif key.isdigit():
+                layer_hotkey(int(key))
+
+        if POLLING_RATE != None:
+            time.sleep(scheduler.timeout(POLLING_RATE))
 
 def main():
     ''' Entry point for pianosouls '''
-    global apimod, CH_STATE, BINDINGS, POLLING_RATE, DEFAULT_API
+    global apimod, midi, msvcrt, CH_STATE, BINDINGS, LAYERS, LAYER
+    global POLLING_RATE, WAIT_TIMEOUT, OUTPUT_RATE, STATS_INTERVAL
+    global CHORD_WINDOW, DEFAULT_API, EXPORT
+    start = stats.phase('import', _IMPORT_START)
 
     # Parse command line arguments
+    from optparse import OptionParser
     opt_parser = OptionParser()
     opt_parser.add_option(
         '--api',
         action = 'store', type = 'string', dest = 'api_module'
     )
+    opt_parser.add_option(
+        '--midi-api',
+        action = 'store', type = 'choice', dest = 'midi_api',
+        choices = list(MIDI_APIS), default = DEFAULT_MIDI_API
+    )
     opt_parser.add_option(
         '-c', '--conf', '--config',
         action = 'store', type = 'string', dest = 'config_path'
@@ -173,12 +641,113 @@ def main():
         '-m', '--midich', '--midichannel',
         action = 'store', type = 'int', dest = 'midi_device_id'
     )
+    opt_parser.add_option(
+        '-i', '--input',
+        action = 'append', type = 'string', dest = 'inputs'
+    )
+    opt_parser.add_option(
+        '--listen-udp',
+        action = 'store', type = 'string', dest = 'listen_udp'
+    )
+    opt_parser.add_option(
+        '--listen-unix',
+        action = 'store', type = 'string', dest = 'listen_unix'
+    )
     opt_parser.add_option(
         '-p', '--poll',
         action = 'store', type = 'int', dest = 'polling_rate'
     )
+    opt_parser.add_option(
+        '--output-rate',
+        action = 'store', type = 'int', dest = 'output_rate'
+    )
+    opt_parser.add_option(
+        '--axis-rate',
+        action = 'store', type = 'int', dest = 'axis_rate'
+    )
+    opt_parser.add_option(
+        '--chord-window',
+        action = 'store', type = 'float', dest = 'chord_window'
+    )
+    opt_parser.add_option(
+        '--conflict',
+        action = 'store', type = 'choice', dest = 'conflict',
+        choices = [arbiter.LAST_WINS, arbiter.MAX, arbiter.SUM],
+        default = arbiter.LAST_WINS
+    )
+    opt_parser.add_option(
+        '--record',
+        action = 'store', type = 'string', dest = 'record_path'
+    )
+    opt_parser.add_option(
+        '--replay',
+        action = 'store', type = 'string', dest = 'replay_path'
+    )
+    opt_parser.add_option(
+        '--realtime',
+        action = 'store_true', dest = 'realtime', default = False
+    )
+    opt_parser.add_option(
+        '--runtime',
+        action = 'store', type = 'choice', dest = 'runtime',
+        choices = ['loop', 'asyncio'], default = 'loop'
+    )
+    opt_parser.add_option(
+        '--compile-config',
+        action = 'store_true', dest = 'compile_config', default = False
+    )
+    opt_parser.add_option(
+        '--stats',
+        action = 'store_true', dest = 'stats', default = False
+    )
+    opt_parser.add_option(
+        '--stats-file',
+        action = 'store', type = 'string', dest = 'stats_path'
+    )
+    opt_parser.add_option(
+        '--stats-interval',
+        action = 'store', type = 'float', dest = 'stats_interval'
+    )
+    opt_parser.add_option(
+        '--export-state',
+        action = 'store', type = 'string', dest = 'export_path'
+    )
+    opt_parser.add_option(
+        '--startup-profile',
+        action = 'store_true', dest = 'startup_profile', default = False
+    )
     (options, args) = opt_parser.parse_args()
 
+    # Ensure existing config file
+    if options.config_path == None:
+        print('Must specify config file')
+        sys.exit(1)
+    options.config_path = os.path.abspath(options.config_path)
+    if not os.path.exists(options.config_path):
+        print('Can\'t find file', options.config_path)
+        sys.exit(1)
+
+    # Only build the config cache
+    if options.compile_config:
+        start = time.perf_counter()
+        cache.compile_config(options.config_path)
+        parse_time = time.perf_counter() - start
+        load_time = cache.load_bindings(options.config_path)[1]
+        print(f'Compiled config in {parse_time * 1000:.1f} ms')
+        print(f'Loading from cache takes {load_time * 1000:.1f} ms')
+        print('Wrote', cache.path_for(options.config_path))
+        sys.exit(0)
+
+    start = stats.phase('arguments', start)
+
+    # Load config, from the parsed cache if it's up to date
+    LAYERS, load_time, cached = cache.load_bindings(options.config_path)
+    print(
+        f'Loaded config in {load_time * 1000:.1f} ms',
+        '(cached)' if cached else '(parsed, cache written)'
+    )
+    start = stats.phase('config', start, 'cached' if cached else 'parsed')
+
     # Default to ViGEm but check if an API module has been specified
     api_module_name = DEFAULT_API
     if options.api_module != None: api_module_name = options.api_module
@@ -188,67 +757,198 @@ def main():
     except ModuleNotFoundError:
         print('Can\'t find module', api_module_name)
         sys.exit(1)
+    actions.apimod = apimod
+    actions.switch_layer = switch_layer
+    axes.apimod = apimod
+    start = stats.phase('output import', start, api_module_name)
 
-    # Ensure existing config file
-    if options.config_path == None:
-        print('Must specify config file')
-        sys.exit(1)
-    options.config_path = os.path.abspath(options.config_path)
-    if not os.path.exists(options.config_path):
-        print('Can\'t find file', options.config_path)
+    # Resolve actions for the output API module, rejecting unknown ones
+    try:
+        matcher.resolve_layers(LAYERS, actions.compile)
+    except ValueError as err:
+        print('Invalid config:', err)
         sys.exit(1)
-    # Load config
-    BINDINGS = config.read_config(options.config_path)
+    # Start on the first layer
+    LAYER = LAYERS.names[0]
+    BINDINGS = LAYERS.indexes[LAYER]
+    if len(LAYERS.names) > 1:
+        print('Layers:', ', '.join(
+            f'{i + 1} {name}' for i, name in enumerate(LAYERS.names)
+        ))
+    start = stats.phase('resolve', start)
 
     # Gather all device ID's specified in config
-    using_devices = []
-    for bn in BINDINGS.values():    # for bind in bindings:
-        for ls in bn.values():      # for list (of actions) in link:
-            for ac in ls:           # for action in list:
-                if not ac[0] in using_devices: using_devices.append(ac[0])
+    using_devices = matcher.layer_devices(LAYERS)
     # Initialize API and output devices
     try:
         apimod.init(using_devices)
     except Exception as err:
         print(err)
         sys.exit(1)
-
-    # Prompt for and open MIDI device for listening
-    if options.midi_device_id == None:
-        options.midi_device_id = midi.prompt_device()
-    if options.midi_device_id == -1:
-        print('No or illegal MIDI input device, exiting')
-        sys.exit(0)
-    midi.open(options.midi_device_id)
+    start = stats.phase('output init', start)
 
     # Create MIDIChannelState object for each MIDI channel listening to
     for ch in BINDINGS: CH_STATE[ch] = MIDIChannelState()
 
-    # Set polling rate
-    if options.polling_rate != None:
+    # Set polling rate, wait for input if not given (or 0)
+    if options.polling_rate != None and options.polling_rate > 0:
         POLLING_RATE = float(1/options.polling_rate)
+    # Set output flush rate, flush after every batch if not given (or 0)
+    if options.output_rate != None and options.output_rate > 0:
+        OUTPUT_RATE = float(1/options.output_rate)
+    # Chord window, given in milliseconds
+    if options.chord_window != None and options.chord_window > 0:
+        CHORD_WINDOW = options.chord_window / 1000
+    # Value of analog controls held by several bindings at once
+    arbiter.MODE = options.conflict
+    # Set analog axis update rate
+    if options.axis_rate != None and options.axis_rate > 0:
+        axes.AXIS_RATE = float(1/options.axis_rate)
+
+    # Latency and event stats
+    if options.stats or options.stats_path != None:
+        stats.ENABLED = True
+    if options.stats_interval != None and options.stats_interval > 0:
+        STATS_INTERVAL = options.stats_interval
+    if options.stats_path != None:
+        write_stats(options.stats_path)
+
+    # Publish live state for overlays and monitors
+    if options.export_path != None:
+        try:
+            EXPORT = statefile.Writer(
+                options.export_path, using_devices,
+                getattr(apimod, 'report', None)
+            )
+        except OSError as err:
+            print('Can\'t export state:', err)
+            apimod.close()
+            sys.exit(1)
+        start = stats.phase('state export', start)
+
+    # Replay a recorded session instead of listening to a MIDI device
+    if options.replay_path != None:
+        if options.startup_profile: print(stats.startup_report())
+        try:
+            replay(options.replay_path, options.realtime)
+        except Exception as err:
+            print(err)
+            sys.exit(1)
+        finally:
+            if stats.ENABLED: print(stats.report(), file = sys.stderr)
+            if options.stats_path != None: stats.write(options.stats_path)
+            actions.stop()
+            axes.stop()
+            arbiter.clear()
+            scheduler.clear()
+            apimod.close()
+            if EXPORT != None: EXPORT.close()
+        sys.exit(0)
 
-    # Main loop
+    # Import the MIDI input module only now, replays don't need one
     try:
-        print(' --- Running - R to reload config - CTRL-C to exit --- ')
-        while True:
-            if midi.DEV.poll():
-                update_state(midi.DEV.read(1))
-
-            # R to reload config on the fly
-            if msvcrt.kbhit():
-                key = msvcrt.getch()
-                if key == b'r':
-                    BINDINGS = config.read_config(options.config_path)
-                    print('Reloaded config', options.config_path)
+        midi = importlib.import_module(
+            '.' + MIDI_APIS[options.midi_api], 'pianosouls'
+        )
+        midi.init()
+    except ImportError as err:
+        print('Can\'t use MIDI API', options.midi_api, f'({err})')
+        apimod.close()
+        sys.exit(1)
+    start = stats.phase('input init', start, options.midi_api)
+
+    # MIDI devices to listen to, by id or name
+    device_ids = []
+    if options.midi_device_id != None:
+        device_ids.append(options.midi_device_id)
+    for spec in options.inputs or []:
+        device_ids.append(midi.find_device(spec))
+        if device_ids[-1] == -1:
+            print('Can\'t find MIDI input device', spec)
+            sys.exit(1)
+    listening = options.listen_udp != None or options.listen_unix != None
+    # Prompt for a device if none given
+    if len(device_ids) == 0 and not listening:
+        device_ids.append(midi.prompt_device())
+        if device_ids[0] == -1:
+            print('No or illegal MIDI input device, exiting')
+            sys.exit(0)
+    # Open MIDI devices for listening
+    try:
+        for d in device_ids: midi.open(d)
+    except Exception as err:
+        print(err)
+        sys.exit(1)
+    # Network input, numbered after the MIDI devices
+    servers = []
+    if listening: from . import ingest
+    try:
+        if options.listen_udp != None:
+            servers.append(ingest.listen_udp(
+                options.listen_udp, len(device_ids) + len(servers) + 1,
+                midi.clock
+            ))
+        if options.listen_unix != None:
+            servers.append(ingest.listen_unix(
+                options.listen_unix, len(device_ids) + len(servers) + 1,
+                midi.clock
+            ))
+    except (OSError, ValueError) as err:
+        print('Can\'t listen for network input:', err)
+        sys.exit(1)
+    for server in servers:
+        midi.add_source(server)
+        print(f'Listening on {server.label} as input {server.number}')
+    midi.start_readers()
+    stats.input_clock = midi.clock
+    start = stats.phase('device open', start)
+    if options.startup_profile: print(stats.startup_report())
+
+    # Keyboard hotkeys are only available on Windows
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+    # Journal all MIDI input if recording
+    recorder = None
+    if options.record_path != None:
+        try:
+            recorder = journal.Writer(options.record_path)
+        except Exception as err:
+            print(err)
+            midi.close()
+            apimod.close()
+            if EXPORT != None: EXPORT.close()
+            sys.exit(1)
 
-            time.sleep(POLLING_RATE)
+    # Main loop
+    try:
+        hotkeys = 'R to reload config'
+        if stats.ENABLED: hotkeys += ' - S for stats'
+        if len(LAYERS.names) > 1: hotkeys += ' - 1-9 for layers'
+        print(f' --- Running - {hotkeys} - CTRL-C to exit --- ')
+        if options.runtime == 'asyncio':
+            from . import aioruntime
+            aioruntime.run(options.config_path, recorder)
+        else:
+            run(options.config_path, recorder)
     except KeyboardInterrupt:
         print('Exiting')
 
+    if stats.ENABLED: print(stats.report())
+    if options.stats_path != None: stats.write(options.stats_path)
+    for server in servers: print(server.report())
+
     # Care says "Bye-bye"
+    actions.stop()
+    axes.stop()
+    arbiter.clear()
+    scheduler.clear()
+    if recorder != None: recorder.close()
     midi.close()
     apimod.close()
+    if EXPORT != None: EXPORT.close()
     sys.exit(0)
 
 if __name__ == '__main__':
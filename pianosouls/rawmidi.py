@@ -0,0 +1,242 @@
+#
+# rawmidi.py
+# pianosouls MIDI input from raw MIDI device files, selected with
+# --midi-api rawmidi
+#
+# Reads ALSA raw MIDI devices (/dev/snd/midiC*D*) or OSS style ones
+# (/dev/midi*) without PortMidi or pygame. Devices are opened non-blocking
+# and waited on with the selectors module, epoll on Linux, so waiting for
+# input costs no CPU time at all. Has the same functions as midi.py.
+#
+
+import io
+import os
+import glob
+import time
+import queue
+import selectors
+
+# Global list of all open devices. Events read from DEVS[i] are tagged with
+# input number i + 1, which config "Input:" declarations refer to.
+DEVS = []
+# Reader threads of other inputs than devices, like ingest.Server
+SOURCES = []
+
+# Device files looked for by find_device() and prompt_device()
+DEVICE_PATTERNS = ('/dev/snd/midiC*D*', '/dev/midi*')
+# Bytes read from a device per call
+READ_SIZE = 4096
+
+# Data bytes following each status byte, system common messages included
+_DATA_LENGTH = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0}
+
+# Waits on device files and the wakeup pipe of sources, created by init()
+_selector = None
+# Pipe sources write into to wake up wait(), created by add_source()
+_wakeup = None
+# clock() starts counting from import
+_start = time.monotonic()
+
+# Open device file and the state of its MIDI byte stream
+class Device:
+    def __init__(self, path:str, number:int):
+        self.path       = path
+        self.number     = number
+        self.fd         = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        # Running status, 0 if none
+        self.status     = 0
+        # Data bytes of the message being read and how many it takes
+        self.data       = []
+        self.length     = 0
+        # Inside a System Exclusive message
+        self.sysex      = False
+
+    def parse(self, buf:bytes, ts:int, events:list) -> None:
+        ''' Append the messages completed by buf to events '''
+        for b in buf:
+            # Real-time messages (clock, active sensing) may appear anywhere,
+            # even in the middle of other messages, and are ignored
+            if b >= 0xF8: continue
+            if b >= 0x80:
+                self.data = []
+                self.sysex = b == 0xF0
+                if b >= 0xF0:
+                    # System messages end running status
+                    self.status = b if b in _DATA_LENGTH else 0
+                    self.length = _DATA_LENGTH.get(b, 0)
+                else:
+                    self.status = b
+                    self.length = 1 if 0xC0 <= b <= 0xDF else 2
+                continue
+            if self.sysex or self.status == 0: continue
+
+            self.data.append(b)
+            if len(self.data) < self.length: continue
+            if self.status < 0xF0:
+                events.append([
+                    [self.status, self.data[0],
+                    self.data[1] if self.length == 2 else 0, 0],
+                    ts, self.number
+                ])
+            else:
+                self.status = 0
+            self.data = []
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+# Wakes up wait() when set from another thread, like threading.Event.set()
+class Wakeup:
+    def __init__(self):
+        self.r, self.w = os.pipe()
+        os.set_blocking(self.r, False)
+        os.set_blocking(self.w, False)
+
+    def set(self) -> None:
+        try:
+            os.write(self.w, b'\0')
+        except BlockingIOError:
+            # Pipe full of wakeups already
+            pass
+
+    def clear(self) -> None:
+        try:
+            while os.read(self.r, READ_SIZE): pass
+        except BlockingIOError:
+            pass
+
+def init() -> None:
+    ''' Set up waiting for input, called before any other function '''
+    global _selector
+    if _selector == None: _selector = selectors.DefaultSelector()
+
+def devices() -> list:
+    ''' Return paths of all raw MIDI device files '''
+    paths = []
+    for pattern in DEVICE_PATTERNS: paths += sorted(glob.glob(pattern))
+    return paths
+
+def device_name(path:str) -> str:
+    ''' Return the name of the sound card of a device file, or its path '''
+    name = os.path.basename(path)
+    # ALSA devices are named midiC<card>D<device>
+    if name.startswith('midiC') and 'D' in name[5:]:
+        card = name[5:].split('D')[0]
+        try:
+            with io.open(f'/proc/asound/card{card}/id', 'r') as f:
+                return f'{f.read().strip()} ({path})'
+        except OSError:
+            pass
+    return path
+
+def open(n) -> None:
+    ''' Open device number n of devices() or a device file path '''
+    global DEVS
+    path = devices()[n] if isinstance(n, int) else n
+    if path in [d.path for d in DEVS]:
+        raise Warning('MIDI device already open')
+
+    dev = Device(path, len(DEVS) + 1)
+    _selector.register(dev.fd, selectors.EVENT_READ, dev)
+    DEVS.append(dev)
+
+def add_source(reader) -> None:
+    ''' Read input from reader alongside devices, call before start_readers '''
+    global SOURCES, _wakeup
+    if _wakeup == None:
+        _wakeup = Wakeup()
+        _selector.register(_wakeup.r, selectors.EVENT_READ, None)
+    reader.ready = _wakeup
+    SOURCES.append(reader)
+
+def close():
+    ''' Close all devices in rawmidi.DEVS and other sources '''
+    global DEVS, SOURCES
+    if len(DEVS) == 0 and len(SOURCES) == 0:
+        raise Warning('MIDI device already closed')
+
+    for s in SOURCES: s.close()
+    SOURCES = []
+    for d in DEVS:
+        # Unplugged devices are no longer waited on
+        if d.fd in _selector.get_map(): _selector.unregister(d.fd)
+        d.close()
+    DEVS = []
+
+def start_readers():
+    ''' Start reading other sources, devices are read as they're waited on '''
+    for s in SOURCES: s.start()
+
+def find_device(spec:str):
+    ''' Return the number of a device by number or name, its path, or -1 '''
+    if spec.isdigit(): return int(spec)
+    # Any device file, virtual ones outside /dev included
+    if os.path.exists(spec): return spec
+
+    paths = devices()
+    for i, path in enumerate(paths):
+        if spec == path or spec.lower() in device_name(path).lower():
+            return i
+    return -1
+
+def poll() -> bool:
+    ''' Return True if there's input waiting to be read '''
+    return len(_selector.select(0)) > 0
+
+def wait(timeout:float) -> bool:
+    ''' Wait at most timeout seconds for input, True if any '''
+    return len(_selector.select(timeout)) > 0
+
+def clock() -> int:
+    ''' Return milliseconds since pianosouls started '''
+    return int((time.monotonic() - _start) * 1000)
+
+def read() -> list:
+    ''' Drain and return all pending input, oldest first '''
+    global DEVS
+
+    events = []
+    now = clock()
+    for key, mask in _selector.select(0):
+        dev = key.data
+        if dev == None: continue
+        try:
+            while True:
+                buf = os.read(dev.fd, READ_SIZE)
+                if len(buf) == 0: raise OSError('End of file')
+                dev.parse(buf, now, events)
+        except BlockingIOError:
+            pass
+        except OSError:
+            # Unplugged, stop waiting on it
+            print('MIDI device', dev.path, 'disconnected')
+            _selector.unregister(dev.fd)
+
+    if _wakeup != None:
+        _wakeup.clear()
+        for s in SOURCES:
+            try:
+                while True: events.append(s.queue.get_nowait())
+            except queue.Empty:
+                pass
+    # Events of each input stay in order, the sort is stable
+    if len(SOURCES) > 0: events.sort(key = lambda e: e[1])
+    return events
+
+def prompt_device() -> int:
+    ''' Interactive prompt for a MIDI device from all available '''
+    paths = devices()
+    print("MIDI input devices available:")
+    for n, path in enumerate(paths):
+        print(f'{n + 1:6}', device_name(path), sep='\t')
+
+    while True:
+        try:
+            d = int(input('Select MIDI device to use (Ctrl-C to quit): '))
+            if 1 <= d <= len(paths): return d - 1
+            raise ValueError('Device index invalid')
+        except ValueError:
+            print('Not a valid input device!')
+        except KeyboardInterrupt:
+            print('\nInterrupted by user, exiting...')
+            return -1
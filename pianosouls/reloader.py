@@ -0,0 +1,70 @@
+#
+# reloader.py
+# pianosouls config file watcher. Changed configs are parsed and compiled in
+# a background thread and handed to the main loop with take().
+#
+
+import os.path
+import threading
+
+from . import cache
+from . import matcher
+from . import actions
+
+# Interval in seconds at which the config file modification time is checked
+CHECK_INTERVAL = 0.5
+
+# Path of the watched config file
+path = None
+# Compiled bindings waiting to be taken by the main loop
+_pending = None
+_lock = threading.Lock()
+# Set to reload right away instead of waiting for the file to change
+_wakeup = threading.Event()
+
+def start(config_path:str) -> None:
+    ''' Start watching config_path for changes '''
+    global path
+    if path != None: raise Warning('Config watcher already running')
+
+    path = config_path
+    threading.Thread(target = _watch, daemon = True).start()
+
+def request() -> None:
+    ''' Reload the config now, even if it hasn't changed '''
+    _wakeup.set()
+
+def take() -> matcher.Layers:
+    ''' Return newly compiled bindings once, None if there are none '''
+    global _pending
+    with _lock:
+        new = _pending
+        _pending = None
+    return new
+
+def _mtime() -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def _watch() -> None:
+    ''' Watcher thread main loop '''
+    global _pending
+
+    mtime = _mtime()
+    while True:
+        forced = _wakeup.wait(CHECK_INTERVAL)
+        _wakeup.clear()
+        new_mtime = _mtime()
+        if new_mtime == None or (new_mtime == mtime and not forced): continue
+        mtime = new_mtime
+
+        try:
+            new = cache.load_bindings(path)[0]
+            matcher.resolve_layers(new, actions.compile)
+        except Exception as err:
+            print('Couldn\'t reload config', path, err)
+            continue
+
+        with _lock: _pending = new
@@ -0,0 +1,724 @@
+#
+# render.py
+# pianosouls offline renderer: evaluates the bindings of a config over a
+# whole Standard MIDI File at once, for checking configs against songs
+#
+# Instead of feeding events one by one through update_state(), every channel
+# is evaluated in a few NumPy passes over the whole song:
+#   1. The notes held after each event, as two 64-bit words per event, are
+#      an XOR scan of the notes each event toggles
+#   2. Notes sounding under the sustain pedal are a segmented OR scan of the
+#      held notes, a segment starting wherever the pedal is up
+#   3. Note bindings are matched against the sounding words of every event
+#      that changes them, in blocks of events x bindings, and presses and
+#      releases are where matching starts, restarts or ends
+#   4. Chord recognition bindings look up the chord of every event in a
+#      table of all pitch class sets and lowest notes
+# Note sequences are fed through their automata note by note, which is cheap
+# next to the rest. The few presses and releases found are then run through
+# the arbiter and the timed actions of the live engine on a simulated clock,
+# so holds, turbo and macros come out like they do live.
+#
+# Continuous control bindings, the chord window and layer switches aren't
+# rendered. The layer given with --layer (the first one by default) is used
+# for the whole song.
+#
+# Output is the state of every control of every device after each change,
+# as CSV with a column per control or as a binary file of changes: MAGIC,
+# the number of control names, the names as NUL terminated UTF-8 and a
+# CHANGE record per change of time in ms, device, name number and level.
+#
+# --check also plays the song through the live engine and compares the two
+# timelines, as a regression oracle for either.
+#
+# Needs NumPy. Run from the repository root:
+# python -m pianosouls.render -c my_config.txt song.mid [-o timeline.csv]
+#
+
+import sys
+import time
+import struct
+import importlib
+from optparse import OptionParser
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import pianosouls as core
+from . import smf
+from . import music
+from . import matcher
+from . import actions
+from . import axes
+from . import arbiter
+from . import scheduler
+from . import journal
+from . import cache
+
+MAGIC = b'PSR\x01'
+COUNT = struct.Struct('<H')
+CHANGE = struct.Struct('<IHHi')
+
+# Cells of an events x bindings block matched at once
+BLOCK_CELLS = 1 << 22
+# Rows of the trigger and overlap tables in the report
+REPORT_ROWS = 20
+
+# Kinds of binding transitions, in the order update_channel() handles them
+NOTES           = 0
+CHORDS          = 1
+SEQUENCES       = 2
+SEQUENCE_ENDS   = 3
+
+# Recognized chord root and quality number by pitch class set * 12 + lowest
+# pitch class, -1 where there's no chord. Built on first use.
+_chord_roots = None
+_chord_qualities = None
+
+def _chord_tables() -> tuple:
+    ''' Return the chord root and quality tables, building them once '''
+    global _chord_roots, _chord_qualities
+    if _chord_roots is None:
+        roots = np.full(4096 * 12, -1, dtype = np.int8)
+        qualities = np.full(4096 * 12, -1, dtype = np.int8)
+        for pcs in range(4096):
+            for bass in range(12):
+                chord = music.recognize(pcs, bass)
+                if chord == None: continue
+                roots[pcs * 12 + bass] = chord.root
+                qualities[pcs * 12 + bass] = (
+                    music.CHORD_QUALITIES.index(chord.quality)
+                )
+        _chord_roots, _chord_qualities = roots, qualities
+    return (_chord_roots, _chord_qualities)
+
+def _words(mask:int) -> tuple:
+    ''' Split a 128-bit note mask into its low and high 64 bits '''
+    return (mask & 0xFFFFFFFFFFFFFFFF, mask >> 64)
+
+def _note_bits(notes):
+    ''' Return low and high words with just the bit of each note, 0 for -1 '''
+    shift = (notes % 64).astype(np.uint64)
+    bit = np.left_shift(np.uint64(1), shift)
+    zero = np.uint64(0)
+    return (
+        np.where((notes >= 0) & (notes < 64), bit, zero),
+        np.where(notes >= 64, bit, zero)
+    )
+
+def _lowest_bit(words):
+    ''' Return the index of the lowest set bit of each word, -1 for 0 '''
+    low = words & (~words + np.uint64(1))
+    with np.errstate(divide = 'ignore'):
+        found = np.log2(low.astype(np.float64))
+    return np.where(words != 0, found, -1).astype(np.int64)
+
+def _segmented_or(x, segments):
+    ''' Return the inclusive OR scan of x, restarting at each new segment '''
+    x = x.copy()
+    step = 1
+    while step < len(x):
+        same = segments[step:] == segments[:-step]
+        x[step:] |= np.where(same, x[:-step], np.uint64(0))
+        step *= 2
+    return x
+
+def sounding(status, data1, data2) -> tuple:
+    ''' Return (low, high, pitch classes) sounding after each event '''
+    # Takes the events of a single channel, notes as 128-bit masks split into
+    # two words, like MIDIChannelState.sounding
+    count = len(status)
+    kind = status & 0xF0
+    is_on = kind == 0x90
+    is_note = is_on | (kind == 0x80)
+
+    # Only ons of notes up and offs of notes down change anything. Sorted by
+    # note, each event is compared to the one before it on the same note.
+    found = np.nonzero(is_note)[0]
+    order = np.lexsort((found, data1[found]))
+    found = found[order]
+    notes = data1[found]
+    down = is_on[found]
+    before = np.zeros(len(found), dtype = bool)
+    same_note = np.zeros(len(found), dtype = bool)
+    same_note[1:] = notes[1:] == notes[:-1]
+    before[1:] = down[:-1]
+    toggles = down != (before & same_note)
+
+    toggle = np.full(count, -1, dtype = np.int64)
+    toggle[found[toggles]] = notes[toggles]
+    low_delta, high_delta = _note_bits(toggle)
+    held_low = np.bitwise_xor.accumulate(low_delta)
+    held_high = np.bitwise_xor.accumulate(high_delta)
+
+    # Sustain pedal position after each event, up until the first one
+    is_pedal = (kind == 0xB0) & (data1 == 64)
+    last = np.maximum.accumulate(np.where(is_pedal, np.arange(count), -1))
+    pedal = (last >= 0) & (data2[np.maximum(last, 0)] >= 64)
+    # Notes held at any point since the pedal was last up keep sounding
+    segments = np.cumsum(~pedal)
+    low = np.where(pedal, _segmented_or(held_low, segments), held_low)
+    high = np.where(pedal, _segmented_or(held_high, segments), held_high)
+
+    pcs = np.zeros(count, dtype = np.int64)
+    for pc in range(12):
+        pc_low, pc_high = _words(sum(1 << n for n in range(pc, 128, 12)))
+        in_pc = (low & np.uint64(pc_low)) | (high & np.uint64(pc_high))
+        pcs |= (in_pc != 0).astype(np.int64) << pc
+    return (low, high, pcs)
+
+def note_transitions(index, low, high, pcs, note_on, velocity) -> list:
+    ''' Return (event, binding, pressed, value) of note bindings in order '''
+    # Bindings never listed in by_note can't ever be matched
+    playable = set()
+    for bindings in index.by_note: playable.update(bindings)
+    bindings = [b for b in index.bindings if b in playable]
+    if len(bindings) == 0 or len(low) == 0: return []
+
+    masks = [_words(b.note_mask) for b in bindings]
+    b_low = np.array([m[0] for m in masks], dtype = np.uint64)
+    b_high = np.array([m[1] for m in masks], dtype = np.uint64)
+    b_pcs = np.array([b.pc_mask for b in bindings], dtype = np.int64)
+
+    # Only events playing a note or changing what sounds can press or
+    # release anything
+    changed = note_on >= 0
+    changed[1:] |= (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+    changed[0] |= (low[0] != 0) | (high[0] != 0)
+    rows = np.nonzero(changed)[0]
+    on_low, on_high = _note_bits(note_on[rows])
+    on_pcs = np.where(
+        note_on[rows] >= 0, np.left_shift(1, note_on[rows] % 12), 0
+    )
+
+    found = []
+    matched_before = np.zeros(len(bindings), dtype = bool)
+    step = max(BLOCK_CELLS // len(bindings), 1)
+    for start in range(0, len(rows), step):
+        r = rows[start:start + step]
+        l, h, p = low[r, None], high[r, None], pcs[r, None]
+        matched = (
+            ((l & b_low) == b_low) & ((h & b_high) == b_high) &
+            ((p & b_pcs) == b_pcs)
+        )
+        before = np.vstack((matched_before[None, :], matched[:-1]))
+        matched_before = matched[-1]
+        # A note played into a matching binding presses it, again if it was
+        # already down
+        s = slice(start, start + step)
+        contains = (
+            ((on_low[s, None] & b_low) != 0) |
+            ((on_high[s, None] & b_high) != 0) |
+            ((on_pcs[s, None] & b_pcs) != 0)
+        )
+        pressed = matched & contains
+        released = before & ~matched
+        for i, j in zip(*np.nonzero(pressed | released)):
+            event = r[i]
+            found.append((
+                event, bindings[j], bool(pressed[i, j]), int(velocity[event])
+            ))
+    return found
+
+def chord_transitions(index, low, high, pcs, note_on, velocity) -> list:
+    ''' Return (event, binding, pressed, value) of chord bindings in order '''
+    if len(index.chords) == 0 or len(low) == 0: return []
+    roots, qualities = _chord_tables()
+
+    lowest = np.where(
+        low != 0, _lowest_bit(low),
+        np.where(high != 0, _lowest_bit(high) + 64, -1)
+    )
+    key = pcs * 12 + np.maximum(lowest, 0) % 12
+    root = np.where(lowest >= 0, roots[key], -1)
+    quality = np.where(lowest >= 0, qualities[key], -1)
+    events = np.arange(len(low))
+    played = note_on >= 0
+
+    found = []
+    for binding in index.chords:
+        matched = quality >= 0
+        if binding.root != -1: matched &= root == binding.root
+        if binding.quality != '':
+            matched &= quality == music.CHORD_QUALITIES.index(binding.quality)
+        pressed = matched & played
+        # Chords can also come about by letting go of notes, without a
+        # press. They're only held from a press until they stop matching.
+        before = np.zeros(len(matched), dtype = bool)
+        before[1:] = matched[:-1]
+        run_start = np.maximum.accumulate(
+            np.where(matched & ~before, events, -1)
+        )
+        last_press = np.maximum.accumulate(np.where(pressed, events, -1))
+        held = matched & (last_press >= run_start)
+        held_before = np.zeros(len(held), dtype = bool)
+        held_before[1:] = held[:-1]
+        released = held_before & ~matched
+        for event in np.nonzero(pressed | released)[0]:
+            found.append((
+                event, binding, bool(pressed[event]), int(velocity[event])
+            ))
+    return found
+
+def sequence_transitions(index, low, high, ms, note_on, velocity) -> tuple:
+    ''' Return (presses, releases) of sequence bindings in order '''
+    # Presses are (event, binding, value) and releases (event, binding), in
+    # the order update_channel() handles them within an event
+    if index.sequences == None: return ([], [])
+    state = index.sequences.start()
+    presses = []
+    releases = []
+    # Pressed sequences by trigger, as [binding, event it stops sounding]
+    active = {}
+
+    def sounding_until(event:int, note:int) -> int:
+        ''' Return the first event after event note doesn't sound after '''
+        words = low if note < 64 else high
+        off = np.nonzero(
+            (words[event + 1:] >> np.uint64(note % 64)) & np.uint64(1)
+            == 0
+        )[0]
+        return event + 1 + off[0] if len(off) > 0 else len(words)
+
+    def release_until(event:int) -> None:
+        ''' Release sequences that stopped sounding before event '''
+        for trigger, (binding, end) in list(active.items()):
+            if end < event:
+                releases.append((end, binding))
+                del active[trigger]
+
+    # Velocity 0 note ons were read as note offs
+    for event in np.nonzero((note_on >= 0) & (velocity > 0))[0]:
+        release_until(event)
+        note = int(note_on[event])
+        for binding in index.sequences.feed(state, note, int(ms[event])):
+            presses.append((event, binding, int(velocity[event])))
+            end = sounding_until(event, note)
+            # Playing a sequence again keeps its place, like a dict key
+            if binding.trigger in active:
+                active[binding.trigger][1] = end
+            else:
+                active[binding.trigger] = [binding, end]
+    release_until(len(low))
+    # Sequences still sounding at the end of the song stay pressed
+    releases = [r for r in releases if r[0] < len(low)]
+    releases.sort(key = lambda r: r[0])
+    return (presses, releases)
+
+def transitions(index:dict, ms, status, data1, data2) -> tuple:
+    ''' Return (sorted transitions, rendered bindings) of all channels '''
+    # Transitions are (event, pass, kind, order, channel, binding, pressed,
+    # value), sorted the way update_event() would come across them
+    found = []
+    rendered = 0
+    for channel in range(16):
+        # Bindings listening to all inputs, and to input 1 only
+        indexes = [
+            (n, ch, index[ch]) for n, ch in enumerate((channel + 1,
+            channel + 17)) if ch in index
+        ]
+        if len(indexes) == 0: continue
+        events = np.nonzero(
+            (status >= 0x80) & (status < 0xF0) & ((status & 0x0F) == channel)
+        )[0]
+        c_status = status[events]
+        c_data1 = data1[events]
+        c_data2 = data2[events]
+        low, high, pcs = sounding(c_status, c_data1, c_data2)
+        note_on = np.where((c_status & 0xF0) == 0x90, c_data1, -1)
+
+        for n, ch, ch_index in indexes:
+            rendered += len(ch_index.bindings) + len(ch_index.chords)
+            rendered += len(ch_index.sequence_bindings)
+            for event, binding, pressed, value in note_transitions(
+                ch_index, low, high, pcs, note_on, c_data2
+            ):
+                found.append((
+                    events[event], n, NOTES, binding.index, ch, binding,
+                    pressed, value
+                ))
+            order = {b.trigger: i for i, b in enumerate(ch_index.chords)}
+            for event, binding, pressed, value in chord_transitions(
+                ch_index, low, high, pcs, note_on, c_data2
+            ):
+                found.append((
+                    events[event], n, CHORDS, order[binding.trigger], ch,
+                    binding, pressed, value
+                ))
+            presses, releases = sequence_transitions(
+                ch_index, low, high, ms[events], note_on, c_data2
+            )
+            for i, (event, binding, value) in enumerate(presses):
+                found.append((
+                    events[event], n, SEQUENCES, i, ch, binding, True, value
+                ))
+            for i, (event, binding) in enumerate(releases):
+                found.append((
+                    events[event], n, SEQUENCE_ENDS, i, ch, binding, False,
+                    0
+                ))
+
+    found.sort(key = lambda t: t[0:4])
+    return (found, rendered)
+
+# Output API stand-in recording the level of every control over time
+class Timeline:
+    def __init__(self):
+        # Level by (device, control name)
+        self.levels     = {}
+        # [(ms, device, control name, level), ...] in order
+        self.changes    = []
+        # Buttons pressed again while down
+        self.represses  = 0
+        # (device, control name) by action, see _control()
+        self.keys       = {}
+
+    def update(self, action:actions.Action, value:int) -> None:
+        level = action.values[value]
+        if action.kind == actions.BUTTON:
+            level = 1 if level > 0 else 0
+            if level and self.levels.get(self.key(action), 0):
+                self.represses += 1
+        self.set(action, level)
+
+    def update_analog(self, action:actions.Action, value:float) -> None:
+        self.set(action, round(value * 32767))
+
+    def set(self, action:actions.Action, level:int) -> None:
+        key = self.key(action)
+        if self.levels.get(key, 0) == level: return
+        self.levels[key] = level
+        self.changes.append(
+            (round(scheduler.clock() * 1000), key[0], key[1], level)
+        )
+
+    def flush(self) -> None:
+        return
+
+    def key(self, action:actions.Action) -> tuple:
+        key = self.keys.get(action)
+        if key == None: key = self.keys[action] = _control(action)
+        return key
+
+def _control(action:actions.Action) -> tuple:
+    ''' Return (device, control name), "+" and "-" of an axis being one '''
+    return (action.rid, action.name.replace('+', '').replace('-', ''))
+
+# Trigger and overlap statistics gathered while playing transitions
+class Report:
+    def __init__(self):
+        # [presses, held ms, first press ms] by (channel, trigger)
+        self.triggers   = {}
+        # Presses of a control already held by another binding, by (device,
+        # control name, holder, other holder)
+        self.overlaps   = {}
+        # Holders by arbiter key
+        self.holders    = {}
+        # Press ms of bindings down, by (channel, trigger)
+        self.down       = {}
+
+    def press(self, ch:int, binding, ms:int) -> None:
+        holder = (ch, binding.trigger)
+        counts = self.triggers.setdefault(holder, [0, 0, ms])
+        counts[0] += 1
+        if not holder in self.down: self.down[holder] = ms
+        for action in binding.actions:
+            holders = self.holders.setdefault(arbiter.key_of(action), [])
+            for other in holders:
+                if other == holder: continue
+                key = _control(action) + (holder, other)
+                self.overlaps[key] = self.overlaps.get(key, 0) + 1
+            if not holder in holders: holders.append(holder)
+
+    def release(self, ch:int, binding, ms:int) -> None:
+        holder = (ch, binding.trigger)
+        self.triggers[holder][1] += ms - self.down.pop(holder)
+        for action in binding.actions:
+            holders = self.holders.get(arbiter.key_of(action), [])
+            if holder in holders: holders.remove(holder)
+
+def _trigger_name(holder:tuple) -> str:
+    ''' Return a (channel, trigger) holder the way configs write it '''
+    ch, trigger = holder
+    if matcher.is_chord(trigger):
+        root = '' if trigger[1] == -1 else (
+            music.PITCH_CLASS_NAMES_SIMPLE[trigger[1]]
+        )
+        quality = trigger[2]
+        name = f'{root or "*"}{quality}' if quality else f'{root}*'
+    elif matcher.is_sequence(trigger):
+        name = ' > '.join(trigger[2:])
+    else:
+        name = ', '.join(trigger)
+    return f'ch {ch} {name}'
+
+# Simulated scheduler clock following song time, like pianosouls.replay()
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+        scheduler.clock = lambda: self.now
+
+    def advance(self, to:float) -> None:
+        ''' Move the clock to time to in seconds, running timed events '''
+        while True:
+            due = scheduler.next_due()
+            if due == None or due > to: break
+            self.now = due
+            scheduler.run()
+        self.now = max(self.now, to)
+
+    def stop(self) -> None:
+        ''' Let timed events still running finish, then use real time '''
+        self.advance(self.now + 1)
+        scheduler.clock = time.perf_counter
+
+def reset(index:dict, timeline:Timeline) -> None:
+    ''' Start over from nothing held, output going to timeline '''
+    actions.stop()
+    axes.stop()
+    arbiter.clear()
+    scheduler.clear()
+    core.PENDING.clear()
+    core.BINDINGS = index
+    core.CH_STATE = {ch: core.MIDIChannelState() for ch in index}
+    # The layer being rendered is kept for the whole song
+    core.LAYERS = None
+    core.NEXT_LAYER = None
+    actions.switch_layer = lambda name: None
+    core.apimod = timeline
+    actions.apimod = timeline
+    axes.apimod = timeline
+
+def render(index:dict, events:list) -> tuple:
+    ''' Return (Timeline, Report, rendered bindings) of events offline '''
+    timeline = Timeline()
+    report = Report()
+    reset(index, timeline)
+    if len(events) == 0: return (timeline, report, 0)
+
+    ms = np.array([e[1] for e in events], dtype = np.int64)
+    messages = np.array([e[0][0:3] for e in events], dtype = np.int64)
+    found, rendered = transitions(
+        index, ms, messages[:, 0], messages[:, 1], messages[:, 2]
+    )
+
+    # Held state per channel, like actions_active, chords_active and
+    # sequences_active of MIDIChannelState
+    active = {}
+    clock = Clock()
+    for event, n, kind, order, ch, binding, pressed, value in found:
+        clock.advance(int(ms[event]) / 1000)
+        held = active.setdefault((ch, min(kind, SEQUENCES)), {})
+        if pressed:
+            report.press(ch, binding, int(ms[event]))
+            core.press_binding(ch, binding, value, held)
+        else:
+            report.release(ch, binding, int(ms[event]))
+            core.release_binding(ch, binding, held)
+    clock.advance(int(ms[-1]) / 1000)
+    clock.stop()
+    for holder, start in report.down.items():
+        report.triggers[holder][1] += int(ms[-1]) - start
+    return (timeline, report, rendered)
+
+def play_live(index:dict, events:list) -> Timeline:
+    ''' Return the Timeline of events played through update_state() '''
+    timeline = Timeline()
+    reset(index, timeline)
+    clock = Clock()
+    for ts, batch in journal.batches(events):
+        clock.advance(ts)
+        core.update_state(batch)
+    clock.stop()
+    return timeline
+
+def compare(offline:list, live:list) -> int:
+    ''' Return the position of the first differing change, -1 if none '''
+    for i, (a, b) in enumerate(zip(offline, live)):
+        if a != b: return i
+    if len(offline) != len(live): return min(len(offline), len(live))
+    return -1
+
+def write_csv(path:str, changes:list) -> None:
+    ''' Write the state of each device after every change as CSV '''
+    names = sorted({c[2] for c in changes})
+    state = {}
+    f = open(path, 'w')
+    f.write(','.join(['time_ms', 'device'] + names) + '\n')
+
+    def write_rows(ms:int, devices:set) -> None:
+        for rid in sorted(devices):
+            levels = state[rid]
+            f.write(','.join(
+                [str(ms), str(rid)] + [str(levels.get(n, 0)) for n in names]
+            ) + '\n')
+
+    # Changes at the same time make up one row per device
+    changed = set()
+    ms = None
+    for c_ms, rid, name, level in changes:
+        if c_ms != ms and len(changed) > 0:
+            write_rows(ms, changed)
+            changed = set()
+        ms = c_ms
+        state.setdefault(rid, {})[name] = level
+        changed.add(rid)
+    if len(changed) > 0: write_rows(ms, changed)
+    f.close()
+
+def write_binary(path:str, changes:list) -> None:
+    ''' Write changes as a binary timeline '''
+    names = sorted({c[2] for c in changes})
+    number = {n: i for i, n in enumerate(names)}
+    f = open(path, 'wb')
+    f.write(MAGIC + COUNT.pack(len(names)))
+    f.write(b''.join(n.encode() + b'\0' for n in names))
+    f.write(b''.join(
+        CHANGE.pack(ms, rid, number[name], level)
+        for ms, rid, name, level in changes
+    ))
+    f.close()
+
+def read_binary(path:str) -> list:
+    ''' Return the changes of a binary timeline as in Timeline.changes '''
+    f = open(path, 'rb')
+    buf = f.read()
+    f.close()
+    if buf[0:len(MAGIC)] != MAGIC:
+        raise Exception(f'{path} is not a pianosouls timeline')
+
+    pos = len(MAGIC) + COUNT.size
+    names = []
+    for i in range(COUNT.unpack_from(buf, len(MAGIC))[0]):
+        end = buf.index(b'\0', pos)
+        names.append(buf[pos:end].decode())
+        pos = end + 1
+    return [
+        (ms, rid, names[name], level)
+        for ms, rid, name, level in CHANGE.iter_unpack(buf[pos:])
+    ]
+
+def print_report(report:Report, rendered:int, timeline:Timeline) -> None:
+    ''' Print trigger and overlap statistics '''
+    print(
+        f'{len(report.triggers)} of {rendered} bindings pressed,',
+        f'{len(timeline.changes)} control changes,',
+        f'{timeline.represses} represses'
+    )
+    if len(report.triggers) > 0:
+        print(f'{"trigger":40}{"presses":>8}{"held s":>10}{"first s":>10}')
+        rows = sorted(report.triggers.items(), key = lambda t: -t[1][0])
+        for holder, (presses, held, first) in rows[:REPORT_ROWS]:
+            print(
+                f'{_trigger_name(holder)[:39]:40}{presses:8}'
+                f'{held / 1000:10.2f}{first / 1000:10.2f}'
+            )
+    if len(report.overlaps) > 0:
+        print(f'{"overlap":60}{"times":>8}')
+        rows = sorted(report.overlaps.items(), key = lambda o: -o[1])
+        for (rid, name, holder, other), times in rows[:REPORT_ROWS]:
+            what = (
+                f'{rid} {name}: {_trigger_name(holder)} over '
+                f'{_trigger_name(other)}'
+            )
+            print(f'{what[:59]:60}{times:8}')
+
+def main():
+    ''' Render a MIDI file through a config '''
+    opt_parser = OptionParser(
+        usage = 'python -m pianosouls.render -c CONFIG SONG.mid [options]'
+    )
+    opt_parser.add_option(
+        '-c', '--conf', '--config',
+        action = 'store', type = 'string', dest = 'config_path'
+    )
+    opt_parser.add_option(
+        '-o', '--output',
+        action = 'store', type = 'string', dest = 'output'
+    )
+    opt_parser.add_option(
+        '--binary',
+        action = 'store_true', dest = 'binary', default = False
+    )
+    opt_parser.add_option(
+        '--layer',
+        action = 'store', type = 'string', dest = 'layer'
+    )
+    opt_parser.add_option(
+        '--api',
+        action = 'store', type = 'string', dest = 'api_module'
+    )
+    opt_parser.add_option(
+        '--check',
+        action = 'store_true', dest = 'check', default = False
+    )
+    (options, args) = opt_parser.parse_args()
+    if options.config_path == None or len(args) != 1:
+        opt_parser.error('Give a config and a MIDI file')
+    if np is None:
+        print('Rendering needs NumPy, install it with pip install numpy')
+        sys.exit(1)
+
+    # Actions are compiled by the output API module, nothing is sent to it
+    api_module_name = options.api_module or core.DEFAULT_API
+    try:
+        actions.apimod = importlib.import_module(
+            '.' + api_module_name, 'pianosouls'
+        )
+    except ImportError:
+        print('Can\'t find module', api_module_name)
+        sys.exit(1)
+    try:
+        layers = cache.load_bindings(options.config_path)[0]
+        matcher.resolve_layers(layers, actions.compile)
+        events = smf.read(args[0])
+    except Exception as err:
+        print(err)
+        sys.exit(1)
+    # Configs are read in upper case
+    layer = options.layer.upper() if options.layer else layers.names[0]
+    if not layer in layers.indexes:
+        print('Unknown layer', layer)
+        sys.exit(1)
+    index = layers.indexes[layer]
+
+    controls = sum(
+        len(c) for i in index.values() for c in i.controls.values()
+    )
+    if controls > 0:
+        print(f'{controls} continuous control bindings aren\'t rendered')
+
+    start = time.perf_counter()
+    timeline, report, rendered = render(index, events)
+    elapsed = time.perf_counter() - start
+    print(
+        f'Rendered {len(events)} events in {elapsed * 1000:.1f} ms',
+        f'({len(events) / max(elapsed, 1e-9):.0f} events/s)'
+    )
+    print_report(report, rendered, timeline)
+
+    if options.output != None:
+        if options.binary:
+            write_binary(options.output, timeline.changes)
+        else:
+            write_csv(options.output, timeline.changes)
+        print('Wrote', options.output)
+
+    if options.check:
+        start = time.perf_counter()
+        live = play_live(index, events)
+        elapsed = time.perf_counter() - start
+        print(f'Played through the live engine in {elapsed * 1000:.1f} ms')
+        i = compare(timeline.changes, live.changes)
+        if i == -1:
+            print(f'Timelines match, {len(live.changes)} changes')
+            sys.exit(0)
+        print(f'Timelines differ from change {i + 1} on:')
+        print('  offline', timeline.changes[i:i + 3])
+        print('  live   ', live.changes[i:i + 3])
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
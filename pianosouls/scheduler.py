@@ -0,0 +1,70 @@
+#
+# scheduler.py
+# pianosouls timed output events
+#
+# All timed events (button re-presses, hold durations, turbo, macros) live in
+# a single heap serviced by the main loop with run(), so no threads are ever
+# created for them and output state is only ever written from one thread.
+#
+
+import time
+import heapq
+from itertools import count
+
+# Clock used for all deadlines, in seconds
+clock = time.perf_counter
+
+# Heap of pending events, ordered by due time and then by scheduling order
+_queue = []
+_order = count()
+
+# Single scheduled call
+class Event:
+    __slots__ = ('due', 'fn', 'args', 'cancelled')
+
+    def __init__(self, due:float, fn, args:tuple):
+        self.due        = due
+        self.fn         = fn
+        self.args       = args
+        self.cancelled  = False
+
+def call_at(due:float, fn, *args) -> Event:
+    ''' Schedule fn(*args) to be called at clock() time due '''
+    event = Event(due, fn, args)
+    heapq.heappush(_queue, (due, next(_order), event))
+    return event
+
+def call_later(delay:float, fn, *args) -> Event:
+    ''' Schedule fn(*args) to be called after delay seconds '''
+    return call_at(clock() + delay, fn, *args)
+
+def cancel(event:Event) -> None:
+    ''' Cancel a scheduled event that hasn't been run yet '''
+    event.cancelled = True
+
+def next_due() -> float:
+    ''' Return the clock() time the next event is due, None if no events '''
+    while len(_queue) > 0 and _queue[0][2].cancelled: heapq.heappop(_queue)
+    if len(_queue) == 0: return None
+    return _queue[0][0]
+
+def timeout(limit:float) -> float:
+    ''' Return seconds until the next event is due, at most limit '''
+    due = next_due()
+    if due == None: return limit
+    return max(min(due - clock(), limit), 0)
+
+def run() -> int:
+    ''' Run all events that are due, return the number of events run '''
+    now = clock()
+    ran = 0
+    while len(_queue) > 0 and _queue[0][0] <= now:
+        event = heapq.heappop(_queue)[2]
+        if event.cancelled: continue
+        event.fn(*event.args)
+        ran += 1
+    return ran
+
+def clear() -> None:
+    ''' Drop all pending events '''
+    _queue.clear()
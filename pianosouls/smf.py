@@ -0,0 +1,130 @@
+#
+# smf.py
+# Standard MIDI File reader for the offline renderer
+#
+# Reads format 0 and 1 files into events in the format of midi.read(),
+# timestamped in milliseconds from the start of the song by the tempo map.
+# Tracks are merged in time order, events at the same tick keeping the order
+# of their tracks. The tracks of format 2 files are merged the same way.
+# System exclusive and meta events other than tempo changes are left out, and
+# a Note On of velocity 0 is read as the Note Off it stands for.
+#
+
+import os.path
+import struct
+
+MAGIC = b'MThd'
+TRACK = b'MTrk'
+HEADER = struct.Struct('>HHH')
+CHUNK = struct.Struct('>4sI')
+
+# Microseconds per quarter note until the first tempo change, 120 bpm
+DEFAULT_TEMPO = 500000
+META_TEMPO = 0x51
+
+# Data bytes following each channel message status, by high nibble
+_DATA_LENGTH = {
+    0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2
+}
+
+def _varlen(buf:bytes, pos:int) -> tuple:
+    ''' Return (variable-length quantity at pos, position after it) '''
+    value = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value = (value << 7) | (b & 0x7F)
+        if b < 0x80: return (value, pos)
+
+def _track(buf:bytes, number:int) -> list:
+    ''' Return [(tick, track, order, [status, data1, data2] or tempo)] '''
+    events = []
+    tick = 0
+    pos = 0
+    status = 0
+    while pos < len(buf):
+        delta, pos = _varlen(buf, pos)
+        tick += delta
+        b = buf[pos]
+        if b == 0xFF:
+            kind = buf[pos + 1]
+            length, pos = _varlen(buf, pos + 2)
+            if kind == META_TEMPO and length == 3:
+                tempo = int.from_bytes(buf[pos:pos + 3], 'big')
+                events.append((tick, number, len(events), tempo))
+            pos += length
+            continue
+        if b == 0xF0 or b == 0xF7:
+            length, pos = _varlen(buf, pos + 1)
+            pos += length
+            continue
+
+        # Running status carries the last status over to data bytes
+        if b >= 0x80:
+            status = b
+            pos += 1
+        elif status == 0:
+            raise ValueError(f'Data byte without status in track {number}')
+        length = _DATA_LENGTH[status & 0xF0]
+        data = list(buf[pos:pos + length])
+        if len(data) < length: raise IndexError('track ends in an event')
+        data.append(0)
+        pos += length
+
+        if status & 0xF0 == 0x90 and data[1] == 0:
+            message = [0x80 | (status & 0x0F), data[0], 0]
+        else:
+            message = [status, data[0], data[1]]
+        events.append((tick, number, len(events), message))
+    return events
+
+def read(path:str) -> list:
+    ''' Return all events of a MIDI file in the format of midi.read() '''
+    if not os.path.exists(path): raise Exception(f'Can\'t find file {path}')
+
+    f = open(path, 'rb')
+    buf = f.read()
+    f.close()
+    if buf[0:4] != MAGIC: raise Exception(f'{path} is not a MIDI file')
+
+    length = CHUNK.unpack_from(buf, 0)[1]
+    ntracks, division = HEADER.unpack_from(buf, CHUNK.size)[1:]
+    pos = CHUNK.size + length
+
+    events = []
+    number = 0
+    try:
+        while number < ntracks and pos < len(buf):
+            kind, length = CHUNK.unpack_from(buf, pos)
+            pos += CHUNK.size
+            # Unknown chunks are to be skipped
+            if kind == TRACK:
+                events += _track(buf[pos:pos + length], number)
+                number += 1
+            pos += length
+    except (IndexError, KeyError, struct.error) as err:
+        raise Exception(f'{path} is a broken MIDI file ({err})')
+    events.sort()
+
+    # Ticks per quarter note, or SMPTE frames per second and ticks per frame
+    if division & 0x8000:
+        fps = 256 - (division >> 8)
+        ms_per_tick = 1000 / (fps * (division & 0xFF))
+    else:
+        ms_per_tick = None
+
+    read_events = []
+    tempo = DEFAULT_TEMPO
+    last_tick = 0
+    ms = 0.0
+    for tick, number, order, message in events:
+        if ms_per_tick != None:
+            ms = tick * ms_per_tick
+        else:
+            ms += (tick - last_tick) * tempo / division / 1000
+        last_tick = tick
+        if isinstance(message, int):
+            tempo = message
+            continue
+        read_events.append([message + [0], round(ms), 1])
+    return read_events
@@ -0,0 +1,212 @@
+#
+# statefile.py
+# pianosouls live state in a memory-mapped file, for stream overlays and
+# other monitors, and a reader for them
+#
+# pianosouls writes the notes held on each channel and the report last sent
+# to each gamepad into the file on every output flush, when started with
+# --export-state. Any number of programs can map the same file and read it
+# as often as they like, without any calls into pianosouls.
+#
+# Layout, all little-endian:
+#   HEADER      MAGIC, sequence number, time of the last write in seconds
+#               since the epoch, running flag, number of channel and device
+#               records in use, name of the current layer (UTF-8, NUL padded)
+#   CHANNEL     MAX_CHANNELS records of channel number, sustain pedal flag
+#               and held and sounding notes as 16 byte masks, bit n standing
+#               for MIDI note n
+#   DEVICE      MAX_DEVICES records of device ID and XUSB_REPORT fields:
+#               buttons, left and right trigger, LX, LY, RX, RY
+#
+# The sequence number is a seqlock. It's odd while a write is under way and
+# even once it's done. Readers copy the file between two reads of it and try
+# again unless both reads got the same even number, so the writer never has
+# to wait for anyone.
+#
+# Run the terminal monitor with:
+# python -m pianosouls.monitor state.pss
+#
+
+import time
+import mmap
+import struct
+
+MAGIC = b'PSS\x01'
+HEADER = struct.Struct('<4sIdBxHH32s')
+CHANNEL = struct.Struct('<HBx16s16s')
+DEVICE = struct.Struct('<HHBBhhhh')
+# XUSB_REPORT as returned by the report() function of output API modules
+REPORT = struct.Struct('<HBBhhhh')
+SEQUENCE = struct.Struct('<I')
+SEQUENCE_AT = 4
+
+MAX_CHANNELS = 128
+MAX_DEVICES = 16
+CHANNELS_AT = HEADER.size
+DEVICES_AT = CHANNELS_AT + MAX_CHANNELS * CHANNEL.size
+SIZE = DEVICES_AT + MAX_DEVICES * DEVICE.size
+
+# Times a reader tries for a copy not torn by a write
+RETRIES = 100
+
+# XUSB_REPORT button bits, like vigemclient.BUTTONS
+BUTTONS = {
+    'UP':       0x0001,
+    'DOWN':     0x0002,
+    'LEFT':     0x0004,
+    'RIGHT':    0x0008,
+    'START':    0x0010,
+    'BACK':     0x0020,
+    'LS':       0x0040,
+    'RS':       0x0080,
+    'LB':       0x0100,
+    'RB':       0x0200,
+    'GUIDE':    0x0400,
+    'A':        0x1000,
+    'B':        0x2000,
+    'X':        0x4000,
+    'Y':        0x8000
+}
+
+# Writes live state into a state file, used by pianosouls.py
+class Writer:
+    def __init__(self, path:str, devices:list, report):
+        self.path       = path
+        # Device ID's of the records, and a function returning the
+        # XUSB_REPORT bytes of a device, None if the output API has none
+        self.devices    = sorted(devices)[:MAX_DEVICES]
+        self.report     = report
+        self.seq        = 0
+        self.file       = open(path, 'w+b')
+        self.file.truncate(SIZE)
+        self.map        = mmap.mmap(
+            self.file.fileno(), SIZE, access = mmap.ACCESS_WRITE
+        )
+        self.publish({}, '')
+
+    def publish(self, channels:dict, layer:str, running:bool = True) -> None:
+        ''' Write MIDIChannelState's by channel and every device report '''
+        m = self.map
+        self.seq += 1
+        SEQUENCE.pack_into(m, SEQUENCE_AT, self.seq & 0xFFFFFFFF)
+
+        n = 0
+        for ch, state in channels.items():
+            if n == MAX_CHANNELS: break
+            CHANNEL.pack_into(
+                m, CHANNELS_AT + n * CHANNEL.size, ch, state.pedal_down,
+                state.held.to_bytes(16, 'little'),
+                state.sounding.to_bytes(16, 'little')
+            )
+            n += 1
+        devices = 0
+        if self.report != None:
+            for i, rid in enumerate(self.devices):
+                DEVICE.pack_into(
+                    m, DEVICES_AT + i * DEVICE.size,
+                    rid, *REPORT.unpack(self.report(rid))
+                )
+            devices = len(self.devices)
+
+        # The header goes last, evening out the sequence number
+        self.seq += 1
+        HEADER.pack_into(
+            m, 0, MAGIC, self.seq & 0xFFFFFFFF, time.time(), running, n,
+            devices, layer.encode()[:32]
+        )
+
+    def close(self) -> None:
+        ''' Mark the state as no longer running, readers keep the file '''
+        self.publish({}, '', False)
+        self.map.close()
+        self.file.close()
+
+# Notes of one channel
+class Channel:
+    __slots__ = ('number', 'pedal', 'held', 'sounding')
+
+    def __init__(self, number:int, pedal:bool, held:int, sounding:int):
+        self.number     = number
+        self.pedal      = pedal
+        # Note masks like MIDIChannelState's
+        self.held       = held
+        self.sounding   = sounding
+
+# Last report sent to one gamepad
+class Device:
+    __slots__ = (
+        'rid', 'buttons', 'left_trigger', 'right_trigger', 'lx', 'ly', 'rx',
+        'ry'
+    )
+
+    def __init__(self, rid, buttons, left_trigger, right_trigger, lx, ly,
+        rx, ry):
+        self.rid            = rid
+        # XUSB_REPORT fields, see BUTTONS for the bits of buttons
+        self.buttons        = buttons
+        self.left_trigger   = left_trigger
+        self.right_trigger  = right_trigger
+        self.lx             = lx
+        self.ly             = ly
+        self.rx             = rx
+        self.ry             = ry
+
+    def pressed(self) -> list:
+        ''' Return the names of the buttons pressed '''
+        return [name for name, bit in BUTTONS.items() if self.buttons & bit]
+
+# Everything in a state file at one moment
+class Snapshot:
+    __slots__ = ('seq', 'time', 'running', 'layer', 'channels', 'devices')
+
+    def __init__(self, data:bytes):
+        magic, self.seq, self.time, running, channels, devices, layer = (
+            HEADER.unpack_from(data)
+        )
+        self.running    = running != 0
+        self.layer      = layer.rstrip(b'\0').decode(errors = 'replace')
+        self.channels   = []
+        for i in range(min(channels, MAX_CHANNELS)):
+            ch, pedal, held, sounding = CHANNEL.unpack_from(
+                data, CHANNELS_AT + i * CHANNEL.size
+            )
+            self.channels.append(Channel(
+                ch, pedal != 0, int.from_bytes(held, 'little'),
+                int.from_bytes(sounding, 'little')
+            ))
+        self.devices    = [
+            Device(*DEVICE.unpack_from(data, DEVICES_AT + i * DEVICE.size))
+            for i in range(min(devices, MAX_DEVICES))
+        ]
+
+# Reads a state file written by another process
+class Reader:
+    def __init__(self, path:str):
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(
+                self.file.fileno(), SIZE, access = mmap.ACCESS_READ
+            )
+        except (ValueError, OSError):
+            self.file.close()
+            raise ValueError(f'{path} is not a pianosouls state file')
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a pianosouls state file')
+
+    def sequence(self) -> int:
+        ''' Return the sequence number, which changes on every write '''
+        return SEQUENCE.unpack_from(self.map, SEQUENCE_AT)[0]
+
+    def read(self) -> Snapshot:
+        ''' Return the current state, None if it was being written to '''
+        for i in range(RETRIES):
+            before = self.sequence()
+            if before & 1: continue
+            data = self.map[:SIZE]
+            if self.sequence() == before: return Snapshot(data)
+        return None
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,117 @@
+#
+# stats.py
+# pianosouls latency histograms and event counters
+#
+# Stages measured, all in seconds:
+#   input       PortMidi timestamp -> update_state() entry
+#   dispatch    update_state() entry -> output API update() call
+#   update      output API update() call -> return
+#   flush       output API flush() call -> return (driver round-trip)
+#   window      note -> press, for presses held back by the chord window
+# Call sites check ENABLED before measuring anything, so disabled stats cost
+# next to nothing.
+#
+# Startup phases (imports, config, backends, devices) are timed once each on
+# every start and shown with --startup-profile.
+#
+
+import time
+
+# Whether anything is measured at all, set by pianosouls.main()
+ENABLED = False
+# Function returning the current PortMidi time in milliseconds, None if event
+# timestamps aren't comparable to wall clock time (eg. replays)
+input_clock = None
+
+# Number of histogram buckets. Bucket i counts latencies of less than 2**i
+# microseconds, the last bucket everything longer.
+BUCKETS = 28
+
+# Fixed bucket latency histogram
+class Histogram:
+    __slots__ = ('counts', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.total  = 0
+        self.max    = 0.0
+
+    def add(self, seconds:float) -> None:
+        ''' Count a latency '''
+        i = min(int(max(seconds, 0) * 1e6).bit_length(), BUCKETS - 1)
+        self.counts[i] += 1
+        self.total += 1
+        if seconds > self.max: self.max = seconds
+
+    def percentile(self, p:float) -> float:
+        ''' Return the upper bound in seconds of the bucket holding p % '''
+        if self.total == 0: return 0.0
+        rank = self.total * p / 100
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank: return min(2**i / 1e6, self.max)
+        return self.max
+
+STAGES = ('input', 'dispatch', 'update', 'flush', 'window')
+COUNTERS = (
+    'events', 'bindings', 'presses', 'releases', 'represses', 'delayed',
+    'absorbed'
+)
+
+HISTOGRAMS = {}
+COUNTS = {}
+# Startup phases as (name, seconds, note), in the order they ran
+PHASES = []
+
+def reset() -> None:
+    ''' Forget everything measured so far '''
+    for s in STAGES: HISTOGRAMS[s] = Histogram()
+    for c in COUNTERS: COUNTS[c] = 0
+
+reset()
+
+def record(stage:str, seconds:float) -> None:
+    ''' Record a latency for a stage '''
+    HISTOGRAMS[stage].add(seconds)
+
+def count(counter:str, n:int = 1) -> None:
+    ''' Increment a counter '''
+    COUNTS[counter] += n
+
+def _format(seconds:float) -> str:
+    if seconds >= 1e-3: return f'{seconds * 1e3:.2f} ms'
+    return f'{seconds * 1e6:.0f} us'
+
+def report() -> str:
+    ''' Return everything measured as a human readable table '''
+    lines = [f'{"stage":10}{"count":>10}{"p50":>14}{"p99":>14}{"max":>14}']
+    for s in STAGES:
+        h = HISTOGRAMS[s]
+        lines.append(
+            f'{s:10}{h.total:10}{_format(h.percentile(50)):>14}'
+            f'{_format(h.percentile(99)):>14}{_format(h.max):>14}'
+        )
+    lines.append('  '.join(f'{c} {COUNTS[c]}' for c in COUNTERS))
+    return '\n'.join(lines)
+
+def phase(name:str, start:float, note:str = '') -> float:
+    ''' Record a startup phase begun at perf_counter() start, return now '''
+    now = time.perf_counter()
+    PHASES.append((name, now - start, note))
+    return now
+
+def startup_report() -> str:
+    ''' Return the startup phases as a human readable table '''
+    lines = [f'{"phase":16}{"time":>14}']
+    for name, seconds, note in PHASES:
+        lines.append(f'{name:16}{_format(seconds):>14}  {note}'.rstrip())
+    total = sum(p[1] for p in PHASES)
+    lines.append(f'{"total":16}{_format(total):>14}')
+    return '\n'.join(lines)
+
+def write(path:str) -> None:
+    ''' Write a timestamped report to a text file '''
+    f = open(path, 'w')
+    f.write(time.strftime('%Y-%m-%d %H:%M:%S') + '\n' + report() + '\n')
+    f.close()
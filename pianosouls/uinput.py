@@ -0,0 +1,304 @@
+#
+# uinput.py
+# pianosouls Linux output API module, virtual Xbox 360 style gamepads
+# through /dev/uinput
+#
+# Changes are queued as input_event records and written to each gamepad in
+# a single write() per flush(), ending in one SYN_REPORT. Games see the whole
+# batch as one update, like a ViGEm report. A control changing twice before
+# a flush gets a SYN_REPORT in between, so no press is ever lost.
+#
+# Writing to /dev/uinput usually needs a udev rule or membership of the
+# group owning it.
+#
+
+import os
+import fcntl
+import struct
+
+from . import scheduler
+from . import stats
+from . import statefile
+from .actions import Action, BUTTON, AXIS, TRIGGER
+
+# Device file of the uinput kernel module
+DEVICE_PATH = '/dev/uinput'
+
+# Interval in seconds at which buttons are de-pressed and then re-pressed
+BUTTON_REPRESS_RATE = 1/30
+
+# Event types and codes from linux/input-event-codes.h
+EV_SYN      = 0x00
+EV_KEY      = 0x01
+EV_ABS      = 0x03
+SYN_REPORT  = 0
+
+BUTTONS = {
+    'A':        0x130,  # BTN_A
+    'B':        0x131,  # BTN_B
+    'X':        0x133,  # BTN_X
+    'Y':        0x134,  # BTN_Y
+    'LB':       0x136,  # BTN_TL
+    'RB':       0x137,  # BTN_TR
+    'BACK':     0x13a,  # BTN_SELECT
+    'START':    0x13b,  # BTN_START
+    'GUIDE':    0x13c,  # BTN_MODE
+    'LS':       0x13d,  # BTN_THUMBL
+    'RS':       0x13e,  # BTN_THUMBR
+    # The D-pad is a hat switch, like on Xbox 360 pads. The BTN_DPAD_* codes
+    # only tell it apart internally.
+    'UP':       0x220,
+    'DOWN':     0x221,
+    'LEFT':     0x222,
+    'RIGHT':    0x223,
+}
+# D-pad buttons as (hat axis, direction)
+ABS_HAT0X   = 0x10
+ABS_HAT0Y   = 0x11
+DPAD = {
+    0x220:  (ABS_HAT0Y, -1),
+    0x221:  (ABS_HAT0Y, 1),
+    0x222:  (ABS_HAT0X, -1),
+    0x223:  (ABS_HAT0X, 1),
+}
+AXES = {
+    'LX':       0x00,   # ABS_X
+    'LY':       0x01,   # ABS_Y
+    'RX':       0x03,   # ABS_RX
+    'RY':       0x04,   # ABS_RY
+}
+TRIGGERS = {
+    'LT':       0x02,   # ABS_Z
+    'RT':       0x05,   # ABS_RZ
+}
+# Up is negative on evdev Y axes, positive on Xbox ones
+FLIPPED = (0x01, 0x04)
+# (min, max) of each absolute axis
+RANGES = {code: (-32768, 32767) for code in AXES.values()}
+RANGES.update({code: (0, 255) for code in TRIGGERS.values()})
+RANGES.update({ABS_HAT0X: (-1, 1), ABS_HAT0Y: (-1, 1)})
+
+# ioctl requests from linux/uinput.h
+UI_DEV_CREATE   = 0x5501
+UI_DEV_DESTROY  = 0x5502
+UI_SET_EVBIT    = 0x40045564
+UI_SET_KEYBIT   = 0x40045565
+UI_SET_ABSBIT   = 0x40045567
+
+# struct input_event, time left for the kernel to fill in
+EVENT = struct.Struct('llHHi')
+SYN = EVENT.pack(0, 0, EV_SYN, SYN_REPORT, 0)
+# struct uinput_user_dev: name, bus, vendor, product, version, effects and
+# absmax, absmin, absfuzz, absflat of 64 axes each
+USER_DEV = struct.Struct('80sHHHHi' + '64i' * 4)
+# Identify as a wired Xbox 360 pad, which games have mappings for
+BUS_USB     = 0x03
+VENDOR      = 0x045e
+PRODUCT     = 0x028e
+VERSION     = 0x0110
+
+# Virtual gamepad
+class Pad:
+    def __init__(self, fd:int):
+        self.fd         = fd
+        # Key codes pressed down
+        self.keys       = set()
+        # Absolute axis values by code
+        self.abs        = {code: 0 for code in RANGES}
+        # Packed events waiting for flush(), and (type, code) pairs among
+        # them since the last SYN_REPORT
+        self.queued     = []
+        self.frame      = set()
+        # Scheduled re-presses by key code
+        self.repressing = {}
+
+    def emit(self, type:int, code:int, value:int) -> None:
+        ''' Queue an event, after a SYN_REPORT if code already changed '''
+        if (type, code) in self.frame:
+            self.queued.append(SYN)
+            self.frame.clear()
+        self.queued.append(EVENT.pack(0, 0, type, code, value))
+        self.frame.add((type, code))
+
+    def set_key(self, code:int, pressed:bool) -> None:
+        ''' Press or release a button '''
+        if pressed == (code in self.keys): return
+        if pressed:
+            self.keys.add(code)
+        else:
+            self.keys.discard(code)
+        if not code in DPAD:
+            self.emit(EV_KEY, code, int(pressed))
+            return
+        # Hat value from the D-pad buttons held on the same axis
+        hat = DPAD[code][0]
+        self.set_abs(hat, sum(
+            d for c, (h, d) in DPAD.items() if h == hat and c in self.keys
+        ))
+
+    def cancel_repress(self, code:int) -> None:
+        ''' Cancel the scheduled re-press of a button, if there is one '''
+        event = self.repressing.pop(code, None)
+        if event != None: scheduler.cancel(event)
+
+    def set_abs(self, code:int, value:int) -> None:
+        ''' Move an absolute axis, clamped to its range '''
+        low, high = RANGES[code]
+        value = min(max(value, low), high)
+        if value == self.abs[code]: return
+        self.abs[code] = value
+        self.emit(EV_ABS, code, value)
+
+# Pad by device ID
+pads = {}
+# Global set of device ID's with queued events since the last flush()
+dirty = set()
+
+def compile_action(rid:int, name:str) -> Action:
+    ''' Resolve action string name on device rid, ValueError if unknown '''
+    real_action = name.replace('+','').replace('-','')
+    if real_action in BUTTONS:
+        kind, control = BUTTON, BUTTONS[real_action]
+    elif real_action in TRIGGERS:
+        kind, control = TRIGGER, TRIGGERS[real_action]
+    elif real_action in AXES:
+        kind, control = AXIS, AXES[real_action]
+    else:
+        raise ValueError(f'Unknown uinput action {name} on device {rid}')
+
+    values = []
+    for value in range(128):
+        # Compensate for piano velocity, like vigemclient
+        value = min(max(int(value * (3/2)), 0), 127)
+        if kind == TRIGGER:
+            value *= 2
+        elif kind == AXIS:
+            if '-' in name: value = (-value) - 1
+            value <<= 8
+            if control in FLIPPED: value = -value
+        values.append(value)
+
+    return Action(rid, name, kind, control, tuple(values))
+
+def update(action:Action, value:int):
+    ''' Update the state of a gamepad, sent on the next flush() '''
+    global pads, dirty, BUTTON_REPRESS_RATE
+
+    rid   = action.rid
+    level = action.values[value]
+    pad   = pads[rid]
+    if action.kind == BUTTON:
+        # Whatever comes next replaces a re-press still waiting
+        pad.cancel_repress(action.control)
+        if level > 0 and action.control in pad.keys:
+            # Release now and press again after a moment
+            if stats.ENABLED: stats.count('represses')
+            pad.repressing[action.control] = scheduler.call_later(
+                BUTTON_REPRESS_RATE, update, action, value
+            )
+            pad.set_key(action.control, False)
+        else:
+            pad.set_key(action.control, level > 0)
+    else:
+        pad.set_abs(action.control, level)
+
+    dirty.add(rid)
+
+def update_analog(action:Action, value:float):
+    ''' Set a control of a gamepad to an analog value from axes.py '''
+    global pads, dirty
+
+    # Signed actions get 0-1 along their direction, others -1-1 across the
+    # whole range
+    if action.sign != 0:
+        level = value
+        value *= action.sign
+    else:
+        level = (value + 1) / 2
+
+    pad = pads[action.rid]
+    if action.kind == BUTTON:
+        pad.cancel_repress(action.control)
+        pad.set_key(action.control, level >= 0.5)
+    elif action.kind == TRIGGER:
+        pad.set_abs(action.control, round(level * 255))
+    else:
+        if action.control in FLIPPED: value = -value
+        scale = 32768 if value < 0 else 32767
+        pad.set_abs(action.control, round(value * scale))
+
+    dirty.add(action.rid)
+
+def flush():
+    ''' Write the queued events of every changed gamepad at once '''
+    global pads, dirty
+
+    for rid in dirty:
+        pad = pads[rid]
+        if len(pad.queued) == 0: continue
+        pad.queued.append(SYN)
+        os.write(pad.fd, b''.join(pad.queued))
+        pad.queued.clear()
+        pad.frame.clear()
+    dirty.clear()
+
+def report(rid:int) -> bytes:
+    ''' Return the state of a gamepad as an XUSB_REPORT, for statefile.py '''
+    global pads
+
+    pad = pads[rid]
+    buttons = 0
+    for name, code in BUTTONS.items():
+        if code in pad.keys: buttons |= statefile.BUTTONS[name]
+    # Back to Xbox directions, where up is positive
+    lx, ly, rx, ry = (
+        min(-pad.abs[code], 32767) if code in FLIPPED else pad.abs[code]
+        for code in AXES.values()
+    )
+    return statefile.REPORT.pack(
+        buttons, pad.abs[TRIGGERS['LT']], pad.abs[TRIGGERS['RT']],
+        lx, ly, rx, ry
+    )
+
+def init(devices):
+    ''' Create a virtual gamepad for each device ID '''
+    global pads
+
+    for d in devices:
+        try:
+            fd = os.open(DEVICE_PATH, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as err:
+            raise Exception(
+                f'Can\'t open {DEVICE_PATH}, is the uinput module loaded '
+                f'and writable? ({err.strerror})'
+            )
+
+        fcntl.ioctl(fd, UI_SET_EVBIT, EV_SYN)
+        fcntl.ioctl(fd, UI_SET_EVBIT, EV_KEY)
+        fcntl.ioctl(fd, UI_SET_EVBIT, EV_ABS)
+        for code in BUTTONS.values():
+            if not code in DPAD: fcntl.ioctl(fd, UI_SET_KEYBIT, code)
+        absmax = [0] * 64
+        absmin = [0] * 64
+        for code, (low, high) in RANGES.items():
+            fcntl.ioctl(fd, UI_SET_ABSBIT, code)
+            absmin[code] = low
+            absmax[code] = high
+        os.write(fd, USER_DEV.pack(
+            f'pianosouls gamepad {d}'.encode(),
+            BUS_USB, VENDOR, PRODUCT, VERSION, 0,
+            *absmax, *absmin, *([0] * 64), *([0] * 64)
+        ))
+        fcntl.ioctl(fd, UI_DEV_CREATE)
+        pads[d] = Pad(fd)
+
+def close():
+    ''' Remove all virtual gamepads '''
+    global pads
+
+    flush()
+
+    for pad in pads.values():
+        fcntl.ioctl(pad.fd, UI_DEV_DESTROY)
+        os.close(pad.fd)
+    pads.clear()
@@ -4,7 +4,10 @@
 
 import os
 from ctypes import *
-from threading import Timer
+
+from . import scheduler
+from . import stats
+from .actions import Action, BUTTON, AXIS, TRIGGER
 
 # Global ViGEm DLL (module) reference
 dll = None
@@ -14,6 +17,13 @@ client = None
 pads = {}
 # Global dictionary with each controller's current state stored
 pad_states = {}
+# Global set of device ID's whose state has changed since the last flush()
+dirty = set()
+# Global dictionary with the last report bytes sent to each controller
+sent_reports = {}
+# Global dictionary with (device ID, button bit) pointing to the scheduled
+# re-press of that button
+repressing = {}
 
 # Interval in seconds at which buttons are de-pressed and then re-pressed
 BUTTON_REPRESS_RATE = 1/30
@@ -41,10 +51,10 @@ AXES = [
     'RX',
     'RY'
 ]
-TRIGGERS = [
-    'LT',
-    'RT'
-]
+TRIGGERS = {
+    'LT':       'bLeftTrigger',
+    'RT':       'bRightTrigger'
+}
 
 # Gamepad state class
 class XUSB_REPORT(Structure):
@@ -58,44 +68,132 @@ class XUSB_REPORT(Structure):
         ('sThumbRY', c_short)
     ]
 
-def update(rid:int, action:str, value:int):
-    ''' Update the state of the ViGEm gamepad '''
-    global dll, pads, pad_states, BUTTON_REPRESS_RATE
-
-    # Compensate for piano velocity
-    # NOTE Shaky
-    value = int(value * (3/2))
-    # Clamp between accepted values
-    value = max(value, 0)
-    value = min(value, 127)
-
-    # Check if signed axis
-    if '-' in action: value = (-value) - 1
-    real_action = action.replace('+','').replace('-','')
-
+def compile_action(rid:int, name:str) -> Action:
+    ''' Resolve action string name on device rid, ValueError if unknown '''
+    real_action = name.replace('+','').replace('-','')
     if real_action in BUTTONS:
-        is_pressed = pad_states[rid].wButtons & BUTTONS[real_action] != 0
-        if value > 0 and is_pressed:
-            # TODO Scary multithreading, I'm certain this breaks everything
-            # in a way I could never have imagined but hey life's short
-            Timer(BUTTON_REPRESS_RATE, update, (rid, real_action, value)).start()
-        pad_states[rid].wButtons ^= BUTTONS[real_action]
+        kind, control, shift = BUTTON, BUTTONS[real_action], 0
     elif real_action in TRIGGERS:
-        if real_action == 'LT':
-            pad_states[rid].bLeftTrigger = value
-        else:
-            pad_states[rid].bRightTrigger = value
+        kind, control, shift = TRIGGER, TRIGGERS[real_action], 0
     elif real_action in AXES:
-        if   real_action == 'LX':
-            pad_states[rid].sThumbLX = value << 8
-        elif real_action == 'LY':
-            pad_states[rid].sThumbLY = value << 8
-        elif real_action == 'RX':
-            pad_states[rid].sThumbRX = value << 8
-        elif real_action == 'RY':
-            pad_states[rid].sThumbRY = value << 8
-
-    dll.vigem_target_x360_update(client, pads[rid], pad_states[rid])
+        kind, control, shift = AXIS, 'sThumb' + real_action, 8
+    else:
+        raise ValueError(f'Unknown ViGEm action {name} on device {rid}')
+
+    values = []
+    for value in range(128):
+        # Compensate for piano velocity
+        # NOTE Shaky
+        value = int(value * (3/2))
+        # Clamp between accepted values
+        value = max(value, 0)
+        value = min(value, 127)
+        # Check if signed axis
+        if '-' in name: value = (-value) - 1
+        values.append(value << shift)
+
+    return Action(rid, name, kind, control, tuple(values))
+
+def update(action:Action, value:int):
+    ''' Update the state of the ViGEm gamepad, sent on the next flush() '''
+    global pad_states, sent_reports, dirty, repressing, BUTTON_REPRESS_RATE
+
+    rid   = action.rid
+    level = action.values[value]
+    state = pad_states[rid]
+    if action.kind == BUTTON:
+        bit = action.control
+        # Whatever comes next replaces a re-press still waiting
+        _cancel_repress(rid, bit)
+        is_pressed = state.wButtons & bit != 0
+        if level > 0 and is_pressed:
+            # Release now and press again after a moment
+            if stats.ENABLED: stats.count('represses')
+            repressing[(rid, bit)] = scheduler.call_later(
+                BUTTON_REPRESS_RATE, update, action, value
+            )
+        # A press not sent yet would be lost when released, send it first
+        if is_pressed and sent_reports[rid].wButtons & bit == 0: _submit(rid)
+        if level > 0 and not is_pressed:
+            state.wButtons |= bit
+        else:
+            state.wButtons &= ~bit
+    else:
+        _set_field(rid, action.control, level)
+
+    dirty.add(rid)
+
+def update_analog(action:Action, value:float):
+    ''' Set a control of the ViGEm gamepad to an analog value from axes.py '''
+    global pad_states, sent_reports, dirty
+
+    # Signed actions get 0-1 along their direction, others -1-1 across the
+    # whole range
+    if action.sign != 0:
+        level = value
+        value *= action.sign
+    else:
+        level = (value + 1) / 2
+
+    rid   = action.rid
+    state = pad_states[rid]
+    if action.kind == BUTTON:
+        bit = action.control
+        pressed = level >= 0.5
+        _cancel_repress(rid, bit)
+        if pressed == (state.wButtons & bit != 0): return
+        # A press not sent yet would be lost when released, send it first
+        if not pressed and sent_reports[rid].wButtons & bit == 0: _submit(rid)
+        if pressed:
+            state.wButtons |= bit
+        else:
+            state.wButtons &= ~bit
+    elif action.kind == TRIGGER:
+        _set_field(rid, action.control, round(level * 127))
+    else:
+        scale = 32768 if value < 0 else 32767
+        _set_field(rid, action.control, round(value * scale))
+
+    dirty.add(rid)
+
+def _cancel_repress(rid:int, bit:int):
+    ''' Cancel the scheduled re-press of a button, if there is one '''
+    global repressing
+
+    event = repressing.pop((rid, bit), None)
+    if event != None: scheduler.cancel(event)
+
+def _set_field(rid:int, field:str, value:int):
+    ''' Set an analog report field, making sure no unsent move gets lost '''
+    state = pad_states[rid]
+    sent  = sent_reports[rid]
+    # If the field is returning to the value last sent before its pending
+    # change is sent, the change would never be seen, so send it first
+    old = getattr(state, field)
+    if getattr(sent, field) != old and getattr(sent, field) == value:
+        _submit(rid)
+    setattr(state, field, value)
+
+def _submit(rid:int):
+    ''' Send the current state of a gamepad to ViGEm if it has changed '''
+    global dll, client, pads, pad_states, sent_reports
+
+    state = pad_states[rid]
+    if bytes(state) == bytes(sent_reports[rid]): return
+    dll.vigem_target_x360_update(client, pads[rid], state)
+    sent_reports[rid] = XUSB_REPORT.from_buffer_copy(state)
+
+def flush():
+    ''' Send every changed gamepad state to ViGEm in one report each '''
+    global dirty
+
+    for rid in dirty: _submit(rid)
+    dirty.clear()
+
+def report(rid:int) -> bytes:
+    ''' Return the XUSB_REPORT last sent to a gamepad, for statefile.py '''
+    global sent_reports
+    return bytes(sent_reports[rid])
 
 def init(devices):
     ''' Initialize ViGEm gamepads '''
@@ -121,11 +219,14 @@ def init(devices):
 
         # TODO Can't you initialize this in the struct
         pad_states[d] = XUSB_REPORT(0, 0, 0, 0, 0, 0, 0)
+        sent_reports[d] = XUSB_REPORT(0, 0, 0, 0, 0, 0, 0)
 
 def close():
     ''' Close and free ViGEm gamepad allocations '''
     global dll, client, pads
 
+    flush()
+
     for p in pads.values():
         dll.vigem_target_remove(client, p)
         dll.vigem_target_free(p)
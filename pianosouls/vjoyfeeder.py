@@ -7,6 +7,8 @@ import winreg
 import os.path
 from threading import Timer
 
+from .actions import Action, BUTTON, AXIS
+
 # TODO Currently has no capability to send POV switch updates
 
 # vJoy installation registry path
@@ -28,31 +30,54 @@ AXES = {
 dll = None
 
 
-def update(rid:int, action:str, value:int):
-    global dll
-
-    # Clamp between accepted values
-    value = max(value, 0)
-    value = min(value, 127)
-
-    real_value = value
-    real_action = action .replace('+','').replace('-','')
+def compile_action(rid:int, name:str) -> Action:
+    ''' Resolve action string name on device rid, ValueError if unknown '''
+    real_action = name.replace('+','').replace('-','')
 
-    if real_action.isdigit():
+    values = []
+    if real_action.isdigit() and 1 <= int(real_action) <= 128:
         # Buttons
-        real_action = int(action)
-        real_value = True if value > 0 else False
-        dll.SetBtn(real_value, rid, real_action)
+        for value in range(128):
+            values.append(True if value > 0 else False)
+        return Action(rid, name, BUTTON, int(real_action), tuple(values))
     elif real_action in AXES:
-        # Check for signed axis
-        if '-' in action:
-            real_value = 64 - ((value/2) + 1)
-        elif '+' in action:
-            real_value = 64 + ((value/2) - 1)
+        for value in range(128):
+            real_value = value
+            # Check for signed axis
+            if '-' in name:
+                real_value = 64 - ((value/2) + 1)
+            elif '+' in name:
+                real_value = 64 + ((value/2) - 1)
+            values.append(int(real_value) << 8)
+        return Action(rid, name, AXIS, AXES[real_action], tuple(values))
+
+    raise ValueError(f'Unknown vJoy action {name} on device {rid}')
+
+def update(action:Action, value:int):
+    global dll
 
-        dll.SetAxis(int(real_value) << 8, rid, AXES[real_action])
+    if action.kind == BUTTON:
+        dll.SetBtn(action.values[value], action.rid, action.control)
+    else:
+        dll.SetAxis(action.values[value], action.rid, action.control)
 
+def update_analog(action:Action, value:float):
+    ''' Set a vJoy control to an analog value from axes.py '''
+    global dll
 
+    if action.kind == BUTTON:
+        # Signed actions get 0-1 along their direction, others -1-1 across
+        # the whole range
+        pressed = value >= 0.5 if action.sign != 0 else value > 0
+        dll.SetBtn(pressed, action.rid, action.control)
+    else:
+        # vJoy axes go from 0 to 0x8000, middle at 0x4000
+        if action.sign < 0: value = -value
+        dll.SetAxis(int(0x4000 + value * 0x4000), action.rid, action.control)
+
+def flush():
+    ''' vJoy setters take effect immediately, nothing to send '''
+    return
 
 def init(devices) -> None:
     ''' Initialize vJoy '''
@@ -98,7 +123,7 @@ def init(devices) -> None:
     # Reset all axes to middle
     for d in devices:
         for x in AXES:
-            update(d, x, 64)
+            update(compile_action(d, x), 64)
 
     return
 
@@ -14,7 +14,10 @@ setuptools.setup(
     license = "GNU GPLv3",
     description = "MIDI notes and chords to virtual gamepad input",
     url = "https://github.com/tanskudaa/pianosouls",
-    install_requires = ['pygame'],
+    # Linux reads raw MIDI devices by default, pygame is only needed elsewhere
+    install_requires = ['pygame; platform_system != "Linux"'],
+    # Only the offline renderer uses NumPy
+    extras_require = {'render': ['numpy']},
     python_requires = '>= 3',
     entry_points = {
         'console_scripts': [
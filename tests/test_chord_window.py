@@ -0,0 +1,113 @@
+#
+# test_chord_window.py
+# Regression checks for presses held back by --chord-window
+#
+# Run from the repository root:
+# python -m unittest tests.test_chord_window
+#
+
+import unittest
+
+from pianosouls import pianosouls as core
+from pianosouls import config
+from pianosouls import matcher
+from pianosouls import actions
+from pianosouls import arbiter
+from pianosouls import scheduler
+from pianosouls import nullpad
+
+# Three levels of bindings, each extending the one before it
+CONFIG = [
+    'C, E       A',
+    'C, E, G    B',
+    'C          X',
+]
+WINDOW = 0.03
+
+# Output API stand-in recording (ms, action name, value) of every update
+class Recorder:
+    def __init__(self):
+        self.updates = []
+
+    def compile_action(self, rid:int, name:str) -> actions.Action:
+        return nullpad.compile_action(rid, name)
+
+    def update(self, action:actions.Action, value:int) -> None:
+        ms = round(scheduler.clock() * 1000)
+        self.updates.append((ms, action.name, value))
+
+    def flush(self) -> None:
+        return
+
+class ChordWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.clock = scheduler.clock
+        scheduler.clock = lambda: self.now
+        scheduler.clear()
+        arbiter.clear()
+        actions.stop()
+
+        self.output = Recorder()
+        core.apimod = self.output
+        actions.apimod = self.output
+        layers = matcher.compile_layers(*config.parse_layers(CONFIG))
+        index = matcher.resolve_layers(layers, actions.compile).indexes['']
+        core.BINDINGS = index
+        core.CH_STATE = {ch: core.MIDIChannelState() for ch in index}
+        core.PENDING.clear()
+        core.CHORD_WINDOW = WINDOW
+
+    def tearDown(self):
+        core.CHORD_WINDOW = 0
+        core.PENDING.clear()
+        scheduler.clear()
+        arbiter.clear()
+        scheduler.clock = self.clock
+
+    def advance(self, ms:int) -> None:
+        ''' Move the clock on by ms, running timed events due on the way '''
+        to = self.now + ms / 1000
+        while True:
+            due = scheduler.next_due()
+            if due == None or due > to: break
+            self.now = due
+            scheduler.run()
+        self.now = to
+
+    def play(self, *messages) -> None:
+        ''' Feed one batch of (status, note, velocity) messages right now '''
+        ms = round(self.now * 1000)
+        core.update_state([[[*m, 0], ms, 1] for m in messages])
+
+    def test_longer_binding_deferred_absorbs_shorter(self):
+        # C, E completes while C, E, G could still follow, so it's held back
+        # too, and C alone must not fire before it
+        self.play((0x90, 60, 90))
+        self.advance(5)
+        self.play((0x90, 64, 80))
+        self.advance(100)
+        self.assertEqual(self.output.updates, [(35, 'A', 80)])
+
+    def test_full_chord_presses_only_longest(self):
+        self.play((0x90, 60, 90))
+        self.advance(5)
+        self.play((0x90, 64, 80))
+        self.advance(5)
+        self.play((0x90, 67, 70))
+        self.advance(100)
+        self.assertEqual(self.output.updates, [(10, 'B', 70)])
+
+    def test_quick_tap_presses_only_chord(self):
+        self.play((0x90, 60, 90), (0x90, 64, 80))
+        self.advance(5)
+        self.play((0x80, 60, 0), (0x80, 64, 0))
+        self.assertEqual(self.output.updates, [(5, 'A', 80), (5, 'A', 0)])
+
+    def test_single_note_fires_after_window(self):
+        self.play((0x90, 60, 90))
+        self.advance(100)
+        self.assertEqual(self.output.updates, [(30, 'X', 90)])
+
+if __name__ == '__main__':
+    unittest.main()